@@ -1,6 +1,7 @@
 import streamlit as st
 import requests
 import time
+import json
 
 # --- Page Configuration ---
 # This sets the title of the browser tab, the icon, and uses the full screen width.
@@ -14,6 +15,33 @@ st.set_page_config(
 # This is the address of the FastAPI app you are running in Terminal 3
 API_URL = "http://127.0.0.1:8000"
 
+
+# --- Live progress helpers ---
+def iter_sse(response):
+    """Yields (event, data) pairs from a server-sent events response."""
+    event, data = "message", []
+    for line in response.iter_lines(decode_unicode=True):
+        if line is None:
+            continue
+        if line == "":
+            if data:
+                yield event, json.loads("\n".join(data))
+            event, data = "message", []
+        elif line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            data.append(line[len("data:"):].strip())
+
+
+def fetch_result(task_id, attempts=10, interval=1):
+    """Gets the final report once the job says it's done (the result may land a moment later)."""
+    for _ in range(attempts):
+        result = requests.get(f"{API_URL}/get-result/{task_id}").json()
+        if result.get("status") != "PENDING":
+            return result
+        time.sleep(interval)
+    return result
+
 # --- Main Page UI ---
 st.title("🧠 Project Cortex: Multi-Modal Video Analyzer")
 st.write("This application transcribes audio, reads on-screen text, and analyzes visual motion to create a comprehensive, time-aligned report of any video.")
@@ -64,12 +92,14 @@ if uploaded_file is not None:
                 }
                 
                 task_id = None
+                processing_id = None
                 try:
                     # Call your FastAPI server
                     response = requests.post(f"{API_URL}/process-video/", files=files, data=data)
                     
                     if response.status_code == 200:
                         task_id = response.json().get("task_id")
+                        processing_id = response.json().get("processing_id")
                         st.success(f"Processing started! Task ID: {task_id}")
                     else:
                         st.error(f"Error starting analysis: {response.status_code} - {response.text}")
@@ -83,39 +113,71 @@ if uploaded_file is not None:
                     st.error(f"An unexpected error occurred: {e}")
                     st.stop()
 
-                # 2. --- Poll the /get-result/ endpoint ---
+                # 2. --- Follow live progress, showing results as they arrive ---
                 if task_id:
-                    report_content = ""
-                    status = "PENDING"
-                    
-                    with st.spinner(f"Task {task_id} is running. This is the slow part. Polling for result..."):
-                        start_time = time.time()
-                        
-                        while status == "PENDING":
-                            elapsed = int(time.time() - start_time)
-                            st.text(f"Waiting for result... (Elapsed: {elapsed}s)")
-                            
-                            time.sleep(5) # Wait 5 seconds between checks
-                            try:
-                                poll_response = requests.get(f"{API_URL}/get-result/{task_id}")
-                                
-                                if poll_response.status_code == 200:
-                                    result = poll_response.json()
-                                    status = result.get("status")
-                                    
-                                    if status == "SUCCESS":
-                                        report_content = result.get("report_markdown")
-                                        st.session_state.report = report_content # Save to session state
-                                        st.balloons()
-                                    elif status == "FAILURE":
-                                        st.error(f"Task Failed: {result.get('message')}")
-                                        break
-                                else:
-                                    st.error("Failed to poll task status.")
+                    status_box = st.empty()
+                    bars = {}
+                    col_transcript, col_screen = st.columns(2)
+                    with col_transcript:
+                        st.subheader("🎙️ Transcript (live)")
+                        transcript_box = st.empty()
+                    with col_screen:
+                        st.subheader("🖥️ On screen (live)")
+                        screen_box = st.empty()
+                    transcript_lines = []
+                    screen_lines = []
+                    final_event = None
+
+                    try:
+                        with requests.get(f"{API_URL}/progress/{processing_id}", stream=True, timeout=(5, 120)) as stream:
+                            for event, payload in iter_sse(stream):
+                                stage = payload.get("stage", "")
+
+                                if event == "progress":
+                                    if stage not in bars:
+                                        bars[stage] = st.progress(0, text=stage)
+                                    eta = payload.get("eta_seconds")
+                                    label = f"{stage}: {payload['done']}/{payload['total']}"
+                                    if eta is not None:
+                                        label += f" (ETA {int(eta)}s)"
+                                    bars[stage].progress(min(payload["percent"], 100.0) / 100.0, text=label)
+                                    for item in payload.get("partial", []):
+                                        if "text" in item and item["text"]:
+                                            screen_lines.append(f"**{item['timestamp']:.0f}s** {item['text']}")
+                                        elif "description" in item:
+                                            screen_lines.append(f"**{item['timestamp']:.0f}s** _{item['description']}_")
+                                    screen_box.markdown("\n\n".join(screen_lines[-50:]))
+
+                                elif event == "partial" and "segments" in payload:
+                                    for seg in payload["segments"]:
+                                        transcript_lines.append(f"**{seg['start']:.0f}s** {seg['text'].strip()}")
+                                    transcript_box.markdown("\n\n".join(transcript_lines[-50:]))
+
+                                elif event in ("started", "completed"):
+                                    status_box.info(f"{stage}: {event}")
+
+                                elif event in ("done", "failed"):
+                                    final_event = (event, payload)
                                     break
-                            except Exception as poll_err:
-                                st.error(f"Error while polling: {poll_err}")
-                                break
+                    except Exception as stream_err:
+                        st.warning(f"Live progress unavailable ({stream_err}). Waiting for the result instead...")
+
+                    # 3. --- Fetch the final report (falls back to polling if live progress dropped) ---
+                    try:
+                        if final_event and final_event[0] == "failed":
+                            st.error(f"Task Failed in {final_event[1].get('stage')}: {final_event[1].get('error')}")
+                        else:
+                            if final_event:
+                                result = fetch_result(task_id)
+                            else:
+                                result = fetch_result(task_id, attempts=10**6, interval=5)
+                            if result.get("status") == "SUCCESS":
+                                st.session_state.report = result.get("report_markdown") # Save to session state
+                                st.balloons()
+                            else:
+                                st.error(f"Task Failed: {result.get('message')}")
+                    except Exception as poll_err:
+                        st.error(f"Error while fetching the result: {poll_err}")
 
 # --- Display the final report ---
 if st.session_state.report:
@@ -0,0 +1,150 @@
+import os
+import bisect
+import logging
+import subprocess
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+# Whisper expects 16 kHz mono float32 audio
+SAMPLE_RATE = 16000
+
+# --- Voice Activity Detection ---
+VAD_ENABLED = os.environ.get("CORTEX_VAD", "1") == "1"
+VAD_AGGRESSIVENESS = int(os.environ.get("CORTEX_VAD_AGGRESSIVENESS", 2))  # webrtcvad 0-3
+VAD_FRAME_MS = 30
+VAD_PAD_SECONDS = 0.3        # keep this much audio around each speech region
+VAD_MERGE_GAP_SECONDS = 0.6  # join regions separated by shorter pauses
+VAD_MIN_REGION_SECONDS = 0.25
+VAD_JOIN_SILENCE_SECONDS = 0.2  # silence inserted between regions so words don't run together
+# If (nearly) everything is speech, skip the cutting and remapping altogether
+VAD_MIN_SAVING = 0.1
+
+
+def load_audio(path: str, start: float = 0.0, duration: float = None):
+    """
+    Decodes the audio track of `path` (optionally only [start, start + duration) seconds)
+    to a 16 kHz mono float32 array with ffmpeg. The video stream is never decoded.
+    """
+    cmd = ["ffmpeg", "-nostdin", "-threads", "0"]
+    if start > 0:
+        cmd += ["-ss", f"{start:.3f}"]  # input seek: no need to decode what comes before
+    cmd += ["-i", path]
+    if duration is not None:
+        cmd += ["-t", f"{duration:.3f}"]
+    cmd += ["-vn", "-f", "s16le", "-ac", "1", "-acodec", "pcm_s16le", "-ar", str(SAMPLE_RATE), "-"]
+
+    try:
+        out = subprocess.run(cmd, capture_output=True, check=True).stdout
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(f"Failed to load audio from {path}: {e.stderr.decode(errors='ignore')}") from e
+
+    return np.frombuffer(out, np.int16).flatten().astype(np.float32) / 32768.0
+
+
+def _speech_frames_webrtc(audio):
+    import webrtcvad
+
+    vad = webrtcvad.Vad(VAD_AGGRESSIVENESS)
+    frame_len = SAMPLE_RATE * VAD_FRAME_MS // 1000
+    pcm = (np.clip(audio, -1.0, 1.0) * 32767).astype(np.int16)
+    n_frames = len(pcm) // frame_len
+    return np.array([
+        vad.is_speech(pcm[i * frame_len:(i + 1) * frame_len].tobytes(), SAMPLE_RATE)
+        for i in range(n_frames)
+    ], dtype=bool)
+
+
+def _speech_frames_energy(audio):
+    """Fallback VAD: frames well above the recording's own noise floor count as speech."""
+    frame_len = SAMPLE_RATE * VAD_FRAME_MS // 1000
+    n_frames = len(audio) // frame_len
+    if n_frames == 0:
+        return np.zeros(0, dtype=bool)
+
+    frames = audio[:n_frames * frame_len].reshape(n_frames, frame_len)
+    rms_db = 10 * np.log10(np.mean(frames ** 2, axis=1) + 1e-10)
+    noise_floor = np.percentile(rms_db, 10)
+    threshold = max(noise_floor + 12.0, -50.0)
+    return rms_db > threshold
+
+
+def detect_speech(audio):
+    """
+    Returns the speech regions of `audio` as a list of (start_seconds, end_seconds).
+    Uses webrtcvad when it is installed, otherwise an energy-based detector.
+    """
+    try:
+        speech = _speech_frames_webrtc(audio)
+    except ImportError:
+        speech = _speech_frames_energy(audio)
+
+    frame_sec = VAD_FRAME_MS / 1000.0
+    total = len(audio) / SAMPLE_RATE
+
+    # Run boundaries of consecutive speech frames
+    edges = np.diff(np.concatenate(([0], speech.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1) * frame_sec
+    ends = np.flatnonzero(edges == -1) * frame_sec
+
+    regions = []
+    for start, end in zip(starts, ends):
+        start = max(0.0, start - VAD_PAD_SECONDS)
+        end = min(total, end + VAD_PAD_SECONDS)
+        if regions and start - regions[-1][1] < VAD_MERGE_GAP_SECONDS:
+            regions[-1] = (regions[-1][0], end)
+        else:
+            regions.append((start, end))
+
+    return [(float(s), float(e)) for s, e in regions if e - s >= VAD_MIN_REGION_SECONDS]
+
+
+def keep_speech(audio):
+    """
+    Cuts non-speech out of `audio`.
+    Returns (speech_audio, timeline), where `timeline` is a list of
+    (start_in_speech_audio, start_in_original, duration) used by remap_result().
+    When VAD is off or wouldn't save much, returns the audio unchanged and timeline None.
+    """
+    total = len(audio) / SAMPLE_RATE
+    if not VAD_ENABLED or total == 0:
+        return audio, None
+
+    regions = detect_speech(audio)
+    speech_seconds = sum(e - s for s, e in regions)
+    if speech_seconds >= total * (1 - VAD_MIN_SAVING):
+        return audio, None
+
+    gap = np.zeros(int(VAD_JOIN_SILENCE_SECONDS * SAMPLE_RATE), dtype=np.float32)
+    pieces = []
+    timeline = []
+    cursor = 0.0
+    for start, end in regions:
+        piece = audio[int(start * SAMPLE_RATE):int(end * SAMPLE_RATE)]
+        timeline.append((cursor, start, len(piece) / SAMPLE_RATE))
+        pieces.extend((piece, gap))
+        cursor += (len(piece) + len(gap)) / SAMPLE_RATE
+
+    speech_audio = np.concatenate(pieces) if pieces else np.zeros(0, dtype=np.float32)
+    return speech_audio, timeline
+
+
+def remap_time(t: float, timeline: list, starts: list) -> float:
+    """Maps a time in the speech-only audio back onto the original timeline."""
+    i = max(0, bisect.bisect_right(starts, t) - 1)
+    cut_start, orig_start, duration = timeline[i]
+    return orig_start + min(max(t - cut_start, 0.0), duration)
+
+
+def remap_result(result: dict, timeline: list) -> dict:
+    """Moves every segment and word timestamp in a Whisper result back to the original timeline."""
+    if not timeline:
+        return result
+    starts = [cut_start for cut_start, _, _ in timeline]
+    for seg in result.get("segments", []):
+        seg["start"] = remap_time(seg["start"], timeline, starts)
+        seg["end"] = remap_time(seg["end"], timeline, starts)
+        for word in seg.get("words", []):
+            word["start"] = remap_time(word["start"], timeline, starts)
+            word["end"] = remap_time(word["end"], timeline, starts)
+    return result
@@ -0,0 +1,378 @@
+"""
+Benchmark for the five-module pipeline on synthetic videos.
+
+Generates a test video locally (text slides + speech-like audio), runs every task from
+tasks.py in-process in pipeline order with stubbed Gemini / Groq backends, and reports
+wall time, CPU time, frames/sec and peak RSS (worker + subprocesses such as tesseract
+and ffmpeg) per stage. Results are saved as JSON so later runs can be compared:
+
+    python benchmark.py --duration 120 --resolution 1280x720
+    python benchmark.py --duration 120 --compare benchmark_results/<earlier run>.json
+
+Needs ffmpeg and tesseract on PATH, like the worker itself. No API keys, Redis or
+network access are required: Gemini is replaced by a local HTTP stub (so the real
+async client, rate limiting included, is exercised) and ChatGroq by a fake chat model.
+"""
+import os
+import sys
+import json
+import time
+import wave
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+import numpy as np
+import psutil
+
+log = logging.getLogger("benchmark")
+
+RESULTS_DIR = "benchmark_results"
+AUDIO_RATE = 16000
+STUB_VISION_LATENCY_SECONDS = 0.2
+STUB_LLM_LATENCY_SECONDS = 0.5
+RSS_SAMPLE_SECONDS = 0.05
+# A stage is flagged when it gets slower than the baseline by more than this fraction
+DEFAULT_TOLERANCE = 0.20
+
+WORDS = ("cortex", "pipeline", "latency", "throughput", "whisper", "tesseract", "gemini",
+         "frame", "module", "worker", "shard", "cache", "fusion", "report", "benchmark")
+
+
+# --- Synthetic video ---
+
+def _slide(index: int, width: int, height: int, rng: np.random.Generator) -> np.ndarray:
+    """One slide: a title and a few lines of text; every other slide is light-on-dark."""
+    dark = index % 2 == 1
+    frame = np.full((height, width, 3), 30 if dark else 235, dtype=np.uint8)
+    color = (235, 235, 235) if dark else (20, 20, 20)
+    scale = height / 720
+    cv2.putText(frame, f"Slide {index + 1}", (int(60 * scale), int(110 * scale)),
+                cv2.FONT_HERSHEY_SIMPLEX, 2.0 * scale, color, max(1, int(4 * scale)), cv2.LINE_AA)
+    for line in range(4):
+        text = " ".join(rng.choice(WORDS, size=5))
+        cv2.putText(frame, text, (int(60 * scale), int((220 + 90 * line) * scale)),
+                    cv2.FONT_HERSHEY_SIMPLEX, 1.2 * scale, color, max(1, int(2 * scale)), cv2.LINE_AA)
+    return frame
+
+
+def _speech_like_audio(duration: float, rng: np.random.Generator) -> np.ndarray:
+    """
+    Tones with a syllable-rate envelope and a wandering pitch, in 'utterances' of a few
+    seconds separated by pauses - enough for VAD to find speech regions and silences.
+    """
+    n = int(duration * AUDIO_RATE)
+    t = np.arange(n) / AUDIO_RATE
+    pitch = 140 + 40 * np.sin(2 * np.pi * 0.3 * t)
+    phase = 2 * np.pi * np.cumsum(pitch) / AUDIO_RATE
+    voice = np.sin(phase) + 0.5 * np.sin(2 * phase) + 0.25 * np.sin(3 * phase)
+    syllables = 0.5 * (1 + np.sin(2 * np.pi * 4.0 * t))
+
+    gate = np.zeros(n)
+    position = 0.0
+    while position < duration:
+        talk = rng.uniform(2.0, 6.0)
+        gate[int(position * AUDIO_RATE):int(min(duration, position + talk) * AUDIO_RATE)] = 1.0
+        position += talk + rng.uniform(0.5, 2.0)
+
+    audio = 0.3 * voice * syllables * gate + 0.003 * rng.standard_normal(n)
+    return (np.clip(audio, -1, 1) * 32767).astype(np.int16)
+
+
+def generate_video(path: str, duration: float, width: int, height: int, fps: float,
+                   slide_seconds: float, seed: int = 0) -> str:
+    """Renders the slides with OpenCV, then muxes in the audio with ffmpeg (H.264 + AAC)."""
+    rng = np.random.default_rng(seed)
+    workdir = tempfile.mkdtemp(prefix="cortex-bench-")
+    try:
+        silent_path = os.path.join(workdir, "video.avi")
+        writer = cv2.VideoWriter(silent_path, cv2.VideoWriter_fourcc(*"MJPG"), fps, (width, height))
+        if not writer.isOpened():
+            raise RuntimeError("OpenCV could not open a video writer.")
+        frames_per_slide = max(1, int(round(slide_seconds * fps)))
+        slide = None
+        for i in range(int(round(duration * fps))):
+            if i % frames_per_slide == 0:
+                slide = _slide(i // frames_per_slide, width, height, rng)
+            writer.write(slide)
+        writer.release()
+
+        audio_path = os.path.join(workdir, "audio.wav")
+        with wave.open(audio_path, "wb") as w:
+            w.setnchannels(1)
+            w.setsampwidth(2)
+            w.setframerate(AUDIO_RATE)
+            w.writeframes(_speech_like_audio(duration, rng).tobytes())
+
+        subprocess.run([
+            "ffmpeg", "-nostdin", "-y", "-loglevel", "error",
+            "-i", silent_path, "-i", audio_path,
+            "-c:v", "libx264", "-preset", "veryfast", "-pix_fmt", "yuv420p",
+            "-c:a", "aac", "-shortest", path
+        ], check=True)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return path
+
+
+# --- Stubbed backends ---
+
+class _GeminiStubHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("content-length", 0)))
+        time.sleep(STUB_VISION_LATENCY_SECONDS)
+        body = json.dumps({"candidates": [{"content": {"parts": [
+            {"text": "A slide with a title and several lines of text."}
+        ]}}]}).encode()
+        self.send_response(200)
+        self.send_header("content-type", "application/json")
+        self.send_header("content-length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_gemini_stub() -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _GeminiStubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class _StubResponse:
+    def __init__(self, prompt: str):
+        self.content = f"## Stub report\n{len(prompt)} prompt characters summarized."
+        self.usage_metadata = {"input_tokens": len(prompt) // 4, "output_tokens": 64}
+
+
+class StubChatGroq:
+    """Stands in for langchain_groq.ChatGroq: a fixed latency per call, no network."""
+
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+
+    def batch(self, prompts, config=None):
+        time.sleep(STUB_LLM_LATENCY_SECONDS)
+        return [_StubResponse(prompt) for prompt in prompts]
+
+
+# --- Measurement ---
+
+class PeakRSS:
+    """Samples the RSS of this process plus its children in the background; .peak_mb is the maximum."""
+
+    def __init__(self):
+        self.process = psutil.Process()
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _current(self) -> int:
+        total = self.process.memory_info().rss
+        for child in self.process.children(recursive=True):
+            try:
+                total += child.memory_info().rss
+            except psutil.Error:
+                pass
+        return total
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self._current())
+            self._stop.wait(RSS_SAMPLE_SECONDS)
+
+    def __enter__(self):
+        self.peak = self._current()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    @property
+    def peak_mb(self) -> float:
+        return round(self.peak / 2**20, 1)
+
+
+def _cpu_seconds(process: psutil.Process) -> float:
+    times = process.cpu_times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+def run_stage(stages: list, name: str, fn, *args):
+    """Runs one task in-process and records its wall time, CPU time and peak RSS."""
+    process = psutil.Process()
+    cpu_before = _cpu_seconds(process)
+    started = time.perf_counter()
+    with PeakRSS() as rss:
+        result = fn(*args)
+    wall = time.perf_counter() - started
+    stages.append({
+        "stage": name,
+        "wall_s": round(wall, 3),
+        "cpu_s": round(_cpu_seconds(process) - cpu_before, 3),
+        "peak_rss_mb": rss.peak_mb,
+    })
+    log.info(f"{name}: {wall:.2f}s wall, peak RSS {rss.peak_mb} MB")
+    return result
+
+
+def run_pipeline(video_path: str, workdir: str) -> dict:
+    """Runs Modules 1-5 on `video_path` the way the chord would, one task after another."""
+    import tasks
+    tasks.ChatGroq = StubChatGroq
+
+    context = {
+        "processing_id": f"bench-{int(time.time())}",
+        # Absolute, so the tasks read it in place (a relative ref would be a store key)
+        "paths": {"original": os.path.abspath(video_path)},
+        "api_keys": {"gemini": "benchmark", "groq": "benchmark"},
+    }
+    stages = []
+    started = time.perf_counter()
+    with PeakRSS() as rss:
+        run_stage(stages, "whisper_load", tasks.whisper_backend.get_model)
+        transcribed = run_stage(stages, "transcribe_video", tasks.transcribe_video, dict(context))
+        sampled = run_stage(stages, "sample_frames", tasks.sample_frames, dict(context))
+        ocr = run_stage(stages, "extract_static_data", tasks.extract_static_data, dict(sampled))
+        motion = run_stage(stages, "describe_motion", tasks.describe_motion, dict(sampled))
+        merged = run_stage(stages, "merge_contexts", tasks.merge_contexts, [transcribed, [ocr, motion]])
+        fused = run_stage(stages, "fuse_data", tasks.fuse_data, merged)
+        final = run_stage(stages, "synthesize_knowledge", tasks.synthesize_knowledge, fused)
+    total = time.perf_counter() - started
+
+    video = final.get("video") or {}
+    stats = final.get("stats", {})
+    by_stage = {s["stage"]: s for s in stages}
+    decode = by_stage["sample_frames"]["wall_s"]
+    ocr_runs = stats.get("ocr", {}).get("ocr_runs", 0)
+    return {
+        "total_wall_s": round(total, 3),
+        "peak_rss_mb": rss.peak_mb,
+        "realtime_factor": round(video.get("duration", 0) / total, 2) if total else None,
+        "decode_fps": round(video.get("frame_count", 0) / decode, 1) if decode else None,
+        "ocr_fps": round(ocr_runs / by_stage["extract_static_data"]["wall_s"], 2) if ocr_runs else None,
+        "stages": stages,
+        "spans": final.get("timings", {}),
+        "stats": stats,
+    }
+
+
+def compare(result: dict, baseline: dict, tolerance: float) -> list:
+    """Prints stage-by-stage deltas against `baseline`; returns the stages that regressed."""
+    base_stages = {s["stage"]: s for s in baseline.get("stages", [])}
+    regressions = []
+    print(f"\n{'stage':<24}{'baseline s':>12}{'now s':>10}{'delta':>9}")
+    for stage in result["stages"] + [{"stage": "TOTAL", "wall_s": result["total_wall_s"]}]:
+        if stage["stage"] == "TOTAL":
+            before = baseline.get("total_wall_s")
+        else:
+            before = base_stages.get(stage["stage"], {}).get("wall_s")
+        if not before:
+            print(f"{stage['stage']:<24}{'-':>12}{stage['wall_s']:>10.2f}")
+            continue
+        change = (stage["wall_s"] - before) / before
+        flag = ""
+        # Sub-second stages are mostly noise, only flag meaningful slowdowns
+        if change > tolerance and stage["wall_s"] - before > 0.5:
+            flag = "  REGRESSION"
+            regressions.append(stage["stage"])
+        print(f"{stage['stage']:<24}{before:>12.2f}{stage['wall_s']:>10.2f}{change:>+9.0%}{flag}")
+    return regressions
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the Cortex pipeline on a synthetic video.")
+    parser.add_argument("--duration", type=float, default=60.0, help="video length in seconds")
+    parser.add_argument("--resolution", default="1280x720", help="WIDTHxHEIGHT")
+    parser.add_argument("--fps", type=float, default=30.0)
+    parser.add_argument("--slide-seconds", type=float, default=5.0, help="how long each text slide stays up")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--video", help="benchmark this file instead of generating one")
+    parser.add_argument("--label", default="", help="name for this run in the results file")
+    parser.add_argument("--output-dir", default=RESULTS_DIR)
+    parser.add_argument("--compare", help="baseline results JSON; exits 1 if a stage regressed")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    width, height = (int(v) for v in args.resolution.lower().split("x"))
+
+    workdir = tempfile.mkdtemp(prefix="cortex-bench-")
+    stub = start_gemini_stub()
+    # Before tasks is imported: module-level settings are read from the environment then
+    os.environ["CORTEX_GEMINI_API_BASE"] = f"http://127.0.0.1:{stub.server_port}"
+    os.environ["CORTEX_STORAGE_DIR"] = os.path.join(workdir, "storage")  # always a cold cache
+    # Progress events are best-effort and there may be no Redis here
+    logging.getLogger("progress").setLevel(logging.ERROR)
+
+    try:
+        if args.video:
+            video_path = args.video
+        else:
+            video_path = os.path.join(workdir, "synthetic.mp4")
+            started = time.perf_counter()
+            generate_video(video_path, args.duration, width, height, args.fps, args.slide_seconds, args.seed)
+            log.info(f"Generated {args.duration:.0f}s {width}x{height} video in {time.perf_counter() - started:.1f}s")
+
+        result = run_pipeline(video_path, workdir)
+    finally:
+        stub.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    import whisper_backend
+    import ocr_engine
+    result = {
+        "label": args.label,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": _git_commit(),
+        "video": {"generated": not args.video, "duration": args.duration, "resolution": args.resolution,
+                  "fps": args.fps, "slide_seconds": args.slide_seconds, "seed": args.seed,
+                  "path": args.video},
+        "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                        "cpus": os.cpu_count(), "whisper_model": whisper_backend.WHISPER_MODEL_NAME,
+                        "whisper_backend": whisper_backend.WHISPER_BACKEND, "ocr_workers": ocr_engine.OCR_WORKERS},
+        **result,
+    }
+
+    print(f"\n{'stage':<24}{'wall s':>9}{'cpu s':>9}{'peak RSS MB':>13}")
+    for stage in result["stages"]:
+        print(f"{stage['stage']:<24}{stage['wall_s']:>9.2f}{stage['cpu_s']:>9.2f}{stage['peak_rss_mb']:>13.1f}")
+    print(f"{'TOTAL':<24}{result['total_wall_s']:>9.2f}{'':>9}{result['peak_rss_mb']:>13.1f}")
+    print(f"realtime factor {result['realtime_factor']}x, decode {result['decode_fps']} fps, OCR {result['ocr_fps']} frames/s")
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    name = f"{result['timestamp'].replace(':', '')}{'-' + args.label if args.label else ''}.json"
+    output_path = os.path.join(args.output_dir, name)
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    print(f"Saved results to {output_path}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            regressions = compare(result, json.load(f), args.tolerance)
+        if regressions:
+            print(f"Regressed: {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
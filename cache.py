@@ -0,0 +1,158 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+import storage
+
+log = logging.getLogger(__name__)
+
+# --- Content-addressed artifact cache ---
+# Every module's output lives in CACHE_DIR/<key>/, where <key> hashes the module name,
+# its parameters and the keys of its inputs (ultimately the video's content hash).
+# The same video with the same settings therefore maps to the same artifacts, no matter
+# what the upload was called or how many times the job is retried.
+# Entries are the store's "cache/<key>/" prefix (see storage.py): committed entries are
+# published to the store, and entries another node committed are pulled in on lookup, so
+# CACHE_DIR doubles as this node's read-through cache of the store.
+CACHE_PREFIX = "cache"
+CACHE_DIR = os.path.join(storage.LOCAL_ROOT, CACHE_PREFIX)
+CACHE_MAX_BYTES = int(float(os.environ.get("CORTEX_CACHE_MAX_GB", 20)) * 2**30)
+# Entries used (looked up or read through fetch()) this recently are never evicted, even
+# over budget: a running job may still read them, and with the local store the cache is
+# the only copy. Keep it above the longest a job can run (see pipeline.TIME_LIMITS).
+CACHE_PIN_SECONDS = float(os.environ.get("CORTEX_CACHE_PIN_SECONDS", 6 * 3600))
+# Bump to invalidate every cached artifact after a change to a module's output
+CACHE_VERSION = 2
+
+COMPLETE_MARKER = ".complete"
+HASH_CHUNK_BYTES = 4 * 2**20
+
+os.makedirs(CACHE_DIR, exist_ok=True)
+
+_digests = {}
+
+
+def file_digest(path: str) -> str:
+    """SHA-256 of a file's bytes (memoized per process on path, size and mtime)."""
+    stat = os.stat(path)
+    memo_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if memo_key not in _digests:
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_BYTES), b""):
+                h.update(chunk)
+        _digests[memo_key] = h.hexdigest()
+    return _digests[memo_key]
+
+
+def make_key(module: str, params: dict, inputs: list) -> str:
+    """Cache key for `module` run with `params` on the artifacts identified by `inputs`."""
+    payload = json.dumps(
+        {"v": CACHE_VERSION, "module": module, "params": params, "inputs": inputs},
+        sort_keys=True, default=str
+    )
+    return f"{module}-{hashlib.sha256(payload.encode('utf-8')).hexdigest()[:32]}"
+
+
+def _entry_dir(key: str) -> str:
+    return os.path.join(CACHE_DIR, key)
+
+
+def ref(key: str, name: str) -> str:
+    """Store reference of artifact `name` in entry `key` (what goes into context["paths"])."""
+    return f"{CACHE_PREFIX}/{key}/{name}"
+
+
+def lookup(key: str, name: str):
+    """
+    Returns the store reference of artifact `name` of a completed entry, or None.
+    An entry committed by another node is downloaded first, so storage.fetch() on the
+    reference is then local. Marks the entry recently used.
+    """
+    entry = _entry_dir(key)
+    marker = os.path.join(entry, COMPLETE_MARKER)
+    if not os.path.exists(marker):
+        entry_ref = f"{CACHE_PREFIX}/{key}"
+        if not (storage.STORE.remote and storage.STORE.exists(f"{entry_ref}/{COMPLETE_MARKER}")):
+            return None
+        shutil.rmtree(entry, ignore_errors=True)  # a local leftover of an unfinished write
+        storage.STORE.fetch(entry_ref)
+    if not os.path.exists(os.path.join(entry, name)):
+        return None
+    os.utime(marker)
+    return ref(key, name)
+
+
+def touch(artifact_ref: str):
+    """Marks the cache entry `artifact_ref` belongs to (if any) recently used."""
+    parts = artifact_ref.split("/")
+    if len(parts) < 2 or parts[0] != CACHE_PREFIX:
+        return
+    try:
+        os.utime(os.path.join(_entry_dir(parts[1]), COMPLETE_MARKER))
+    except FileNotFoundError:
+        pass
+
+
+def fetch(artifact_ref: str) -> str:
+    """storage.fetch() for tasks: also marks the cache entry being read recently used."""
+    path = storage.fetch(artifact_ref)
+    touch(artifact_ref)
+    return path
+
+
+def artifact_path(key: str, name: str) -> str:
+    """Where a task should write artifact `name` for `key`. Call commit(key) once all are written."""
+    entry = _entry_dir(key)
+    os.makedirs(entry, exist_ok=True)
+    return os.path.join(entry, name)
+
+
+def commit(key: str):
+    """Marks the entry complete, publishes it to the store, and evicts old local entries if over budget."""
+    with open(os.path.join(_entry_dir(key), COMPLETE_MARKER), 'w') as f:
+        f.write(str(time.time()))
+    # The marker goes up last: other nodes only see an entry once all of it is there
+    storage.STORE.put(f"{CACHE_PREFIX}/{key}", last=COMPLETE_MARKER)
+    evict(keep=key)
+
+
+def _entry_size(entry: str) -> int:
+    total = 0
+    for root, _, files in os.walk(entry):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def evict(keep: str = None, max_bytes: int = CACHE_MAX_BYTES):
+    """
+    Deletes least-recently-used entries until the cache fits in `max_bytes`. Entries used
+    in the last CACHE_PIN_SECONDS are kept regardless.
+    """
+    pinned_since = time.time() - CACHE_PIN_SECONDS
+    entries = []
+    for key in os.listdir(CACHE_DIR):
+        entry = _entry_dir(key)
+        marker = os.path.join(entry, COMPLETE_MARKER)
+        if not os.path.isdir(entry) or not os.path.exists(marker):
+            continue  # still being written
+        entries.append((os.path.getmtime(marker), key, _entry_size(entry)))
+
+    total = sum(size for _, _, size in entries)
+    for used_at, key, size in sorted(entries):
+        if total <= max_bytes:
+            break
+        if key == keep:
+            continue
+        if used_at >= pinned_since:
+            log.warning(f"Cache over budget ({total / 2**30:.2f} GB), but the remaining entries are in use")
+            break
+        log.info(f"Cache over budget ({total / 2**30:.2f} GB), evicting {key}")
+        shutil.rmtree(_entry_dir(key), ignore_errors=True)
+        total -= size
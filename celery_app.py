@@ -1,4 +1,6 @@
+import os
 from celery import Celery
+from kombu import Queue
 
 # Assumes Redis is running on localhost, default port 6379
 # The broker is the transport, the backend is for storing results.
@@ -13,6 +15,55 @@ celery = Celery(
     include=['tasks']  # Explicitly tell Celery where to find our tasks file
 )
 
+# --- Queues ---
+# Tasks are routed by resource profile, so API-bound tasks never wait behind CPU-bound ones:
+#   cpu     - Whisper, frame decoding, Tesseract: a few long, core-hungry tasks per machine
+#   io      - Gemini / Groq calls: mostly waiting on the network, many at once
+#   default - the small bookkeeping tasks between stages (merge, stitch, fusion)
+TASK_ROUTES = {
+    'tasks.transcribe_video': {'queue': 'cpu'},
+    'tasks.sample_frames': {'queue': 'cpu'},
+    'tasks.extract_static_data': {'queue': 'cpu'},
+    'tasks.describe_motion': {'queue': 'io'},
+    'tasks.synthesize_knowledge': {'queue': 'io'},
+    'tasks.merge_contexts': {'queue': 'default'},
+    'tasks.stitch_shards': {'queue': 'default'},
+    'tasks.fuse_data': {'queue': 'default'},
+}
+
+# --- CPU budget ---
+# cpu tasks are parallel themselves (an OCR task runs several Tesseract processes, Whisper
+# runs PyTorch / CTranslate2 threads), so the cpu pool is kept small and every task gets
+# its share of the cores: CPU_CONCURRENCY tasks x CPU_THREADS_PER_TASK threads ~= cores.
+# (A pool of one task per core, each using every core, would run cores^2 threads.)
+CPU_COUNT = os.cpu_count() or 1
+CPU_CONCURRENCY = int(os.environ.get('CORTEX_CPU_CONCURRENCY', max(1, CPU_COUNT // 4)))
+CPU_THREADS_PER_TASK = max(1, CPU_COUNT // CPU_CONCURRENCY)
+
+# Worker settings per queue. Start one worker per profile, e.g.
+#   CORTEX_WORKER_PROFILE=cpu celery -A celery_app.celery worker -n cpu@%h
+# (command-line options such as -c / -P still override these). Without a profile a
+# worker consumes every queue with Celery's defaults, which is what `-P solo` in dev wants.
+WORKER_PROFILES = {
+    'cpu': {
+        'pool': 'prefork',
+        'concurrency': CPU_CONCURRENCY,  # see CPU budget above
+        # Long tasks: don't reserve work another idle worker could start now
+        'prefetch_multiplier': 1,
+    },
+    'io': {
+        'pool': 'threads',
+        'concurrency': int(os.environ.get('CORTEX_IO_CONCURRENCY', 32)),
+        'prefetch_multiplier': 4,
+    },
+    'default': {
+        'pool': 'prefork',
+        'concurrency': int(os.environ.get('CORTEX_DEFAULT_CONCURRENCY', 2)),
+        'prefetch_multiplier': 1,
+    },
+}
+WORKER_PROFILE = os.environ.get('CORTEX_WORKER_PROFILE')
+
 # Optional configuration
 celery.conf.update(
     task_serializer='json',
@@ -20,7 +71,30 @@ celery.conf.update(
     result_serializer='json',
     timezone='UTC',
     enable_utc=True,
+    task_queues=[Queue(name) for name in WORKER_PROFILES],
+    task_default_queue='default',
+    task_routes=TASK_ROUTES,
+    # Job priorities (see scheduling.py): Redis keeps one list per step, lower is served first
+    broker_transport_options={'priority_steps': list(range(10)), 'sep': ':', 'queue_order_strategy': 'priority'},
+    task_default_priority=3,
 )
 
+if WORKER_PROFILE:
+    if WORKER_PROFILE not in WORKER_PROFILES:
+        raise ValueError(f"Unknown CORTEX_WORKER_PROFILE '{WORKER_PROFILE}', expected one of {sorted(WORKER_PROFILES)}.")
+    profile = WORKER_PROFILES[WORKER_PROFILE]
+    celery.conf.update(
+        task_queues=[Queue(WORKER_PROFILE)],  # consume only this profile's queue
+        worker_pool=profile['pool'],
+        worker_concurrency=profile['concurrency'],
+        worker_prefetch_multiplier=profile['prefetch_multiplier'],
+    )
+
+
+def consumes_task(task_name: str) -> bool:
+    """Whether this worker's profile consumes the queue `task_name` is routed to (no profile: all of them)."""
+    return not WORKER_PROFILE or TASK_ROUTES[task_name]['queue'] == WORKER_PROFILE
+
+
 if __name__ == '__main__':
-    celery.start()
\ No newline at end of file
+    celery.start()
@@ -0,0 +1,216 @@
+import os
+import json
+import time
+import uuid
+import socket
+import logging
+import storage
+
+log = logging.getLogger(__name__)
+
+# --- Result checkpoints ---
+# Per-frame results (OCR lines, Gemini descriptions) are appended to a JSON Lines file as
+# they arrive, instead of living in a list until the task ends. Memory stays flat however
+# long the video is, and a task that dies halfway loses nothing: the next job computing
+# the same artifact (the video submitted again, or re-run; logs are named after the cache
+# key) reopens the log and only processes the frames that aren't in it yet. Tasks aren't
+# retried automatically (no acks_late / autoretry_for), so resuming takes a new job.
+# Logs live in the store under "checkpoints/", uploaded every CHECKPOINT_UPLOAD_SECONDS
+# (and when the task stops) so a job on another node can resume too.
+# Only one task at a time writes a shared log: it holds "<log>.lock" (created with O_EXCL,
+# so it works on every OS). Another job computing the same artifact at the same time
+# (a duplicate upload) writes a private log of its own instead. A lock whose process is
+# gone (same host), or that hasn't been refreshed for LOCK_STALE_SECONDS, belonged to a
+# task that died and is taken over.
+CHECKPOINT_PREFIX = "checkpoints"
+CHECKPOINT_UPLOAD_SECONDS = float(os.environ.get("CORTEX_CHECKPOINT_UPLOAD_SECONDS", 30))
+LOCK_STALE_SECONDS = float(os.environ.get("CORTEX_CHECKPOINT_LOCK_STALE_SECONDS", 600))
+LOCK_REFRESH_SECONDS = 10
+
+
+class ResultLog:
+    """
+    Append-only JSON Lines log of {"timestamp": seconds, "result": ...} records.
+
+    Only each record's byte offset is kept in memory; get() reads results back from disk.
+    Opening a log that already exists resumes it: a torn last line (the writer died
+    mid-write) is dropped, and every complete record counts as done. While another task
+    holds the log, this one gets a private, empty log (`shared` is False) instead.
+
+    Usage:
+        with ResultLog(f"ocr-{key}") as results:   # close()d on the way out
+            pending = [s for s in samples if s["timestamp"] not in results]
+            ...
+            results.append(timestamp, lines)
+            ...
+            results.discard()   # once the final artifact is written
+    """
+
+    def __init__(self, name: str):
+        self.ref = f"{CHECKPOINT_PREFIX}/{name}.jsonl"
+        self.path = storage.STORE.local_path(self.ref)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._lock_path = f"{self.path}.lock"
+        self.shared = self._acquire()
+        if not self.shared:
+            log.info(f"Checkpoint {self.ref} is in use by another task, writing a private log")
+            self.ref = None
+            self.path = f"{self.path}.{uuid.uuid4().hex}"
+        elif not os.path.exists(self.path):
+            try:
+                storage.STORE.fetch(self.ref)
+            except FileNotFoundError:
+                pass
+
+        self._offsets = {}
+        self._size = 0
+        if os.path.exists(self.path):
+            self._scan()
+        self.resumed = len(self._offsets)
+        self._file = open(self.path, "ab")
+        self._reader = None
+        self._dirty = False
+        self._uploaded_at = time.monotonic()
+        self._locked_at = time.monotonic()
+        self._closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _holder_alive(self) -> bool:
+        """Whether the lock was refreshed lately and, if it was taken on this host, whether its
+        process still runs."""
+        if time.time() - os.path.getmtime(self._lock_path) >= LOCK_STALE_SECONDS:
+            return False
+        with open(self._lock_path, "r") as f:
+            holder = f.read().split()
+        if len(holder) < 2 or holder[0] != socket.gethostname() or os.name != "posix":
+            return True  # not written yet, or another host's
+        try:
+            os.kill(int(holder[1]), 0)
+        except ProcessLookupError:
+            return False
+        except (PermissionError, ValueError):
+            pass
+        return True
+
+    def _acquire(self) -> bool:
+        """Takes the log's lock (or a dead task's over); False while a live task holds it."""
+        for _ in range(2):
+            try:
+                fd = os.open(self._lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                try:
+                    if self._holder_alive():
+                        return False
+                    # Rename first: of several tasks taking over, only one wins the rename
+                    stale = f"{self._lock_path}.{uuid.uuid4().hex}"
+                    os.rename(self._lock_path, stale)
+                    os.remove(stale)
+                    log.warning(f"Took over the checkpoint lock {self._lock_path} of a task that died")
+                except FileNotFoundError:
+                    pass  # released or taken over meanwhile; try again
+                continue
+            with os.fdopen(fd, "w") as f:
+                f.write(f"{socket.gethostname()} {os.getpid()} {time.time()}")
+            return True
+        return False
+
+    def _refresh_lock(self):
+        if self.shared and time.monotonic() - self._locked_at >= LOCK_REFRESH_SECONDS:
+            os.utime(self._lock_path)
+            self._locked_at = time.monotonic()
+
+    def _release(self):
+        if self.shared:
+            try:
+                os.remove(self._lock_path)
+            except FileNotFoundError:
+                pass
+
+    def _scan(self):
+        with open(self.path, "r+b") as f:
+            for line in f:
+                try:
+                    record = json.loads(line) if line.endswith(b"\n") else None
+                except ValueError:
+                    record = None
+                if record is None:
+                    break
+                self._offsets[record["timestamp"]] = self._size
+                self._size += len(line)
+            f.truncate(self._size)
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def __contains__(self, timestamp: float):
+        return timestamp in self._offsets
+
+    def append(self, timestamp: float, result):
+        line = json.dumps({"timestamp": timestamp, "result": result}, separators=(",", ":"), ensure_ascii=False)
+        data = line.encode("utf-8") + b"\n"
+        self._file.write(data)
+        self._file.flush()
+        self._offsets[timestamp] = self._size
+        self._size += len(data)
+        self._dirty = True
+        self._refresh_lock()
+        if time.monotonic() - self._uploaded_at >= CHECKPOINT_UPLOAD_SECONDS:
+            self.upload()
+
+    def get(self, timestamp: float, default=None):
+        offset = self._offsets.get(timestamp)
+        if offset is None:
+            return default
+        if self._reader is None:
+            self._reader = open(self.path, "rb")
+        self._reader.seek(offset)
+        return json.loads(self._reader.readline())["result"]
+
+    def upload(self):
+        """Publishes the log to the store (a no-op for the local store and private logs)."""
+        if self._dirty and self.shared:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            storage.STORE.put(self.ref)
+            self._dirty = False
+        self._uploaded_at = time.monotonic()
+
+    def close(self):
+        """
+        Stops writing, keeping the log (and publishing it) for a later resume. Private logs
+        are deleted. Does nothing once the log is closed or discarded.
+        """
+        if self._closed:
+            return
+        if not self.shared:
+            self.discard()
+            return
+        try:
+            self.upload()
+        except Exception as e:
+            log.warning(f"Could not upload checkpoint {self.ref}: {e}")
+        self._close_files()
+        self._release()
+
+    def discard(self):
+        """Deletes the log, once its results are in the final artifact."""
+        if self._closed:
+            return
+        self._close_files()
+        if self.shared:
+            storage.STORE.delete(self.ref)
+            self._release()
+        elif os.path.exists(self.path):
+            os.remove(self.path)
+
+    def _close_files(self):
+        self._closed = True
+        self._file.close()
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
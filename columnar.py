@@ -0,0 +1,266 @@
+import os
+import json
+import shutil
+import tempfile
+import numpy as np
+
+# --- Columnar intermediate format ---
+# Module outputs (transcript segments and words, OCR items, frame descriptions) are stored
+# as a directory of columns instead of pretty-printed JSON:
+#
+#   <name>.cols/
+#       meta.json                     tables, columns, dtypes, row counts, attrs
+#       <table>.<column>.npy          numeric column (np.save, memory-mappable)
+#       <table>.<column>.utf8         text column: all strings, UTF-8, back to back
+#       <table>.<column>.offsets.npy  text column: int64 byte offsets, one more than rows
+#
+# Readers memory-map the columns, so fuse_data can np.searchsorted straight over the
+# timestamps on disk and only decodes the strings it actually emits.
+FORMAT_NAME = "cortex-columns"
+FORMAT_VERSION = 1
+SUFFIX = ".cols"
+META_FILE = "meta.json"
+# Also write a pretty-printed JSON copy next to each artifact, for eyeballing / debugging
+DEBUG_JSON = os.environ.get("CORTEX_DEBUG_JSON", "0").lower() in ("1", "true", "yes")
+
+
+def _is_text(values) -> bool:
+    return not isinstance(values, np.ndarray) or values.dtype.kind in ("U", "S", "O")
+
+
+def _write_text(directory: str, stem: str, values):
+    encoded = [str(v).encode("utf-8") for v in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    if encoded:
+        np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    with open(os.path.join(directory, f"{stem}.utf8"), "wb") as f:
+        f.write(b"".join(encoded))
+    np.save(os.path.join(directory, f"{stem}.offsets.npy"), offsets)
+
+
+def write_bundle(path: str, tables: dict, attrs: dict = None):
+    """
+    Writes `tables` ({table: {column: values}}) to the directory `path`.
+    Numeric columns must be NumPy arrays (their dtype is kept); anything else is a
+    sequence of strings. Columns of a table must all have the same length.
+    The directory is written next to `path` under a name of its own and renamed into place
+    when complete. Writers racing for the same path (artifacts are content-addressed or
+    per job, so they write the same data) keep whichever bundle landed first.
+    """
+    tmp = tempfile.mkdtemp(prefix=f"{os.path.basename(path)}.", suffix=".tmp", dir=os.path.dirname(path) or ".")
+    os.chmod(tmp, 0o755)  # mkdtemp's 0700 would hide the bundle from other users of a shared volume
+    try:
+        _write_tables(tmp, tables, attrs)
+        try:
+            os.replace(tmp, path)
+        except OSError:
+            # Another writer got there first (a directory with files in it is never replaced)
+            if not os.path.isdir(path):
+                raise
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def _write_tables(tmp: str, tables: dict, attrs: dict):
+    """Writes the columns and the metadata of a bundle into the directory `tmp`."""
+    meta = {"format": FORMAT_NAME, "version": FORMAT_VERSION, "attrs": attrs or {}, "tables": {}}
+    for table, columns in tables.items():
+        rows = None
+        columns_meta = {}
+        for column, values in columns.items():
+            if rows is None:
+                rows = len(values)
+            elif len(values) != rows:
+                raise ValueError(f"Column '{table}.{column}' has {len(values)} rows, expected {rows}.")
+            stem = f"{table}.{column}"
+            if _is_text(values):
+                _write_text(tmp, stem, values)
+                columns_meta[column] = "text"
+            else:
+                np.save(os.path.join(tmp, f"{stem}.npy"), np.ascontiguousarray(values))
+                columns_meta[column] = values.dtype.str
+        meta["tables"][table] = {"rows": rows or 0, "columns": columns_meta}
+
+    with open(os.path.join(tmp, META_FILE), "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+
+
+class TextColumn:
+    """A memory-mapped column of strings, decoded on access."""
+
+    def __init__(self, data, offsets):
+        self._data = data
+        self._offsets = offsets
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, index: int) -> str:
+        if index < 0:
+            index += len(self)
+        start, end = int(self._offsets[index]), int(self._offsets[index + 1])
+        return bytes(self._data[start:end]).decode("utf-8")
+
+    def __iter__(self):
+        data = bytes(self._data)
+        offsets = self._offsets.tolist()
+        for start, end in zip(offsets[:-1], offsets[1:]):
+            yield data[start:end].decode("utf-8")
+
+    def tolist(self) -> list:
+        return list(self)
+
+
+class Table:
+    """One table of a bundle. table["column"] is a NumPy array (memory-mapped) or a TextColumn."""
+
+    def __init__(self, directory: str, name: str, meta: dict, mmap: bool):
+        self.name = name
+        self.rows = meta["rows"]
+        self.kinds = meta["columns"]
+        self._directory = directory
+        self._mmap_mode = "r" if mmap else None
+        self._columns = {}
+
+    @property
+    def columns(self) -> list:
+        return list(self.kinds)
+
+    def __len__(self):
+        return self.rows
+
+    def __contains__(self, column: str):
+        return column in self.kinds
+
+    def __getitem__(self, column: str):
+        if column not in self._columns:
+            stem = os.path.join(self._directory, f"{self.name}.{column}")
+            if self.kinds[column] == "text":
+                offsets = np.load(f"{stem}.offsets.npy", mmap_mode=self._mmap_mode)
+                if offsets[-1] == 0:
+                    data = np.zeros(0, dtype=np.uint8)  # np.memmap can't map an empty file
+                elif self._mmap_mode:
+                    data = np.memmap(f"{stem}.utf8", dtype=np.uint8, mode="r")
+                else:
+                    data = np.fromfile(f"{stem}.utf8", dtype=np.uint8)
+                self._columns[column] = TextColumn(data, offsets)
+            else:
+                self._columns[column] = np.load(f"{stem}.npy", mmap_mode=self._mmap_mode)
+        return self._columns[column]
+
+    def records(self) -> list:
+        """The table as a list of dicts (plain Python values), e.g. for JSON export."""
+        values = [self[column].tolist() for column in self.kinds]
+        return [dict(zip(self.kinds, row)) for row in zip(*values)]
+
+
+class Bundle:
+    """A columnar artifact: bundle.attrs, bundle["table"] -> Table."""
+
+    def __init__(self, path: str, mmap: bool = True):
+        with open(os.path.join(path, META_FILE), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("format") != FORMAT_NAME or meta.get("version") != FORMAT_VERSION:
+            raise ValueError(f"{path} is not a {FORMAT_NAME} v{FORMAT_VERSION} artifact.")
+        self.path = path
+        self.attrs = meta["attrs"]
+        self.tables = {name: Table(path, name, table_meta, mmap) for name, table_meta in meta["tables"].items()}
+
+    def __getitem__(self, table: str) -> Table:
+        return self.tables[table]
+
+    def __contains__(self, table: str):
+        return table in self.tables
+
+
+def read_bundle(path: str, mmap: bool = True) -> Bundle:
+    return Bundle(path, mmap)
+
+
+def export_json(path: str, data):
+    """Writes the pretty-printed JSON debug view of an artifact, when CORTEX_DEBUG_JSON is set."""
+    if not DEBUG_JSON:
+        return
+    json_path = (path[:-len(SUFFIX)] if path.endswith(SUFFIX) else path) + ".json"
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+
+
+# --- Artifact layouts ---
+# Transcription: "segments" (start, end, text) and "words" (segment, start, end, probability, word);
+# attrs hold the language and full text. OCR: "spans" (first_seen, last_seen, text, confidence,
+# frames, bbox [x, y, w, h]). Motion: "items" (timestamp, description).
+
+def save_transcription(path: str, result: dict):
+    segments = result.get("segments", [])
+    words = [(i, w) for i, seg in enumerate(segments) for w in seg.get("words", [])]
+    write_bundle(path, {
+        "segments": {
+            "start": np.array([seg["start"] for seg in segments], dtype=np.float64),
+            "end": np.array([seg["end"] for seg in segments], dtype=np.float64),
+            "text": [seg["text"] for seg in segments],
+        },
+        "words": {
+            "segment": np.array([i for i, _ in words], dtype=np.int32),
+            "start": np.array([w["start"] for _, w in words], dtype=np.float64),
+            "end": np.array([w["end"] for _, w in words], dtype=np.float64),
+            "probability": np.array([w.get("probability", 0.0) for _, w in words], dtype=np.float32),
+            "word": [w["word"] for _, w in words],
+        },
+    }, attrs={"language": result.get("language"), "text": result.get("text", "")})
+    export_json(path, result)
+
+
+def load_transcription(path: str) -> dict:
+    """The transcription in Whisper's own layout (segments with their words)."""
+    bundle = read_bundle(path, mmap=False)
+    segments = [
+        {"id": i, "start": seg["start"], "end": seg["end"], "text": seg["text"], "words": []}
+        for i, seg in enumerate(bundle["segments"].records())
+    ]
+    for word in bundle["words"].records():
+        segments[word.pop("segment")]["words"].append(word)
+    return {"text": bundle.attrs.get("text", ""), "segments": segments, "language": bundle.attrs.get("language")}
+
+
+def save_items(path: str, items: list, text_field: str, extra: dict = None):
+    """
+    OCR / motion items: a float64 timestamp, a text column `text_field` and optional numeric
+    `extra` columns, given as {column: dtype} or {column: (dtype, width)} for fixed-size
+    vectors such as bounding boxes.
+    """
+    columns = {
+        "timestamp": np.array([item["timestamp"] for item in items], dtype=np.float64),
+        text_field: [item[text_field] for item in items],
+    }
+    for column, spec in (extra or {}).items():
+        dtype, width = spec if isinstance(spec, tuple) else (spec, None)
+        values = np.array([item[column] for item in items], dtype=dtype)
+        columns[column] = values.reshape(-1, width) if width else values
+    write_bundle(path, {"items": columns})
+    export_json(path, items)
+
+
+def load_items(path: str) -> list:
+    return read_bundle(path, mmap=False)["items"].records()
+
+
+def span_tables(spans: list) -> dict:
+    return {"spans": {
+        "first_seen": np.array([s["first_seen"] for s in spans], dtype=np.float64),
+        "last_seen": np.array([s["last_seen"] for s in spans], dtype=np.float64),
+        "text": [s["text"] for s in spans],
+        "confidence": np.array([s["confidence"] for s in spans], dtype=np.float32),
+        "frames": np.array([s["frames"] for s in spans], dtype=np.int32),
+        "bbox": np.array([s["bbox"] for s in spans], dtype=np.int32).reshape(-1, 4),
+    }}
+
+
+def save_spans(path: str, spans: list):
+    """OCR text spans (see ocr_engine.build_spans)."""
+    write_bundle(path, span_tables(spans))
+    export_json(path, spans)
+
+
+def load_spans(path: str) -> list:
+    return read_bundle(path, mmap=False)["spans"].records()
@@ -0,0 +1,458 @@
+import os
+import json
+import bisect
+import logging
+import subprocess
+import cv2
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+JPEG_QUALITY = 95
+
+# Change-detection gate: a sample whose downscaled grayscale image differs from the last
+# *kept* sample of the same consumer by less than this (mean absolute difference, 0-1)
+# is marked as a duplicate, and consumers reuse the earlier result. 0 disables the gate.
+CHANGE_THRESHOLD = float(os.environ.get("CORTEX_CHANGE_THRESHOLD", 0.02))
+SIGNATURE_SIZE = (64, 36)
+
+# --- Adaptive sampling ---
+# "fixed" samples every consumer on its interval grid (sample_video). "adaptive", the
+# default, finds shot boundaries in a cheap pass over the decoded stream and spends each
+# consumer's frame budget on keyframes: one per scene, then frames where the picture
+# changed within a scene (sample_video_adaptive). The grid is kept as the timeline's
+# resolution, with every grid point pointing at the keyframe of its scene that covers it
+# (each scene a grid point falls in gets one, even over budget), so consumers see the same
+# manifest shape and nothing the grid would have seen goes missing.
+# CORTEX_SAMPLING=fixed brings back the plain grid.
+SAMPLING_MODE = os.environ.get("CORTEX_SAMPLING", "adaptive").lower()
+# Frames per second looked at when searching for scene cuts (every frame is still decoded)
+ANALYSIS_FPS = float(os.environ.get("CORTEX_SCENE_ANALYSIS_FPS", 4))
+ANALYSIS_SIZE = (160, 90)
+HISTOGRAM_BINS = [8, 4, 4]  # hue, saturation, value
+# A cut is a jump in colour distribution (Bhattacharyya distance of HSV histograms) or in
+# the picture itself (signature difference, 0-1) between two analysed frames
+SCENE_HISTOGRAM_THRESHOLD = float(os.environ.get("CORTEX_SCENE_HISTOGRAM_THRESHOLD", 0.35))
+SCENE_DIFFERENCE_THRESHOLD = float(os.environ.get("CORTEX_SCENE_DIFFERENCE_THRESHOLD", 0.12))
+# Cuts closer together than this are one transition (fade, wipe), not several scenes
+MIN_SCENE_SECONDS = 0.3
+SAMPLING_SETTINGS = {
+    "mode": SAMPLING_MODE,
+    "analysis_fps": ANALYSIS_FPS,
+    "analysis_size": ANALYSIS_SIZE,
+    "histogram_bins": HISTOGRAM_BINS,
+    "scene_thresholds": [SCENE_HISTOGRAM_THRESHOLD, SCENE_DIFFERENCE_THRESHOLD],
+    "min_scene_seconds": MIN_SCENE_SECONDS,
+}
+
+
+def _probe_container(video_path: str):
+    """
+    Fallback for when OpenCV can't report FPS / frame count (common for webm/mkv and some
+    variable-frame-rate files): ask ffprobe for the container metadata instead.
+    Returns (fps, duration_seconds), either of which may be 0.0 if unknown.
+    """
+    try:
+        out = subprocess.run(
+            [
+                "ffprobe", "-v", "error", "-select_streams", "v:0",
+                "-show_entries", "stream=avg_frame_rate,r_frame_rate:format=duration",
+                "-of", "json", video_path
+            ],
+            capture_output=True, text=True, check=True, timeout=60
+        ).stdout
+        info = json.loads(out)
+    except Exception as e:
+        log.warning(f"ffprobe failed for {video_path}: {e}")
+        return 0.0, 0.0
+
+    fps = 0.0
+    for stream in info.get("streams", []):
+        for key in ("avg_frame_rate", "r_frame_rate"):
+            num, _, den = stream.get(key, "0/0").partition("/")
+            try:
+                fps = float(num) / float(den or 1)
+            except (ValueError, ZeroDivisionError):
+                fps = 0.0
+            if fps > 0:
+                break
+        if fps > 0:
+            break
+
+    try:
+        duration = float(info.get("format", {}).get("duration", 0.0))
+    except (TypeError, ValueError):
+        duration = 0.0
+
+    return fps, duration
+
+
+def probe_video(video_path: str, cap=None):
+    """
+    Returns {"fps", "frame_count", "duration"} for the video.
+    Uses OpenCV's stream properties first and falls back to the container metadata.
+    """
+    own_cap = cap is None
+    if own_cap:
+        cap = cv2.VideoCapture(video_path)
+        if not cap.isOpened():
+            raise IOError(f"Cannot open video file {video_path}")
+
+    try:
+        fps = cap.get(cv2.CAP_PROP_FPS) or 0.0
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+    finally:
+        if own_cap:
+            cap.release()
+
+    if fps <= 0 or frame_count <= 0:
+        meta_fps, meta_duration = _probe_container(video_path)
+        if fps <= 0:
+            fps = meta_fps
+        if frame_count <= 0 and fps > 0:
+            frame_count = int(round(meta_duration * fps))
+
+    if fps <= 0 or frame_count <= 0:
+        raise IOError(f"Could not determine FPS / length of video {video_path}")
+
+    return {"fps": fps, "frame_count": frame_count, "duration": frame_count / fps}
+
+
+def build_schedule(video_info: dict, intervals_ms: dict, start: float = 0.0, end: float = None):
+    """
+    Computes every sample point up front, bounded by the video's length
+    (or by the [start, end) time range in seconds, for sharded processing).
+    Sample times stay on each consumer's global grid (multiples of its interval),
+    so shards line up exactly with an unsharded run.
+    Returns {frame_index: [(consumer, timestamp_seconds), ...]}.
+    """
+    fps = video_info["fps"]
+    last_index = video_info["frame_count"] - 1
+    start_ms = max(0.0, start) * 1000.0
+    end_ms = video_info["duration"] * 1000.0
+    if end is not None:
+        end_ms = min(end_ms, end * 1000.0)
+
+    schedule = {}
+    for name, interval_ms in intervals_ms.items():
+        if interval_ms <= 0:
+            raise ValueError(f"Sampling interval for '{name}' must be positive, got {interval_ms}")
+        t_ms = -(-start_ms // interval_ms) * interval_ms  # first grid point >= start
+        while t_ms < end_ms:
+            index = min(int(round(t_ms / 1000.0 * fps)), last_index)
+            schedule.setdefault(index, []).append((name, t_ms / 1000.0))
+            t_ms += interval_ms
+    return schedule
+
+
+def frame_signature(frame):
+    """A tiny grayscale thumbnail, cheap to compare and robust to compression noise."""
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    return cv2.resize(gray, SIGNATURE_SIZE, interpolation=cv2.INTER_AREA).astype(np.int16)
+
+
+def frame_difference(signature_a, signature_b) -> float:
+    """Mean absolute pixel difference between two signatures, scaled to 0-1."""
+    return float(np.abs(signature_a - signature_b).mean()) / 255.0
+
+
+def sample_video(video_path: str, intervals_ms: dict, output_dir: str, change_threshold: float = CHANGE_THRESHOLD,
+                 start: float = 0.0, end: float = None, on_progress=None):
+    """
+    Decodes the video ONCE, front to back, and saves the frames every consumer needs.
+
+    `intervals_ms` maps a consumer name (e.g. "ocr", "motion") to its sampling interval.
+    The sample schedule is computed up front from FPS / frame count, then the file is read
+    sequentially by frame index with grab()/retrieve() - no millisecond seeking. Only
+    scheduled frames are retrieved and written (once, even if several consumers want them),
+    and decoding stops at the last scheduled frame, so runtime is bounded by video length.
+    With `start`/`end` (seconds) only that range is sampled: the decoder seeks once to the
+    first scheduled frame of the range and reads forward from there.
+    `on_progress(frames_decoded, frames_to_decode)` is called after every scheduled frame.
+
+    Samples that have not meaningfully changed since the consumer's last kept sample
+    (see CHANGE_THRESHOLD) are not written; their entry points at the kept frame and
+    carries "duplicate_of": <timestamp of the kept sample>.
+
+    Returns (manifest, video_info), where manifest is
+    {consumer: [{"timestamp": seconds, "path": frame_path[, "duplicate_of": seconds]}, ...]}
+    """
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise IOError(f"Cannot open video file {video_path}")
+
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = {name: [] for name in intervals_ms}
+    last_kept = {}  # consumer -> {"signature", "timestamp", "path"}
+
+    try:
+        video_info = probe_video(video_path, cap)
+        schedule = build_schedule(video_info, intervals_ms, start, end)
+        first_scheduled = min(schedule) if schedule else 0
+        last_scheduled = max(schedule) if schedule else -1
+
+        if first_scheduled > 0:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, first_scheduled)
+
+        for index in range(first_scheduled, last_scheduled + 1):
+            if not cap.grab():
+                log.warning(
+                    f"Decoder stopped at frame {index} of {video_info['frame_count']} "
+                    f"(expected {last_scheduled + 1}). Remaining samples skipped."
+                )
+                break
+
+            if index not in schedule:
+                continue
+            if on_progress:
+                on_progress(index - first_scheduled + 1, last_scheduled - first_scheduled + 1)
+
+            ret, frame = cap.retrieve()
+            if not ret:
+                log.warning(f"Could not retrieve frame {index}, skipping.")
+                continue
+
+            frame_path = os.path.join(output_dir, f"frame_{index:08d}.jpg")
+            signature = frame_signature(frame) if change_threshold > 0 else None
+            frame_needed = False
+
+            for name, timestamp in schedule[index]:
+                kept = last_kept.get(name)
+                if kept is not None and frame_difference(signature, kept["signature"]) < change_threshold:
+                    manifest[name].append({
+                        "timestamp": timestamp,
+                        "path": kept["path"],
+                        "duplicate_of": kept["timestamp"]
+                    })
+                    continue
+
+                manifest[name].append({"timestamp": timestamp, "path": frame_path})
+                if signature is not None:
+                    last_kept[name] = {"signature": signature, "timestamp": timestamp, "path": frame_path}
+                frame_needed = True
+
+            if frame_needed:
+                cv2.imwrite(frame_path, frame, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+    finally:
+        cap.release()
+
+    return manifest, video_info
+
+
+def _histogram(image):
+    hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+    hist = cv2.calcHist([hsv], [0, 1, 2], None, HISTOGRAM_BINS, [0, 180, 0, 256, 0, 256])
+    return cv2.normalize(hist, hist).flatten()
+
+
+def _frame_range(video_info: dict, start: float, end: float):
+    """First and last frame index of the [start, end) time range (seconds)."""
+    fps = video_info["fps"]
+    last = video_info["frame_count"] - 1
+    if end is not None:
+        last = min(last, int(np.ceil(end * fps)) - 1)
+    return min(int(np.ceil(max(0.0, start) * fps)), last + 1), last
+
+
+def grid_timestamps(video_info: dict, interval_ms: float, start: float = 0.0, end: float = None) -> list:
+    """A consumer's interval grid within [start, end), the same points build_schedule uses."""
+    schedule = build_schedule(video_info, {"grid": interval_ms}, start, end)
+    return sorted(timestamp for points in schedule.values() for _, timestamp in points)
+
+
+def find_scenes(cap, video_info: dict, first: int, last: int, output_dir: str, change_threshold: float,
+                min_gap: float, on_progress=None) -> list:
+    """
+    One pass over frames [first, last]: splits them into scenes and saves candidate keyframes.
+
+    Every frame is decoded (grab), but only ANALYSIS_FPS frames per second are retrieved and
+    compared. Each scene's first analysed frame is a candidate; within a scene, a frame
+    becomes a candidate when it differs from the previous candidate by at least
+    `change_threshold` and is at least `min_gap` seconds after it (a slide build-up, a pan).
+
+    The analysed frames are the same for every range (every stride-th frame of the video),
+    and a range that doesn't start the video is compared with the analysed frame before it,
+    so a shard boundary is only a cut where the unsharded run sees one. Otherwise the first
+    scene is "continued": it began before `first`, in the previous shard.
+
+    Returns [{"start", "end", "continued", "candidates": [{"timestamp", "path", "novelty"}]}]
+    in time order.
+    """
+    fps = video_info["fps"]
+    stride = max(1, int(round(fps / ANALYSIS_FPS)))
+    primer = (first - 1) // stride * stride if first > 0 else 0  # last analysed frame before the range
+    scenes = []
+    previous = None  # (histogram, signature) of the last analysed frame
+    anchor = None  # signature and time of the scene's last candidate
+
+    def save(frame, index, novelty):
+        path = os.path.join(output_dir, f"frame_{index:08d}.jpg")
+        cv2.imwrite(path, frame, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+        return {"timestamp": index / fps, "path": path, "novelty": novelty}
+
+    if primer > 0:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, primer)
+    for index in range(primer, last + 1):
+        if not cap.grab():
+            log.warning(f"Decoder stopped at frame {index} of {video_info['frame_count']} (expected {last + 1}).")
+            break
+        if index % stride:
+            continue
+        if on_progress and index >= first:
+            on_progress(index - first + 1, last - first + 1)
+        ret, frame = cap.retrieve()
+        if not ret:
+            log.warning(f"Could not retrieve frame {index}, skipping.")
+            continue
+
+        small = cv2.resize(frame, ANALYSIS_SIZE, interpolation=cv2.INTER_AREA)
+        histogram, signature = _histogram(small), frame_signature(small)
+        timestamp = index / fps
+        cut = previous is None or (
+            cv2.compareHist(previous[0], histogram, cv2.HISTCMP_BHATTACHARYYA) > SCENE_HISTOGRAM_THRESHOLD
+            or frame_difference(previous[1], signature) > SCENE_DIFFERENCE_THRESHOLD
+        )
+        previous = (histogram, signature)
+        if index < first:
+            continue
+
+        if not scenes:
+            scenes.append({"start": timestamp, "continued": not cut, "candidates": [save(frame, index, 1.0)]})
+        elif cut and not scenes[-1]["continued"] and timestamp - scenes[-1]["start"] < MIN_SCENE_SECONDS:
+            # Still inside a transition: the scene is represented by where it settles
+            for candidate in scenes[-1]["candidates"]:
+                os.remove(candidate["path"])
+            scenes[-1]["candidates"] = [save(frame, index, 1.0)]
+        elif cut:
+            scenes.append({"start": timestamp, "continued": False, "candidates": [save(frame, index, 1.0)]})
+        else:
+            novelty = frame_difference(anchor[0], signature)
+            if novelty < change_threshold or timestamp - anchor[1] < min_gap:
+                continue
+            scenes[-1]["candidates"].append(save(frame, index, novelty))
+        anchor = (signature, timestamp)
+
+    for scene, following in zip(scenes, scenes[1:]):
+        scene["end"] = following["start"]
+    if scenes:
+        scenes[-1]["end"] = (last + 1) / fps
+    return scenes
+
+
+def select_keyframes(scenes: list, budget: int, min_gap: float, required=()) -> list:
+    """
+    Picks at most `budget` candidates: the first one of every scene in `required` (the
+    budget grows to cover them all), then of the other scenes (the longest first, if there
+    are more scenes than the budget; a "continued" scene only when required), then the most
+    changed frames within scenes, at least `min_gap` seconds from another pick in the same
+    scene. Returns them in time order.
+    """
+    required = sorted(set(required))
+    others = sorted(
+        (i for i in range(len(scenes)) if i not in required and not scenes[i]["continued"]),
+        key=lambda i: scenes[i]["end"] - scenes[i]["start"], reverse=True
+    )
+    budget = max(budget, len(required))
+    picked = {i: [scenes[i]["candidates"][0]] for i in (required + others)[:budget]}
+    count = len(picked)
+
+    extra = sorted(
+        ((i, c) for i in picked for c in scenes[i]["candidates"][1:]),
+        key=lambda item: item[1]["novelty"], reverse=True
+    )
+    for i, candidate in extra:
+        if count >= budget:
+            break
+        if all(abs(candidate["timestamp"] - p["timestamp"]) >= min_gap for p in picked[i]):
+            picked[i].append(candidate)
+            count += 1
+
+    return sorted((c for chosen in picked.values() for c in chosen), key=lambda c: c["timestamp"])
+
+
+def _scene_at(starts: list, timestamp: float) -> int:
+    """Index of the scene on screen at `timestamp`; the first scene before the first analysed
+    frame."""
+    return max(0, bisect.bisect_right(starts, timestamp) - 1)
+
+
+def _covering(keyframes: list, times: list, starts: list, scene_of: dict, timestamp: float):
+    """
+    The keyframe standing in for `timestamp`: the latest one of its scene up to then, else
+    the scene's first. None when the scene has no keyframe: a frame from another scene
+    would describe a picture that isn't on screen.
+    """
+    scene = _scene_at(starts, timestamp)
+    position = bisect.bisect_right(times, timestamp)
+    for keyframe in reversed(keyframes[:position]):
+        if scene_of[id(keyframe)] == scene:
+            return keyframe
+    for keyframe in keyframes[position:]:
+        if scene_of[id(keyframe)] == scene:
+            return keyframe
+    return None
+
+
+def sample_video_adaptive(video_path: str, intervals_ms: dict, budgets_per_minute: dict, output_dir: str,
+                          change_threshold: float = CHANGE_THRESHOLD, start: float = 0.0, end: float = None,
+                          on_progress=None):
+    """
+    Scene-aware alternative to sample_video, with the same arguments and result shape.
+
+    Detects scenes (find_scenes), then gives each consumer
+    budgets_per_minute[consumer] keyframes per minute of the sampled range
+    (select_keyframes, with the consumer's interval as the minimum spacing within a scene).
+    Every scene one of the consumer's grid points falls in gets a keyframe even over the
+    budget, so adaptive sampling never leaves out a part of the video the fixed grid saw.
+    A consumer's manifest holds its keyframes at their own timestamps (with the "scene"
+    they represent), plus its interval grid, where every point is a duplicate of the
+    keyframe of its scene covering it, so results still span the whole timeline.
+    Frames no consumer picked are deleted.
+
+    Returns (manifest, video_info, scenes) where scenes is [[start, end], ...] in seconds,
+    for the scenes starting in the range (one continued from before `start` belongs to the
+    previous shard's count).
+    """
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise IOError(f"Cannot open video file {video_path}")
+
+    os.makedirs(output_dir, exist_ok=True)
+    try:
+        video_info = probe_video(video_path, cap)
+        first, last = _frame_range(video_info, start, end)
+        min_gap = min(intervals_ms.values()) / 1000.0
+        scenes = find_scenes(cap, video_info, first, last, output_dir, change_threshold, min_gap, on_progress)
+    finally:
+        cap.release()
+
+    minutes = max(0, last + 1 - first) / video_info["fps"] / 60.0
+    budgets = {name: max(1, int(np.ceil(rate * minutes))) for name, rate in budgets_per_minute.items()}
+
+    starts = [scene["start"] for scene in scenes]
+    scene_of = {id(c): i for i, scene in enumerate(scenes) for c in scene["candidates"]}
+    manifest = {}
+    used = set()
+    for name, interval_ms in intervals_ms.items():
+        grid = grid_timestamps(video_info, interval_ms, start, end)
+        required = {_scene_at(starts, timestamp) for timestamp in grid} if scenes else ()
+        keyframes = select_keyframes(scenes, budgets[name], interval_ms / 1000.0, required)
+        used.update(k["path"] for k in keyframes)
+        samples = [
+            {"timestamp": k["timestamp"], "path": k["path"], "scene": scene_of[id(k)]}
+            for k in keyframes
+        ]
+        times = [k["timestamp"] for k in keyframes]
+        taken = set(times)
+        for timestamp in grid:
+            keyframe = None if timestamp in taken else _covering(keyframes, times, starts, scene_of, timestamp)
+            if keyframe is not None:
+                samples.append({"timestamp": timestamp, "path": keyframe["path"], "duplicate_of": keyframe["timestamp"]})
+        manifest[name] = sorted(samples, key=lambda sample: sample["timestamp"])
+
+    for scene in scenes:
+        for candidate in scene["candidates"]:
+            if candidate["path"] not in used:
+                os.remove(candidate["path"])
+
+    return manifest, video_info, [[scene["start"], scene["end"]] for scene in scenes if not scene["continued"]]
@@ -0,0 +1,98 @@
+import math
+import numpy as np
+
+
+def _chunks_for_intervals(edges, starts, ends):
+    """
+    For each [start, end) interval, the first and last chunk it overlaps
+    (chunk k overlaps when start < edges[k + 1] and end > edges[k]).
+    """
+    first = np.searchsorted(edges[1:], starts, side='right')
+    last = np.searchsorted(edges[:-1], ends, side='left') - 1
+    return first, last
+
+
+def _chunks_for_points(edges, timestamps):
+    """Chunk index of each timestamp (edges[k] <= t < edges[k + 1]), -1 / n when outside."""
+    return np.searchsorted(edges, timestamps, side='right') - 1
+
+
+def stream_duration(segments, ocr_data, motion_data) -> float:
+    """The latest time any stream reaches, for when the video's own duration isn't known."""
+    latest = 0.0
+    if len(segments):
+        latest = max(latest, float(np.max(segments['end'])))
+    # Just past the last sample, so it still falls inside the last chunk
+    if len(ocr_data):
+        latest = max(latest, math.nextafter(float(np.max(ocr_data['last_seen'])), math.inf))
+    if len(motion_data):
+        latest = max(latest, math.nextafter(float(np.max(motion_data['timestamp'])), math.inf))
+    return latest
+
+
+def fuse_streams(segments, ocr_data, motion_data, duration: float, time_step_seconds: float):
+    """
+    Aligns the three streams onto fixed time chunks of `time_step_seconds`.
+
+    Every stream is swept once: chunk indices for all items are found with a single
+    np.searchsorted over the chunk edges, then items are appended to their chunks in
+    their original order. Cost is O(items + chunks) instead of O(items x chunks).
+
+    The streams are column tables (see columnar.py): segments with 'start', 'end' and
+    'text', OCR spans with 'first_seen', 'last_seen' and 'text', motion items with
+    'timestamp' and 'description'. A span is in every chunk from the one it was first
+    seen in to the one it was last seen in. Timestamps may be memory-mapped; only the
+    strings that land in a chunk are decoded.
+
+    Returns the fused timeline: [{"time_chunk", "spoken", "on_screen_text", "visuals"}]
+    (chunks with no data at all are left out).
+    """
+    n_chunks = max(1, math.ceil(duration / time_step_seconds)) if duration > 0 else 0
+    if n_chunks == 0:
+        return []
+    edges = np.arange(n_chunks + 1, dtype=np.float64) * time_step_seconds
+
+    spoken = [[] for _ in range(n_chunks)]
+    on_screen = [{} for _ in range(n_chunks)]  # dict as an insertion-ordered set
+    visuals = [[] for _ in range(n_chunks)]
+
+    if len(segments):
+        texts = segments['text']
+        first, last = _chunks_for_intervals(edges, np.asarray(segments['start']), np.asarray(segments['end']))
+        for i, (k0, k1) in enumerate(zip(first.tolist(), last.tolist())):
+            if k0 > k1 or k1 < 0 or k0 >= n_chunks:
+                continue
+            text = texts[i]
+            for k in range(max(k0, 0), min(k1, n_chunks - 1) + 1):
+                spoken[k].append(text)
+
+    if len(ocr_data):
+        texts = ocr_data['text']
+        first = _chunks_for_points(edges, np.asarray(ocr_data['first_seen']))
+        last = _chunks_for_points(edges, np.asarray(ocr_data['last_seen']))
+        for i, (k0, k1) in enumerate(zip(first.tolist(), last.tolist())):
+            if k1 < 0 or k0 >= n_chunks:
+                continue
+            text = texts[i]
+            for k in range(max(k0, 0), min(k1, n_chunks - 1) + 1):
+                on_screen[k][text] = None
+
+    if len(motion_data):
+        texts = motion_data['description']
+        chunks = _chunks_for_points(edges, np.asarray(motion_data['timestamp']))
+        for i, k in enumerate(chunks.tolist()):
+            if 0 <= k < n_chunks:
+                visuals[k].append(texts[i])
+
+    fused_timeline = []
+    for k in range(n_chunks):
+        spoken_text = " ".join(spoken[k]).strip()
+        motion_descriptions = " ".join(visuals[k])
+        if spoken_text or on_screen[k] or motion_descriptions:
+            fused_timeline.append({
+                "time_chunk": f"{edges[k]:.1f}s - {edges[k + 1]:.1f}s",
+                "spoken": spoken_text,
+                "on_screen_text": list(on_screen[k]),
+                "visuals": motion_descriptions
+            })
+    return fused_timeline
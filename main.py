@@ -1,18 +1,22 @@
 import os
-import shutil
+import re
+import time
 import logging
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
-from celery import chain  # <-- Import chain
+import redis.asyncio as aioredis
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from celery.result import AsyncResult
 from celery_app import celery
-# --- KEY CHANGE: Import all tasks directly ---
-from tasks import (
-    transcribe_video, 
-    extract_static_data, 
-    describe_motion, 
-    fuse_data, 
-    synthesize_knowledge
-)
+import metrics
+import storage
+from frame_sampler import probe_video
+from pipeline import build_pipeline, build_rerun, missing_rerun_inputs, rerun_stage
+from scheduling import DEFAULT_TENANT, PRIORITIES, TENANT_PATTERN, AdmissionRejected, admit, job_priority, release
+from tasks import load_job_context
+from progress import PROGRESS_REDIS_URL, TERMINAL_EVENTS, stream_key
+from uploads import StreamingUpload, UploadError, UploadTooLarge, new_job_id
+
 
 app = FastAPI(
     title="Project Cortex API",
@@ -24,6 +28,30 @@ log = logging.getLogger(__name__)
 # --- Base upload directory ---
 UPLOAD_DIR = "video_uploads"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
+MAX_UPLOAD_BYTES = int(float(os.environ.get("CORTEX_MAX_UPLOAD_GB", 10)) * 2**30)
+
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """Counts and times every request, labelled by route template (not the raw path)."""
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        path = getattr(route, "path", "unmatched")
+        metrics.HTTP_REQUEST_SECONDS.labels(request.method, path).observe(time.perf_counter() - started)
+        metrics.HTTP_REQUESTS.labels(request.method, path, str(status)).inc()
+
+
+@app.get("/metrics")
+def get_metrics():
+    """Prometheus metrics for the API (workers export theirs separately, see metrics.py)."""
+    body, content_type = metrics.render()
+    return Response(content=body, media_type=content_type)
 
 
 @app.get("/")
@@ -33,60 +61,125 @@ def read_root():
 
 
 @app.post("/process-video/")
-async def process_video_endpoint(
-    gemini_api_key: str = Form(...),
-    groq_api_key: str = Form(...),
-    video_file: UploadFile = File(...)
-):
+async def process_video_endpoint(request: Request):
     """
     Upload a video and API keys to trigger the asynchronous processing pipeline.
+
+    Multipart form fields: `gemini_api_key`, `groq_api_key`, `video_file`, and optionally
+    `shard_seconds` to split long videos into time shards processed on separate workers,
+    `tenant` (whose share the job counts against) and `priority` (interactive / normal /
+    batch; by default from the video's length, see scheduling.py).
+    The body is streamed straight to disk (and hashed) as it arrives; see uploads.py.
+    Answers 429 (with Retry-After) when the tenant already has too much in progress.
     """
-    if not video_file.content_type.startswith("video/"):
-        raise HTTPException(status_code=400, detail="Invalid file type. Please upload a video.")
-        
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"Upload exceeds the {MAX_UPLOAD_BYTES // 2**20} MB limit.")
+
     try:
-        # Save the uploaded video
-        file_path = os.path.join(UPLOAD_DIR, video_file.filename)
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(video_file.file, buffer)
-        
-        log.info(f"Video file saved to: {file_path}")
+        upload = StreamingUpload(request.headers.get("content-type"), UPLOAD_DIR, MAX_UPLOAD_BYTES)
+    except UploadError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    try:
+        async for chunk in request.stream():
+            upload.feed(chunk)
+            await run_in_threadpool(upload.flush)
+        await run_in_threadpool(upload.finish)
+        metrics.UPLOAD_BYTES.inc(upload.size)
+    except UploadTooLarge as e:
+        await run_in_threadpool(upload.abort)
+        raise HTTPException(status_code=413, detail=str(e))
+    except UploadError as e:
+        await run_in_threadpool(upload.abort)
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        await run_in_threadpool(upload.abort)
+        log.error(f"Error during file upload: {e}")
+        raise HTTPException(status_code=500, detail=f"Internal server error: {e}")
 
+    missing = [name for name in ("gemini_api_key", "groq_api_key") if not upload.fields.get(name)]
+    if missing:
+        os.remove(upload.path)
+        raise HTTPException(status_code=400, detail=f"Missing form fields: {', '.join(missing)}")
+
+    shard_seconds = upload.fields.get("shard_seconds")
+    if shard_seconds is not None and not shard_seconds.strip().isdigit():
+        os.remove(upload.path)
+        raise HTTPException(status_code=400, detail="shard_seconds must be a whole number of seconds.")
+
+    tenant = upload.fields.get("tenant") or DEFAULT_TENANT
+    if not TENANT_PATTERN.fullmatch(tenant):
+        os.remove(upload.path)
+        raise HTTPException(status_code=400, detail="tenant must be 1-64 letters, digits, '.', '_' or '-'.")
+    requested_priority = upload.fields.get("priority") or None
+    if requested_priority is not None and requested_priority not in PRIORITIES:
+        os.remove(upload.path)
+        raise HTTPException(status_code=400, detail=f"priority must be one of {', '.join(PRIORITIES)}.")
+
+    try:
+        # Workers on any node read the video from the store; identical uploads share one copy
+        video_ref = f"videos/{upload.sha256}{os.path.splitext(upload.path)[1]}"
+        already_stored = await run_in_threadpool(storage.STORE.exists, video_ref)
+        await run_in_threadpool(storage.STORE.ingest, video_ref, upload.path)
+        log.info(f"Video file stored as: {video_ref} ({upload.size} bytes, sha256 {upload.sha256})")
+    except Exception as e:
+        log.error(f"Error while storing the upload: {e}")
+        raise HTTPException(status_code=500, detail=f"Internal server error: {e}")
+
+    # --- Admission control: a job's cost is its video length, known before anything is queued ---
+    try:
+        video_info = await run_in_threadpool(probe_video, storage.video_source(video_ref))
+    except IOError as e:
+        # Nothing evicts videos/: don't keep an unreadable upload (unless an earlier job uses it)
+        if not already_stored:
+            await run_in_threadpool(storage.STORE.delete, video_ref)
+        raise HTTPException(status_code=400, detail=f"Could not read the video: {e}")
+    priority = job_priority(video_info["duration"], requested_priority)
+    try:
+        await run_in_threadpool(admit, tenant, upload.job_id, video_info["duration"])
+    except AdmissionRejected as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+    try:
         # --- KEY CHANGE: Build the context dictionary here ---
         initial_context = {
-            "original_video_path": file_path,
-            "processing_id": os.path.basename(file_path).split('.')[0], 
-            "paths": {"original": file_path},
+            "original_video_path": video_ref,
+            "processing_id": upload.job_id,
+            "video_hash": upload.sha256,
+            "video": video_info,
+            "tenant": tenant,
+            "priority": priority,
+            "paths": {"original": video_ref},
             "api_keys": {
-                "gemini": gemini_api_key,
-                "groq": groq_api_key
+                "gemini": upload.fields["gemini_api_key"],
+                "groq": upload.fields["groq_api_key"]
             }
         }
 
-        # --- KEY CHANGE: We build the chain here, in the API ---
-        processing_chain = chain(
-            transcribe_video.s(initial_context), # Pass context to the *first* task
-            extract_static_data.s(),
-            describe_motion.s(), 
-            fuse_data.s(),
-            synthesize_knowledge.s() # The *last* task
-        )
+        # --- Modules 1-3 run in parallel, then fusion and synthesis (see pipeline.py) ---
+        if shard_seconds is None:
+            processing_pipeline = build_pipeline(initial_context)
+        else:
+            processing_pipeline = build_pipeline(initial_context, shard_seconds=int(shard_seconds))
         
-        # Start the chain and get the AsyncResult of the *last* task
-        task = processing_chain.delay()
+        # Start the pipeline and get the AsyncResult of the *last* task
+        task = processing_pipeline.delay()
         
         # Return the ID of the last task
         return {
             "status": "success",
             "message": "Video processing has started.",
-            "task_id": task.id # This ID will have the final report
+            "task_id": task.id, # This ID will have the final report
+            "processing_id": upload.job_id,
+            "tenant": tenant,
+            "priority": priority
         }
 
     except Exception as e:
-        log.error(f"Error during file upload or task queuing: {e}")
+        log.error(f"Error during task queuing: {e}")
+        await run_in_threadpool(release, initial_context)
         raise HTTPException(status_code=500, detail=f"Internal server error: {e}")
-    finally:
-        video_file.file.close()
 
 
 @app.get("/get-result/{task_id}")
@@ -103,10 +196,14 @@ async def get_task_result(task_id: str):
             final_context = task_result.get()
             
             # This logic is now correct
-            report_path = final_context.get("paths", {}).get("final_report")
+            report_ref = final_context.get("paths", {}).get("final_report")
             
-            if report_path and os.path.exists(report_path):
-                # Read the markdown content and send it
+            try:
+                # Read the markdown content (from the store) and send it
+                report_path = await run_in_threadpool(storage.fetch, report_ref) if report_ref else None
+            except FileNotFoundError:
+                report_path = None
+            if report_path:
                 with open(report_path, 'r', encoding='utf-8') as f:
                     report_content = f.read()
                 return {
@@ -120,4 +217,134 @@ async def get_task_result(task_id: str):
             return {"status": "FAILURE", "message": str(task_result.info)}
     else:
         # The task is still running
-        return {"status": "PENDING", "message": "Processing is still in progress..."}
\ No newline at end of file
+        return {"status": "PENDING", "message": "Processing is still in progress..."}
+
+
+# --- Re-analysis ---
+JOB_ID_PATTERN = re.compile(r"[A-Za-z0-9_-]+")
+
+
+@app.post("/rerun/{processing_id}")
+async def rerun_job(processing_id: str, request: Request):
+    """
+    Re-runs a finished job with new parameters, without uploading the video again.
+
+    JSON body: `params` (e.g. {"time_step_seconds": 10} or {"synthesis_prompt": "..."}),
+    the API keys (`groq_api_key`, plus `gemini_api_key` when re-running extraction), and
+    optionally `stage` (extraction / fusion / synthesis; defaults to the earliest stage
+    that reads one of the params) and `priority`. The re-run counts against the original
+    job's tenant. Stored artifacts upstream of that stage are reused (409 if they have
+    since been evicted), and any stage whose settings didn't change is a cache hit, so
+    e.g. re-fusing at a new time step only costs fusion and synthesis. Returns a new
+    task_id and processing_id.
+    """
+    try:
+        body = await request.json()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Expected a JSON body.")
+    if not isinstance(body, dict) or not isinstance(body.get("params", {}), dict):
+        raise HTTPException(status_code=400, detail="Expected a JSON object with a 'params' object.")
+
+    params = body.get("params", {})
+    try:
+        stage = rerun_stage(params, body.get("stage"))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    missing = [name for name in ("groq_api_key",) + (("gemini_api_key",) if stage == "extraction" else ())
+               if not body.get(name)]
+    if missing:
+        raise HTTPException(status_code=400, detail=f"Missing fields: {', '.join(missing)}")
+    requested_priority = body.get("priority")
+    if requested_priority is not None and requested_priority not in PRIORITIES:
+        raise HTTPException(status_code=400, detail=f"priority must be one of {', '.join(PRIORITIES)}.")
+
+    if not JOB_ID_PATTERN.fullmatch(processing_id):
+        raise HTTPException(status_code=404, detail="Unknown job.")
+    try:
+        saved = await run_in_threadpool(load_job_context, processing_id)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Unknown job, or it hasn't finished yet.")
+
+    context = dict(saved)
+    context.pop("parent_id", None)  # left over from stitching; progress would go to the old job
+    context["processing_id"] = new_job_id(processing_id)
+    context["rerun_of"] = processing_id
+    context["params"] = {**saved.get("params", {}), **params}
+    context["timings"] = {}
+    context["api_keys"] = {"gemini": body.get("gemini_api_key"), "groq": body["groq_api_key"]}
+
+    # The stage's inputs may have been evicted from the cache since the job finished
+    missing = await run_in_threadpool(missing_rerun_inputs, context, stage)
+    if missing:
+        earlier = "upload the video again" if stage == "extraction" else "re-run from 'extraction'"
+        raise HTTPException(
+            status_code=409,
+            detail=f"The stored {', '.join(missing)} output of job {processing_id} is gone; {earlier}."
+        )
+
+    # Only re-running extraction costs video time; fusion and synthesis take seconds
+    cost = (saved.get("video") or {}).get("duration", 0.0) if stage == "extraction" else 0.0
+    context["tenant"] = saved.get("tenant", DEFAULT_TENANT)
+    context["priority"] = job_priority(cost, requested_priority)
+    try:
+        await run_in_threadpool(admit, context["tenant"], context["processing_id"], cost)
+    except AdmissionRejected as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+    try:
+        task = (await run_in_threadpool(build_rerun, context, stage)).delay()
+    except Exception as e:
+        log.error(f"Error during re-run queuing: {e}")
+        await run_in_threadpool(release, context)
+        raise HTTPException(status_code=500, detail=f"Internal server error: {e}")
+
+    log.info(f"[{context['processing_id']}] Re-running {processing_id} from {stage} with {sorted(params)}")
+    return {
+        "status": "success",
+        "message": f"Re-analysis from {stage} has started.",
+        "task_id": task.id,
+        "processing_id": context["processing_id"],
+        "stage": stage,
+    }
+
+
+# --- Live progress (server-sent events) ---
+SSE_BLOCK_MS = 15000
+
+
+@app.get("/progress/{processing_id}")
+async def stream_progress(processing_id: str, request: Request):
+    """
+    Streams a job's progress and partial results as server-sent events, from the start
+    (or from the Last-Event-ID header when reconnecting). Each event's `event:` is one of
+    started / progress / partial / completed / done / failed, and `data:` is JSON with at
+    least the `stage`. The stream ends after `done` or `failed`.
+    """
+    key = stream_key(processing_id)
+    last_id = request.headers.get("last-event-id", "0-0")
+
+    async def events():
+        nonlocal last_id
+        client = aioredis.Redis.from_url(PROGRESS_REDIS_URL)
+        try:
+            while not await request.is_disconnected():
+                batches = await client.xread({key: last_id}, block=SSE_BLOCK_MS, count=100)
+                if not batches:
+                    yield ": keep-alive\n\n"
+                    continue
+                for entry_id, fields in batches[0][1]:
+                    last_id = entry_id.decode()
+                    event = fields[b"event"].decode()
+                    data = fields[b"data"].decode()
+                    yield f"id: {last_id}\nevent: {event}\ndata: {data}\n\n"
+                    if event in TERMINAL_EVENTS:
+                        return
+        finally:
+            await client.aclose()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
@@ -0,0 +1,155 @@
+import os
+import json
+import time
+import logging
+from contextlib import contextmanager
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, REGISTRY,
+    generate_latest, multiprocess, start_http_server
+)
+
+log = logging.getLogger(__name__)
+
+# --- Prometheus metrics ---
+# Celery's prefork workers (and uvicorn with --workers) run several processes, so set
+# PROMETHEUS_MULTIPROC_DIR to an empty, writable directory before starting them: each
+# process then writes its samples there and the exporter aggregates them.
+#   - workers: the main worker process serves /metrics on CORTEX_WORKER_METRICS_PORT
+#   - API: main.py serves /metrics on the app itself
+MULTIPROC_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+WORKER_METRICS_PORT = int(os.environ.get("CORTEX_WORKER_METRICS_PORT", 9808))
+
+# Stages take from milliseconds (fusion, one OCR frame) to many minutes (Whisper on a long video)
+STAGE_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+API_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60, 120)
+
+STAGE_SECONDS = Histogram(
+    "cortex_stage_seconds", "Time spent in one pipeline stage (see span()).",
+    ["stage"], buckets=STAGE_BUCKETS)
+TASK_SECONDS = Histogram(
+    "cortex_task_seconds", "Run time of a Celery task.",
+    ["task"], buckets=STAGE_BUCKETS)
+TASK_QUEUE_WAIT_SECONDS = Histogram(
+    "cortex_task_queue_wait_seconds", "Time from publishing a task to a worker starting it.",
+    ["task"], buckets=STAGE_BUCKETS)
+TASKS_TOTAL = Counter(
+    "cortex_tasks", "Celery tasks finished, by final state.",
+    ["task", "state"])
+FRAMES_TOTAL = Counter(
+    "cortex_frames", "Video frames processed, by stage (sampled, ocr, vision).",
+    ["stage"])
+EXTERNAL_API_SECONDS = Histogram(
+    "cortex_external_api_seconds", "Latency of one external API request.",
+    ["api", "outcome"], buckets=API_BUCKETS)
+EXTERNAL_API_RETRIES = Counter(
+    "cortex_external_api_retries", "External API requests retried.",
+    ["api", "reason"])
+LLM_TOKENS = Counter(
+    "cortex_llm_tokens", "Tokens sent to / received from the synthesis LLM.",
+    ["direction"])
+WHISPER_LOAD_SECONDS = Gauge(
+    "cortex_whisper_load_seconds", "Time the resident Whisper model took to load.",
+    ["model", "backend"], multiprocess_mode="liveall")
+WHISPER_MODEL_MEMORY_MB = Gauge(
+    "cortex_whisper_model_memory_mb", "Resident memory added by loading the Whisper model.",
+    ["model", "backend"], multiprocess_mode="liveall")
+
+HTTP_REQUESTS = Counter(
+    "cortex_http_requests", "API requests handled.",
+    ["method", "route", "status"])
+HTTP_REQUEST_SECONDS = Histogram(
+    "cortex_http_request_seconds", "API request latency (until the response starts, for streams).",
+    ["method", "route"], buckets=API_BUCKETS)
+UPLOAD_BYTES = Counter(
+    "cortex_upload_bytes", "Bytes of video received by the API.")
+
+SENT_AT_HEADER = "cortex_sent_at"
+
+
+@contextmanager
+def span(stage: str, context: dict = None, **fields):
+    """
+    Times a block as pipeline stage `stage`: observes cortex_stage_seconds, logs one
+    structured (JSON) line, and adds the duration to context["timings"] when given.
+    Extra `fields` go into the log line; the dict yielded can add more from inside.
+    """
+    started = time.perf_counter()
+    extra = dict(fields)
+    status = "ok"
+    try:
+        yield extra
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        seconds = time.perf_counter() - started
+        STAGE_SECONDS.labels(stage).observe(seconds)
+        if context is not None:
+            timings = context.setdefault("timings", {})
+            timings[stage] = round(timings.get(stage, 0.0) + seconds, 3)
+        log.info(json.dumps({
+            "span": stage,
+            "processing_id": (context or {}).get("processing_id"),
+            "seconds": round(seconds, 4),
+            "status": status,
+            **extra,
+        }, default=str))
+
+
+def observe(stage: str, seconds: float):
+    """Records a stage duration measured elsewhere (e.g. in a worker thread)."""
+    STAGE_SECONDS.labels(stage).observe(seconds)
+
+
+# --- Celery signal handlers (connected in tasks.py) ---
+
+def stamp_sent_time(headers=None, **_):
+    """before_task_publish: remember when the task was queued."""
+    if headers is not None:
+        headers[SENT_AT_HEADER] = time.time()
+
+
+def task_started(task=None, **_):
+    """task_prerun: queue wait, and the start of the task's run time."""
+    sent_at = getattr(task.request, SENT_AT_HEADER, None)
+    if sent_at:
+        TASK_QUEUE_WAIT_SECONDS.labels(task.name).observe(max(0.0, time.time() - float(sent_at)))
+    task.request._cortex_started = time.perf_counter()
+
+
+def task_finished(task=None, state=None, **_):
+    """task_postrun: run time and final state."""
+    started = getattr(task.request, "_cortex_started", None)
+    if started is not None:
+        TASK_SECONDS.labels(task.name).observe(time.perf_counter() - started)
+    TASKS_TOTAL.labels(task.name, state or "UNKNOWN").inc()
+
+
+def start_worker_exporter(**_):
+    """worker_init: serve /metrics for this worker (all its pool processes) on WORKER_METRICS_PORT."""
+    try:
+        start_http_server(WORKER_METRICS_PORT, registry=_registry())
+        log.info(f"Worker metrics on :{WORKER_METRICS_PORT}/metrics")
+    except OSError as e:
+        log.warning(f"Could not start the worker metrics exporter on :{WORKER_METRICS_PORT}: {e}")
+
+
+def process_exited(pid=None, **_):
+    """worker_process_shutdown: drop the exited pool process's live gauges."""
+    if MULTIPROC_DIR:
+        multiprocess.mark_process_dead(pid or os.getpid())
+
+
+# --- Exposition ---
+
+def _registry():
+    if not MULTIPROC_DIR:
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def render():
+    """The current metrics in Prometheus text format: (body, content_type)."""
+    return generate_latest(_registry()), CONTENT_TYPE_LATEST
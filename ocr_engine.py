@@ -0,0 +1,341 @@
+import os
+import time
+import logging
+from difflib import SequenceMatcher
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+import pytesseract
+from PIL import Image
+from celery_app import CPU_THREADS_PER_TASK
+
+# Tesseract spins up OpenMP threads per process; with several processes running side by
+# side that oversubscribes the CPU. One thread each, parallelism comes from the pool.
+os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+
+log = logging.getLogger(__name__)
+
+# Number of Tesseract processes one OCR task runs at the same time (1 = serial). Defaults
+# to the task's share of the cores, so a full cpu pool doesn't oversubscribe the machine.
+OCR_WORKERS = int(os.environ.get("CORTEX_OCR_WORKERS", CPU_THREADS_PER_TASK))
+MIN_CONFIDENCE = 50
+
+# --- Preprocessing ---
+# Text regions are found on a downscaled copy of the frame; only those regions are
+# cropped (from the full-resolution frame), binarized and OCR'd.
+DETECT_WIDTH = int(os.environ.get("CORTEX_OCR_DETECT_WIDTH", 1280))
+MIN_REGION_HEIGHT = 8           # px at DETECT_WIDTH; smaller blobs are noise
+MAX_REGION_HEIGHT_FRACTION = 0.25
+MIN_REGION_FILL = 0.15          # share of edge pixels in a text region's box
+MAX_REGIONS = 60
+TARGET_TEXT_HEIGHT = 40         # px; small crops are upscaled to about this for Tesseract
+MAX_UPSCALE = 3.0
+CROP_PADDING = 4                # px around each region, in the full-resolution frame
+STRIP_GAP = 24                  # px of white between crops in the OCR strip
+ADAPTIVE_BLOCK_SIZE = 31
+ADAPTIVE_C = 10
+TESSERACT_CONFIG = "--psm 4"    # a single column of text of variable sizes
+
+# Part of the OCR cache key: changing any of these changes the results
+PREPROCESS_SETTINGS = {
+    "detect_width": DETECT_WIDTH,
+    "min_region_height": MIN_REGION_HEIGHT,
+    "max_region_height_fraction": MAX_REGION_HEIGHT_FRACTION,
+    "min_region_fill": MIN_REGION_FILL,
+    "max_regions": MAX_REGIONS,
+    "target_text_height": TARGET_TEXT_HEIGHT,
+    "adaptive": [ADAPTIVE_BLOCK_SIZE, ADAPTIVE_C],
+    "tesseract_config": TESSERACT_CONFIG,
+}
+
+
+def _merge_same_line(regions: list) -> list:
+    """Joins boxes that sit on the same line with a gap of less than about two characters."""
+    merged = []
+    for x, y, w, h in sorted(regions, key=lambda r: r[0]):
+        for i, (mx, my, mw, mh) in enumerate(merged):
+            overlap = min(y + h, my + mh) - max(y, my)
+            if overlap > 0.5 * min(h, mh) and x - (mx + mw) < 2 * max(h, mh):
+                x0, y0 = min(x, mx), min(y, my)
+                merged[i] = (x0, y0, max(x + w, mx + mw) - x0, max(y + h, my + mh) - y0)
+                break
+        else:
+            merged.append((x, y, w, h))
+    return merged
+
+
+def detect_text_regions(gray: np.ndarray) -> list:
+    """
+    Candidate text lines in a grayscale frame, as (x, y, w, h) boxes in its coordinates.
+
+    Morphological detection: the morphological gradient lights up character edges whether
+    the text is dark-on-light or light-on-dark, Otsu keeps the strong edges, and a wide,
+    flat closing joins neighbouring characters into words and lines. Boxes that are too
+    small, too tall, or too empty inside to be text are dropped.
+    """
+    height, width = gray.shape[:2]
+    scale = min(1.0, DETECT_WIDTH / width)
+    small = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1.0 else gray
+
+    gradient = cv2.morphologyEx(small, cv2.MORPH_GRADIENT, cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3)))
+    _, edges = cv2.threshold(gradient, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+    join = cv2.getStructuringElement(cv2.MORPH_RECT, (max(9, small.shape[1] // 80), 3))
+    joined = cv2.morphologyEx(edges, cv2.MORPH_CLOSE, join)
+
+    contours, _ = cv2.findContours(joined, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    max_height = MAX_REGION_HEIGHT_FRACTION * small.shape[0]
+    regions = []
+    for contour in contours:
+        x, y, w, h = cv2.boundingRect(contour)
+        if h < MIN_REGION_HEIGHT or h > max_height or w < h // 2:
+            continue
+        if cv2.countNonZero(edges[y:y + h, x:x + w]) < MIN_REGION_FILL * w * h:
+            continue
+        regions.append((int(x / scale), int(y / scale), int(round(w / scale)), int(round(h / scale))))
+
+    # Biggest first when capping, then in reading order
+    regions = sorted(_merge_same_line(regions), key=lambda r: r[2] * r[3], reverse=True)[:MAX_REGIONS]
+    return sorted(regions, key=lambda r: (r[1], r[0]))
+
+
+def binarize_region(crop: np.ndarray) -> np.ndarray:
+    """
+    Adaptive threshold to dark text on a white background. Light-on-dark crops (judged
+    by the border, which is background) are inverted first.
+    """
+    otsu, _ = cv2.threshold(crop, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+    border = np.concatenate([crop[0], crop[-1], crop[:, 0], crop[:, -1]])
+    if np.median(border) < otsu:
+        crop = cv2.bitwise_not(crop)
+    block = min(ADAPTIVE_BLOCK_SIZE, (min(crop.shape[:2]) // 2) * 2 + 1)
+    if block < 3:
+        return crop
+    return cv2.adaptiveThreshold(crop, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, block, ADAPTIVE_C)
+
+
+def build_strip(gray: np.ndarray, regions: list):
+    """
+    Crops, binarizes and upscales every region, then stacks them on one white strip so
+    Tesseract runs once per frame instead of once per region.
+    Returns (strip, placements) with one (strip_top, strip_bottom, x, y, scale) per region.
+    """
+    height, width = gray.shape[:2]
+    crops = []
+    for x, y, w, h in regions:
+        x0, y0 = max(0, x - CROP_PADDING), max(0, y - CROP_PADDING)
+        x1, y1 = min(width, x + w + CROP_PADDING), min(height, y + h + CROP_PADDING)
+        crop = binarize_region(gray[y0:y1, x0:x1])
+        scale = min(MAX_UPSCALE, max(1.0, TARGET_TEXT_HEIGHT / max(1, h)))
+        if scale > 1.0:
+            crop = cv2.resize(crop, None, fx=scale, fy=scale, interpolation=cv2.INTER_CUBIC)
+        crops.append((crop, x0, y0, scale))
+
+    strip_width = max(crop.shape[1] for crop, *_ in crops) + 2 * STRIP_GAP
+    strip_height = sum(crop.shape[0] + STRIP_GAP for crop, *_ in crops) + STRIP_GAP
+    strip = np.full((strip_height, strip_width), 255, dtype=np.uint8)
+    placements = []
+    top = STRIP_GAP
+    for crop, x0, y0, scale in crops:
+        h, w = crop.shape[:2]
+        strip[top:top + h, STRIP_GAP:STRIP_GAP + w] = crop
+        placements.append((top, top + h, x0, y0, scale))
+        top += h + STRIP_GAP
+    return strip, placements
+
+
+def _lines(data: dict, placements: list, timestamp_sec: float) -> list:
+    """Groups Tesseract's words into lines (per region, block, paragraph and line) with frame-space boxes."""
+    lines = {}
+    for i in range(len(data['text'])):
+        text = data['text'][i].strip()
+        confidence = float(data['conf'][i])
+        if not text or confidence <= MIN_CONFIDENCE:
+            continue
+        middle = data['top'][i] + data['height'][i] / 2
+        region = next((r for r, (top, bottom, *_) in enumerate(placements) if top <= middle < bottom), None)
+        if region is None:
+            continue
+        top, _, x0, y0, scale = placements[region]
+        left = x0 + (data['left'][i] - STRIP_GAP) / scale
+        upper = y0 + (data['top'][i] - top) / scale
+        box = (left, upper, left + data['width'][i] / scale, upper + data['height'][i] / scale)
+
+        key = (region, data['block_num'][i], data['par_num'][i], data['line_num'][i])
+        line = lines.setdefault(key, {"words": [], "confidences": [], "box": list(box)})
+        line["words"].append(text)
+        line["confidences"].append(confidence)
+        line["box"] = [min(line["box"][0], box[0]), min(line["box"][1], box[1]),
+                       max(line["box"][2], box[2]), max(line["box"][3], box[3])]
+
+    results = []
+    for key in sorted(lines, key=lambda k: (lines[k]["box"][1], lines[k]["box"][0])):
+        line = lines[key]
+        x0, y0, x1, y1 = line["box"]
+        results.append({
+            "timestamp": timestamp_sec,
+            "text": " ".join(line["words"]),
+            "confidence": round(sum(line["confidences"]) / len(line["confidences"]), 1),
+            "bbox": [int(round(x0)), int(round(y0)), int(round(x1 - x0)), int(round(y1 - y0))],
+        })
+    return results
+
+
+def ocr_frame(sample: dict):
+    """
+    OCRs one sampled frame ({"timestamp", "path"}): detect text regions, binarize the
+    crops, OCR them in a single Tesseract call.
+    Returns (lines, latency_seconds); each line is {"timestamp", "text", "confidence",
+    "bbox": [x, y, w, h]} in the frame's pixel coordinates.
+    """
+    started = time.perf_counter()
+    timestamp_sec = sample["timestamp"]
+
+    gray = cv2.imread(sample["path"], cv2.IMREAD_GRAYSCALE)
+    if gray is None:
+        raise IOError(f"Could not read sampled frame {sample['path']}")
+
+    regions = detect_text_regions(gray)
+    if not regions:
+        return [], time.perf_counter() - started
+
+    strip, placements = build_strip(gray, regions)
+    data = pytesseract.image_to_data(Image.fromarray(strip), config=TESSERACT_CONFIG,
+                                     output_type=pytesseract.Output.DICT)
+    return _lines(data, placements, timestamp_sec), time.perf_counter() - started
+
+
+# --- Cross-frame text spans ---
+# A slide that stays up for a minute is OCR'd at every sample; instead of repeating its
+# lines per frame, each line becomes one span with the times it was first and last seen.
+SPAN_MAX_MISSED = 1       # sampled frames a line may drop out of (OCR misses) and still continue
+SPAN_SIMILARITY = 0.8     # text similarity for matching noisy OCR of the same line...
+SPAN_MIN_IOU = 0.5        # ...at (about) the same place on screen
+
+SPAN_SETTINGS = {
+    "max_missed": SPAN_MAX_MISSED,
+    "similarity": SPAN_SIMILARITY,
+    "min_iou": SPAN_MIN_IOU,
+}
+
+
+def _normalize(text: str) -> str:
+    return " ".join(text.split()).casefold()
+
+
+def _iou(a: list, b: list) -> float:
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    w = min(ax + aw, bx + bw) - max(ax, bx)
+    h = min(ay + ah, by + bh) - max(ay, by)
+    if w <= 0 or h <= 0:
+        return 0.0
+    inter = w * h
+    return inter / (aw * ah + bw * bh - inter)
+
+
+def _extend(span: dict, line: dict, key: str, timestamp: float, index: int):
+    span["last_seen"] = timestamp
+    span["frames"] += 1
+    span["_last"] = index
+    if line["confidence"] > span["confidence"]:
+        span.update(text=line["text"], confidence=line["confidence"], bbox=line["bbox"], _key=key)
+
+
+def build_spans(frames: list) -> list:
+    """
+    Merges per-frame OCR lines into text spans.
+
+    `frames` yields (timestamp, lines) for every sampled frame in time order, including
+    frames where nothing was read. A line continues an open span when its normalized text
+    is identical, or similar enough (SPAN_SIMILARITY) at an overlapping place (SPAN_MIN_IOU);
+    a span closes once its line is missing for more than SPAN_MAX_MISSED frames in a row.
+    Each span keeps its most confident reading.
+
+    Returns [{"first_seen", "last_seen", "text", "confidence", "bbox", "frames"}] ordered by first_seen.
+    """
+    spans = []
+    open_spans = []
+    for index, (timestamp, lines) in enumerate(frames):
+        open_spans = [span for span in open_spans if index - span["_last"] <= SPAN_MAX_MISSED + 1]
+        taken = set()
+        fuzzy = []
+        # Exact matches first, so a noisy reading can't steal a line's span
+        for line in lines:
+            key = _normalize(line["text"])
+            if not key:
+                continue
+            span = next((s for s in open_spans if id(s) not in taken and s["_key"] == key), None)
+            if span is None:
+                fuzzy.append((line, key))
+                continue
+            taken.add(id(span))
+            _extend(span, line, key, timestamp, index)
+
+        for line, key in fuzzy:
+            span = next((
+                s for s in open_spans
+                if id(s) not in taken
+                and _iou(s["bbox"], line["bbox"]) >= SPAN_MIN_IOU
+                and SequenceMatcher(None, s["_key"], key).ratio() >= SPAN_SIMILARITY
+            ), None)
+            if span is None:
+                span = {"first_seen": timestamp, "last_seen": timestamp, "text": line["text"],
+                        "confidence": line["confidence"], "bbox": line["bbox"], "frames": 0,
+                        "_key": key, "_last": index}
+                spans.append(span)
+                open_spans.append(span)
+            taken.add(id(span))
+            _extend(span, line, key, timestamp, index)
+
+    for span in spans:
+        del span["_key"], span["_last"]
+    return spans
+
+
+def join_spans(spans: list, max_gap: float) -> list:
+    """Joins spans of identical text at most `max_gap` seconds apart (e.g. split at a shard boundary)."""
+    joined = []
+    last_by_text = {}
+    for span in sorted(spans, key=lambda s: s["first_seen"]):
+        key = _normalize(span["text"])
+        previous = last_by_text.get(key)
+        if previous is not None and span["first_seen"] - previous["last_seen"] <= max_gap:
+            previous["last_seen"] = max(previous["last_seen"], span["last_seen"])
+            previous["frames"] += span["frames"]
+            if span["confidence"] > previous["confidence"]:
+                previous.update(text=span["text"], confidence=span["confidence"], bbox=span["bbox"])
+            continue
+        span = dict(span)
+        joined.append(span)
+        last_by_text[key] = span
+    return joined
+
+
+def ocr_samples(samples: list, workers: int = OCR_WORKERS):
+    """
+    Fans the sampled frames out to `workers` concurrent Tesseract processes.
+
+    pytesseract runs every call as a separate `tesseract` process, so each pool thread
+    simply drives its own process (and OpenCV releases the GIL while preprocessing).
+    A thread pool is used rather than a process pool because Celery's prefork workers
+    are daemonic and may not start child process pools of their own.
+
+    Yields (sample, results, latency_seconds, error) in the original (timestamp) order.
+    TesseractNotFoundError is raised immediately; any other per-frame error is yielded.
+    """
+    workers = max(1, min(workers, len(samples) or 1))
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ocr") as pool:
+        futures = [pool.submit(ocr_frame, sample) for sample in samples]
+        try:
+            for sample, future in zip(samples, futures):
+                try:
+                    results, latency = future.result()
+                    yield sample, results, latency, None
+                except pytesseract.TesseractNotFoundError:
+                    raise
+                except Exception as e:
+                    yield sample, [], 0.0, e
+        finally:
+            for future in futures:
+                future.cancel()
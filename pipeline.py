@@ -0,0 +1,199 @@
+import os
+from celery import chain, chord, group
+from frame_sampler import probe_video
+import storage
+from scheduling import PRIORITIES
+from tasks import (
+    transcribe_video,
+    sample_frames,
+    extract_static_data,
+    describe_motion,
+    merge_contexts,
+    stitch_shards,
+    fuse_data,
+    synthesize_knowledge
+)
+
+# Default shard length for long videos (seconds). 0 = never shard.
+SHARD_SECONDS = int(os.environ.get("CORTEX_SHARD_SECONDS", 0))
+# Broker priority of jobs built without one (scheduling.PRIORITIES["normal"])
+DEFAULT_PRIORITY = PRIORITIES["normal"]
+
+# --- Time limits ---
+# Hard limit per task = (base + per_video_second x seconds of video) x scale, so a stuck
+# task on a short clip is killed in minutes while a long video still gets the time it needs.
+# The soft limit (SoftTimeLimitExceeded inside the task) comes a little earlier.
+# Note: limits are enforced by the prefork pool only (the io queue's thread pool ignores
+# them; the API clients there have their own timeouts and retry caps).
+TIME_LIMITS = {
+    # task: (base seconds, seconds per second of video)
+    "tasks.transcribe_video": (120, 2.0),
+    "tasks.sample_frames": (60, 0.5),
+    "tasks.extract_static_data": (60, 1.5),
+    "tasks.describe_motion": (120, 1.0),
+    "tasks.merge_contexts": (60, 0.0),
+    "tasks.stitch_shards": (60, 0.02),
+    "tasks.fuse_data": (60, 0.02),
+    "tasks.synthesize_knowledge": (300, 0.2),
+}
+TIME_LIMIT_SCALE = float(os.environ.get("CORTEX_TIME_LIMIT_SCALE", 1.0))
+SOFT_LIMIT_FRACTION = 0.9
+
+
+def time_limits(task_name: str, seconds: float) -> dict:
+    """apply_async options limiting `task_name` on `seconds` of video (none if the duration is unknown)."""
+    if not seconds or seconds <= 0:
+        return {}
+    base, per_second = TIME_LIMITS[task_name]
+    hard = int((base + per_second * seconds) * TIME_LIMIT_SCALE)
+    return {"time_limit": hard, "soft_time_limit": int(hard * SOFT_LIMIT_FRACTION)}
+
+
+def _sig(task, seconds: float, priority: int, *args):
+    return task.s(*args).set(priority=priority, **time_limits(task.name, seconds))
+
+
+def _extractors(context: dict, seconds: float, priority: int):
+    """Modules 1-3 for one context: Whisper, plus the frame sampler feeding OCR and Vision."""
+    return [
+        _sig(transcribe_video, seconds, priority, context),
+        chain(
+            _sig(sample_frames, seconds, priority, context),
+            group(_sig(extract_static_data, seconds, priority), _sig(describe_motion, seconds, priority))
+        )
+    ]
+
+
+def plan_shards(duration: float, shard_seconds: int):
+    """Splits [0, duration) into consecutive [start, end) time ranges of `shard_seconds`."""
+    if not shard_seconds or shard_seconds <= 0 or duration <= shard_seconds:
+        return [(0.0, duration)]
+    shards = []
+    start = 0.0
+    while start < duration:
+        shards.append((start, min(start + shard_seconds, duration)))
+        start += shard_seconds
+    return shards
+
+
+def build_pipeline(context: dict, shard_seconds: int = SHARD_SECONDS):
+    """
+    Builds the Celery canvas for one video.
+
+    Modules 1-3 are independent, so they run as a group (on whichever workers are free):
+      - Module 1 (Whisper) straight from the video
+      - the shared frame sampler, then Modules 2 (OCR) and 3 (Vision) side by side
+    The chord body waits for all of them, merges their contexts, then fuses and synthesizes.
+    End-to-end latency is the slowest extractor plus fusion and synthesis.
+
+    With `shard_seconds`, videos longer than that are split into time ranges and every
+    shard gets its own Modules 1-3 tasks (reading its range of the original file, no
+    re-encode), so long videos spread over all workers. stitch_shards puts the pieces
+    back together on the original timeline before fusion.
+
+    Every task gets time limits scaled to the video (or shard) duration and the job's
+    context["priority"] (see scheduling.py); queues are picked by the routes in celery_app.py.
+    The video is probed here unless the caller already did (context["video"]).
+    """
+    if "video" not in context:
+        context["video"] = probe_video(storage.video_source(context["paths"]["original"]))
+    context["shard_seconds"] = shard_seconds  # so a re-run from extraction shards the same way
+    duration = context["video"]["duration"]
+    priority = context.get("priority", DEFAULT_PRIORITY)
+    shards = plan_shards(duration, shard_seconds)
+
+    if len(shards) == 1:
+        return chord(
+            group(*_extractors(context, duration, priority)),
+            chain(
+                _sig(merge_contexts, duration, priority),
+                _sig(fuse_data, duration, priority),
+                _sig(synthesize_knowledge, duration, priority)
+            )
+        )
+
+    header = []
+    for index, (start, end) in enumerate(shards):
+        shard_context = dict(context)
+        shard_context["paths"] = dict(context["paths"])
+        shard_context["parent_id"] = context["processing_id"]
+        shard_context["processing_id"] = f"{context['processing_id']}_shard{index:03d}"
+        shard_context["shard"] = {"index": index, "start": start, "end": end}
+        header.extend(_extractors(shard_context, end - start, priority))
+
+    return chord(
+        group(*header),
+        chain(
+            _sig(stitch_shards, duration, priority),
+            _sig(fuse_data, duration, priority),
+            _sig(synthesize_knowledge, duration, priority)
+        )
+    )
+
+
+# --- Re-analysis ---
+# A finished job can be re-run from a later stage with new parameters (context["params"]).
+# Stages in pipeline order, and the stage each parameter is first read by:
+RERUN_STAGES = ("extraction", "fusion", "synthesis")
+RERUN_PARAMS = {
+    "time_step_seconds": ("fusion", int),
+    "synthesis_prompt": ("synthesis", str),
+    "synthesis_batch_tokens": ("synthesis", int),
+}
+# Stored artifacts (keys of context["paths"]) each stage reads. Cache entries can be
+# evicted after the job finished, so a re-run checks they are still there before queuing.
+RERUN_INPUTS = {
+    "extraction": ("original",),
+    "fusion": ("transcription", "ocr", "motion"),
+    "synthesis": ("fused",),
+}
+
+
+def rerun_stage(params: dict, stage: str = None) -> str:
+    """
+    The stage a re-run starts from: `stage` if given, otherwise the earliest stage that
+    reads one of `params`. Raises ValueError for unknown stages or parameters, and when
+    `stage` comes after a stage that reads one of the parameters.
+    """
+    unknown = sorted(set(params) - set(RERUN_PARAMS))
+    if unknown:
+        raise ValueError(f"Unknown parameters: {', '.join(unknown)} (expected {', '.join(RERUN_PARAMS)}).")
+    for name, value in params.items():
+        expected = RERUN_PARAMS[name][1]
+        if not isinstance(value, expected) or isinstance(value, bool):
+            raise ValueError(f"Parameter '{name}' must be of type {expected.__name__}.")
+    if params.get("time_step_seconds", 1) <= 0 or params.get("synthesis_batch_tokens", 1) <= 0:
+        raise ValueError("time_step_seconds and synthesis_batch_tokens must be positive.")
+    if "synthesis_prompt" in params and "{raw_data}" not in params["synthesis_prompt"]:
+        raise ValueError("synthesis_prompt must contain the {raw_data} placeholder.")
+
+    needed = min((RERUN_STAGES.index(RERUN_PARAMS[name][0]) for name in params), default=len(RERUN_STAGES) - 1)
+    if stage is None:
+        return RERUN_STAGES[needed]
+    if stage not in RERUN_STAGES:
+        raise ValueError(f"Unknown stage '{stage}' (expected one of {', '.join(RERUN_STAGES)}).")
+    if RERUN_STAGES.index(stage) > needed:
+        raise ValueError(f"The parameters given are read before '{stage}'; re-run from '{RERUN_STAGES[needed]}'.")
+    return stage
+
+
+def missing_rerun_inputs(context: dict, stage: str) -> list:
+    """The artifacts a re-run of `context` from `stage` reads that are no longer stored."""
+    paths = context.get("paths", {})
+    return [name for name in RERUN_INPUTS[stage] if not paths.get(name) or not storage.exists(paths[name])]
+
+
+def build_rerun(context: dict, stage: str):
+    """
+    Builds the canvas re-running a finished job (its saved context, see tasks.load_job_context)
+    from `stage`. Everything upstream is reused as is: the paths and cache keys in the saved
+    context point at the stored artifacts, and every task checks the cache first, so only
+    the stages whose parameters (or inputs) changed are actually recomputed.
+    """
+    duration = (context.get("video") or {}).get("duration")
+    priority = context.get("priority", DEFAULT_PRIORITY)
+    if stage == "extraction":
+        return build_pipeline(context, shard_seconds=context.get("shard_seconds", SHARD_SECONDS))
+    if stage == "fusion":
+        return chain(_sig(fuse_data, duration, priority, context), _sig(synthesize_knowledge, duration, priority))
+    return _sig(synthesize_knowledge, duration, priority, context)
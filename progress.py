@@ -0,0 +1,109 @@
+import os
+import json
+import time
+import logging
+import redis
+from celery_app import CELERY_BROKER_URL
+
+log = logging.getLogger(__name__)
+
+# --- Progress events ---
+# Every module appends events to a Redis stream per job ("cortex:progress:<job id>").
+# main.py's /progress/{processing_id} endpoint relays them to the client as server-sent
+# events, so the frontend sees progress and partial results (transcript, OCR text,
+# frame descriptions) as they are produced instead of polling for the final report.
+PROGRESS_REDIS_URL = os.environ.get("CORTEX_PROGRESS_REDIS_URL", CELERY_BROKER_URL)
+STREAM_MAXLEN = 5000
+STREAM_TTL_SECONDS = 24 * 3600
+MIN_PUBLISH_INTERVAL_SECONDS = 1.0
+# Final events: the SSE stream closes after one of these
+TERMINAL_EVENTS = ("done", "failed")
+
+_client = None
+
+
+def _redis():
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(PROGRESS_REDIS_URL)
+    return _client
+
+
+def stream_key(job_id: str) -> str:
+    return f"cortex:progress:{job_id}"
+
+
+def job_id(context: dict) -> str:
+    """Shards report under their parent job."""
+    return context.get("parent_id") or context["processing_id"]
+
+
+def publish(context: dict, stage: str, event: str = "progress", **data):
+    """
+    Appends one event for the job. Progress is best-effort: a Redis hiccup is logged,
+    never allowed to fail the task that reports it.
+    """
+    payload = {"stage": stage, "time": time.time(), **data}
+    shard = context.get("shard")
+    if shard:
+        payload["shard"] = shard["index"]
+    try:
+        key = stream_key(job_id(context))
+        pipe = _redis().pipeline()
+        pipe.xadd(key, {"event": event, "data": json.dumps(payload, ensure_ascii=False)},
+                  maxlen=STREAM_MAXLEN, approximate=True)
+        pipe.expire(key, STREAM_TTL_SECONDS)
+        pipe.execute()
+    except Exception as e:
+        log.warning(f"[{context.get('processing_id')}] Could not publish {event} for {stage}: {e}")
+
+
+class ProgressTracker:
+    """
+    Reports progress through `total` units of work for one stage, with percent and ETA.
+    `baseline` units were already done before this run (e.g. resumed from a checkpoint):
+    they count towards the percentage but not towards the rate the ETA is based on.
+    Partial results passed to update() are buffered and sent along with the next
+    progress event; events are throttled to one per MIN_PUBLISH_INTERVAL_SECONDS.
+    """
+
+    def __init__(self, context: dict, stage: str, total: int, baseline: int = 0):
+        self.context = context
+        self.stage = stage
+        self.total = max(0, total)
+        self.baseline = min(max(0, baseline), self.total)
+        self.started = time.monotonic()
+        self.last_sent = 0.0
+        self.partial = []
+        publish(context, stage, "started", total=self.total)
+
+    def update(self, done: int, partial: list = None):
+        if partial:
+            self.partial.extend(partial)
+        now = time.monotonic()
+        if done < self.total and now - self.last_sent < MIN_PUBLISH_INTERVAL_SECONDS:
+            return
+        self.last_sent = now
+
+        elapsed = now - self.started
+        fraction = done / self.total if self.total else 1.0
+        progressed = done - self.baseline
+        eta = elapsed * (self.total - done) / progressed if progressed > 0 else None
+        data = {
+            "done": done,
+            "total": self.total,
+            "percent": round(100.0 * fraction, 1),
+            "eta_seconds": round(eta, 1) if eta is not None else None,
+        }
+        if self.partial:
+            data["partial"] = self.partial
+            self.partial = []
+        publish(self.context, self.stage, "progress", **data)
+
+    def finish(self, **data):
+        if self.partial:
+            publish(self.context, self.stage, "progress", done=self.total, total=self.total,
+                    percent=100.0, eta_seconds=0.0, partial=self.partial)
+            self.partial = []
+        publish(self.context, self.stage, "completed",
+                elapsed_seconds=round(time.monotonic() - self.started, 2), **data)
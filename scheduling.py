@@ -0,0 +1,131 @@
+import os
+import re
+import time
+import logging
+import redis
+from celery_app import CELERY_BROKER_URL
+from progress import job_id
+
+log = logging.getLogger(__name__)
+
+# --- Priorities ---
+# Every task of a job is published with the job's priority (see pipeline._sig). With the
+# Redis broker a lower number is served first (celery_app.py sets the priority steps).
+# Short videos are interactive by default and long ones batch. A client may ask for any
+# class, but a video longer than INTERACTIVE_SECONDS is never scheduled above "normal",
+# so a pile of long uploads can't get in front of everybody's short clips.
+PRIORITIES = {"interactive": 0, "normal": 3, "batch": 6}
+INTERACTIVE_SECONDS = float(os.environ.get("CORTEX_INTERACTIVE_SECONDS", 300))
+
+# --- Fair share ---
+# Admission control per tenant, before anything is queued: a tenant may have at most
+# TENANT_MAX_JOBS jobs and TENANT_MAX_VIDEO_SECONDS of video in flight. A job over the
+# seconds budget on its own is still admitted when the tenant has nothing else running,
+# so long batch jobs always make progress, one at a time.
+# In-flight jobs are a Redis hash per tenant (job id -> "<video seconds>:<lease expiry>").
+# A job leaves it when it finishes or fails; the lease clears jobs whose worker died.
+SCHEDULER_REDIS_URL = os.environ.get("CORTEX_SCHEDULER_REDIS_URL", CELERY_BROKER_URL)
+DEFAULT_TENANT = "default"
+TENANT_PATTERN = re.compile(r"[A-Za-z0-9_.-]{1,64}")
+TENANT_MAX_JOBS = int(os.environ.get("CORTEX_TENANT_MAX_JOBS", 4))
+TENANT_MAX_VIDEO_SECONDS = float(os.environ.get("CORTEX_TENANT_MAX_VIDEO_SECONDS", 4 * 3600))
+JOB_LEASE_SECONDS = int(os.environ.get("CORTEX_JOB_LEASE_SECONDS", 24 * 3600))
+# What a rejected client is told to wait before trying again
+RETRY_AFTER_SECONDS = 30
+
+# KEYS[1] tenant hash; ARGV: job id, video seconds, now, lease, max jobs, max seconds.
+# Returns {admitted (0/1), reason, jobs in flight, seconds in flight}.
+_ADMIT_SCRIPT = """
+local now = tonumber(ARGV[3])
+local jobs, total = 0, 0
+local entries = redis.call('HGETALL', KEYS[1])
+for i = 1, #entries, 2 do
+    local seconds, expires = string.match(entries[i + 1], '([^:]+):([^:]+)')
+    if tonumber(expires) < now then
+        redis.call('HDEL', KEYS[1], entries[i])
+    else
+        jobs = jobs + 1
+        total = total + tonumber(seconds)
+    end
+end
+if jobs >= tonumber(ARGV[5]) then
+    return {0, 'jobs', jobs, tostring(total)}
+end
+if jobs > 0 and total + tonumber(ARGV[2]) > tonumber(ARGV[6]) then
+    return {0, 'seconds', jobs, tostring(total)}
+end
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[2] .. ':' .. tostring(now + tonumber(ARGV[4])))
+return {1, 'ok', jobs + 1, tostring(total + tonumber(ARGV[2]))}
+"""
+
+
+class AdmissionRejected(Exception):
+    """The tenant is at its limit; the job should be submitted again later (maps to HTTP 429)."""
+
+    def __init__(self, message: str, retry_after: int = RETRY_AFTER_SECONDS):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+_client = None
+_admit = None
+
+
+def _redis():
+    global _client, _admit
+    if _client is None:
+        _client = redis.Redis.from_url(SCHEDULER_REDIS_URL)
+        _admit = _client.register_script(_ADMIT_SCRIPT)
+    return _client
+
+
+def tenant_key(tenant: str) -> str:
+    return f"cortex:tenant:{tenant}:jobs"
+
+
+def job_priority(duration: float, requested: str = None) -> int:
+    """Broker priority for a job on `duration` seconds of video (ValueError for an unknown class)."""
+    if requested is None:
+        requested = "interactive" if duration <= INTERACTIVE_SECONDS else "batch"
+    if requested not in PRIORITIES:
+        raise ValueError(f"Unknown priority '{requested}' (expected one of {', '.join(PRIORITIES)}).")
+    priority = PRIORITIES[requested]
+    if duration > INTERACTIVE_SECONDS:
+        priority = max(priority, PRIORITIES["normal"])
+    return priority
+
+
+def admit(tenant: str, processing_id: str, seconds: float):
+    """
+    Reserves a slot for the job in the tenant's share, or raises AdmissionRejected.
+    Admission is best-effort like progress: if Redis can't be reached, the job is let through.
+    """
+    try:
+        _redis()
+        admitted, reason, jobs, total = _admit(
+            keys=[tenant_key(tenant)],
+            args=[processing_id, round(seconds, 3), time.time(), JOB_LEASE_SECONDS,
+                  TENANT_MAX_JOBS, TENANT_MAX_VIDEO_SECONDS]
+        )
+    except redis.RedisError as e:
+        log.warning(f"[{processing_id}] Admission control unavailable, admitting without it: {e}")
+        return
+    if not admitted:
+        reason = reason.decode() if isinstance(reason, bytes) else reason
+        if reason == "jobs":
+            raise AdmissionRejected(f"Tenant '{tenant}' already has {jobs} jobs in progress (limit {TENANT_MAX_JOBS}).")
+        raise AdmissionRejected(
+            f"Tenant '{tenant}' already has {float(total) / 60:.0f} minutes of video in progress "
+            f"(limit {TENANT_MAX_VIDEO_SECONDS / 60:.0f}); this one adds {seconds / 60:.0f}."
+        )
+    log.info(f"[{processing_id}] Admitted for tenant '{tenant}' ({jobs} jobs, {float(total):.0f}s of video in flight)")
+
+
+def release(context: dict):
+    """Frees the job's slot in its tenant's share. Safe to call more than once; never raises."""
+    if "tenant" not in context:
+        return
+    try:
+        _redis().hdel(tenant_key(context["tenant"]), job_id(context))
+    except Exception as e:
+        log.warning(f"[{context.get('processing_id')}] Could not release the tenant slot: {e}")
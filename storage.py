@@ -0,0 +1,203 @@
+import os
+import shutil
+import logging
+from urllib.parse import urlparse
+
+log = logging.getLogger(__name__)
+
+# --- Artifact store ---
+# Tasks pass artifacts to each other as references: keys relative to the store, such as
+# "videos/<sha256>.mp4", "cache/<cache key>/ocr_data.cols" or "jobs/<processing id>/...".
+# Every node keeps a local copy of what it has written or read under LOCAL_ROOT, laid out
+# exactly like the store, so a reference resolves to the same relative path everywhere:
+#   - LocalStore (default): LOCAL_ROOT *is* the store; single machine or shared volume
+#   - S3Store (CORTEX_STORE_URL=s3://bucket/prefix): LOCAL_ROOT is a read-through cache
+#     of the bucket; works with any S3-compatible server (CORTEX_S3_ENDPOINT_URL, e.g. MinIO)
+LOCAL_ROOT = os.environ.get("CORTEX_STORAGE_DIR", "video_processing_storage")
+STORE_URL = os.environ.get("CORTEX_STORE_URL", "")
+S3_ENDPOINT_URL = os.environ.get("CORTEX_S3_ENDPOINT_URL")
+# Lifetime of the presigned URLs ffmpeg / OpenCV read remote videos through
+PRESIGNED_URL_SECONDS = int(os.environ.get("CORTEX_PRESIGNED_URL_SECONDS", 6 * 3600))
+# Read remote videos in place (HTTP range requests) instead of downloading them first.
+# Shards then only transfer their own time range.
+STREAM_VIDEOS = os.environ.get("CORTEX_STREAM_VIDEOS", "1").lower() in ("1", "true", "yes")
+
+os.makedirs(LOCAL_ROOT, exist_ok=True)
+
+
+class LocalStore:
+    """The store is a directory on this machine (or a volume shared by all of them)."""
+
+    remote = False
+
+    def __init__(self, root: str = LOCAL_ROOT):
+        self.root = root
+
+    def local_path(self, key: str) -> str:
+        """Where `key` lives (or is cached) on this machine."""
+        return os.path.join(self.root, *key.split("/"))
+
+    def put(self, key: str, last: str = None):
+        """Publishes the file or directory written at local_path(key). Nothing to do locally."""
+
+    def ingest(self, key: str, src_path: str):
+        """Moves a finished local file into the store as `key` (a duplicate of an existing key is dropped)."""
+        target = self.local_path(key)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if os.path.exists(target):
+            os.remove(src_path)
+        else:
+            shutil.move(src_path, target)
+
+    def exists(self, key: str) -> bool:
+        return os.path.exists(self.local_path(key))
+
+    def delete(self, key: str):
+        """Removes the file `key` (here and, for remote stores, from the store)."""
+        path = self.local_path(key)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def fetch(self, key: str) -> str:
+        """Local path of `key` (file or directory), downloading it first if needed."""
+        path = self.local_path(key)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Artifact '{key}' not found in {self.root}.")
+        return path
+
+    def url(self, key: str) -> str:
+        """Something ffmpeg and OpenCV can open to read `key`."""
+        return self.fetch(key)
+
+
+class S3Store(LocalStore):
+    """Objects in an S3-compatible bucket; LocalStore's root is the local read-through cache."""
+
+    remote = True
+
+    def __init__(self, bucket: str, prefix: str = "", endpoint_url: str = S3_ENDPOINT_URL, root: str = LOCAL_ROOT):
+        try:
+            import boto3
+        except ImportError:
+            raise ImportError("CORTEX_STORE_URL points at S3 but boto3 is not installed (pip install boto3).")
+        super().__init__(root)
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.client = boto3.client("s3", endpoint_url=endpoint_url)
+
+    def _object(self, key: str) -> str:
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def _list(self, key: str):
+        """Object names under directory `key`, relative to it."""
+        prefix = self._object(key) + "/"
+        for page in self.client.get_paginator("list_objects_v2").paginate(Bucket=self.bucket, Prefix=prefix):
+            for item in page.get("Contents", []):
+                yield item["Key"][len(prefix):]
+
+    def put(self, key: str, last: str = None):
+        """
+        Uploads the file or directory at local_path(key). For directories, the file named
+        `last` (e.g. a completion marker) is uploaded after everything else.
+        """
+        path = self.local_path(key)
+        if os.path.isfile(path):
+            self.client.upload_file(path, self.bucket, self._object(key))
+            return
+        names = []
+        for directory, _, files in os.walk(path):
+            for name in files:
+                names.append(os.path.relpath(os.path.join(directory, name), path).replace(os.sep, "/"))
+        names.sort(key=lambda name: name == last)
+        for name in names:
+            self.client.upload_file(os.path.join(path, *name.split("/")), self.bucket, f"{self._object(key)}/{name}")
+
+    def ingest(self, key: str, src_path: str):
+        """Uploads a finished local file as `key`; the local file is removed (this node may never need it)."""
+        if not self.exists(key):
+            self.client.upload_file(src_path, self.bucket, self._object(key))
+        os.remove(src_path)
+
+    def delete(self, key: str):
+        super().delete(key)
+        self.client.delete_object(Bucket=self.bucket, Key=self._object(key))
+
+    def exists(self, key: str) -> bool:
+        if os.path.exists(self.local_path(key)):
+            return True
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._object(key))
+            return True
+        except self.client.exceptions.ClientError:
+            return next(iter(self._list(key)), None) is not None
+
+    def fetch(self, key: str) -> str:
+        path = self.local_path(key)
+        if os.path.exists(path):
+            return path
+
+        # Download next to the target and rename, so concurrent readers never see half a file
+        tmp = f"{path}.download-{os.getpid()}"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            try:
+                self.client.download_file(self.bucket, self._object(key), tmp)
+            except self.client.exceptions.ClientError:
+                names = list(self._list(key))
+                if not names:
+                    raise FileNotFoundError(f"Artifact '{key}' not found in s3://{self.bucket}/{self.prefix}.")
+                for name in names:
+                    target = os.path.join(tmp, *name.split("/"))
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    self.client.download_file(self.bucket, f"{self._object(key)}/{name}", target)
+            if not os.path.exists(path):
+                os.replace(tmp, path)
+        finally:
+            if os.path.isdir(tmp):
+                shutil.rmtree(tmp, ignore_errors=True)
+            elif os.path.exists(tmp):
+                os.remove(tmp)
+        log.info(f"Fetched {key} from the store")
+        return path
+
+    def url(self, key: str) -> str:
+        """A presigned URL: ffmpeg and OpenCV read it with HTTP range requests, only fetching what they seek to."""
+        if os.path.exists(self.local_path(key)) or not STREAM_VIDEOS:
+            return self.fetch(key)
+        return self.client.generate_presigned_url(
+            "get_object", Params={"Bucket": self.bucket, "Key": self._object(key)}, ExpiresIn=PRESIGNED_URL_SECONDS
+        )
+
+
+def open_store(url: str = STORE_URL) -> LocalStore:
+    parsed = urlparse(url)
+    if parsed.scheme in ("", "file"):
+        return LocalStore(LOCAL_ROOT)
+    if parsed.scheme == "s3":
+        return S3Store(parsed.netloc, parsed.path)
+    raise ValueError(f"Unsupported CORTEX_STORE_URL scheme '{parsed.scheme}' (expected s3:// or file://).")
+
+
+STORE = open_store()
+
+
+def fetch(ref: str) -> str:
+    """Local path for an artifact reference. Absolute paths (files outside the store) pass through."""
+    if os.path.isabs(ref):
+        return ref
+    return STORE.fetch(ref)
+
+
+def exists(ref: str) -> bool:
+    """Whether an artifact reference can still be fetched (absolute paths: whether the file is there)."""
+    if os.path.isabs(ref):
+        return os.path.exists(ref)
+    return STORE.exists(ref)
+
+
+def video_source(ref: str) -> str:
+    """What to hand ffmpeg / OpenCV for a video reference: a local path or a presigned URL."""
+    if os.path.isabs(ref):
+        return ref
+    return STORE.url(ref)
@@ -0,0 +1,201 @@
+import os
+import json
+import time
+import logging
+import metrics
+
+log = logging.getLogger(__name__)
+
+# --- Configuration ---
+SYNTHESIS_MODEL = "llama-3.1-8b-instant"
+# Token budget for the data in one LLM call. Timelines that fit go out in a single call;
+# longer ones are split into batches of time chunks (map), then combined (reduce).
+SYNTHESIS_BATCH_TOKENS = int(os.environ.get("CORTEX_SYNTHESIS_BATCH_TOKENS", 6000))
+SYNTHESIS_CONCURRENCY = int(os.environ.get("CORTEX_SYNTHESIS_CONCURRENCY", 4))
+
+SYNTHESIS_PROMPT = """
+        You are a technical analyst. You will receive a JSON object representing a video,
+        broken down into time chunks. Each chunk contains:
+        1. "spoken": The raw transcription (may contain errors).
+        2. "on_screen_text": A list of de-duplicated lines of text found by Tesseract.
+           (e.g., ["HOW NVIDIA AND", "OPEN AI"])
+        3. "visuals": A description of the on-screen action.
+
+        Your task is to synthesize this raw data into a clean, comprehensive markdown report.
+        Perform the following actions:
+        - Re-assemble the "on_screen_text" lines into coherent sentences or labels.
+        - SUMMARIZE what is happening in each time chunk by combining the spoken
+          text, the (now re-assembled) on-screen text, AND the visual descriptions.
+        - Be structured and precise.
+
+        RAW DATA:
+        {raw_data}
+
+        ---
+
+        FINAL SYNTHESIZED REPORT (Markdown Format):
+        """
+
+MAP_PROMPT = """
+        You are a technical analyst. You will receive a JSON list covering one section
+        ({time_range}) of a longer video, broken down into time chunks. Each chunk contains:
+        1. "spoken": The raw transcription (may contain errors).
+        2. "on_screen_text": De-duplicated text found on screen by OCR.
+        3. "visuals": A description of the on-screen action.
+
+        Write concise markdown notes for this section only:
+        - Re-assemble the on-screen text into coherent sentences or labels.
+        - Summarize what happens, keeping the time ranges, by combining the spoken text,
+          the on-screen text AND the visual descriptions.
+        - Keep every concrete fact (names, numbers, steps, code, terminology).
+
+        RAW DATA:
+        {raw_data}
+
+        ---
+
+        SECTION NOTES (Markdown Format):
+        """
+
+REDUCE_PROMPT = """
+        You are a technical analyst. Below are notes on consecutive sections of one video,
+        in time order. Combine them into a single clean, comprehensive markdown report:
+        - Start with a short overall summary, then go through the video in order.
+        - Merge repetition across sections, but keep every concrete fact and the time ranges.
+        - Be structured and precise.
+
+        SECTION NOTES:
+        {raw_data}
+
+        ---
+
+        FINAL SYNTHESIZED REPORT (Markdown Format):
+        """
+
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    _ENCODING = None
+
+
+def compact_json(data) -> str:
+    """JSON without indentation or spaces - whitespace costs tokens and carries nothing."""
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False)
+
+
+def count_tokens(text: str) -> int:
+    """Token count with tiktoken when installed (close enough for Llama), else ~4 chars/token."""
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text, disallowed_special=()))
+    return len(text) // 4 + 1
+
+
+def batch_by_tokens(items: list, budget: int, render=compact_json) -> list:
+    """Splits `items` into consecutive batches whose rendered size stays within `budget` tokens."""
+    batches, current, used = [], [], 0
+    for item in items:
+        cost = count_tokens(render(item)) + 1
+        if current and used + cost > budget:
+            batches.append(current)
+            current, used = [], 0
+        current.append(item)
+        used += cost
+    if current:
+        batches.append(current)
+    return batches
+
+
+def _usage(response) -> dict:
+    usage = getattr(response, "usage_metadata", None) or {}
+    if not usage:
+        usage = (getattr(response, "response_metadata", None) or {}).get("token_usage", {})
+    return {
+        "input_tokens": usage.get("input_tokens", usage.get("prompt_tokens")),
+        "output_tokens": usage.get("output_tokens", usage.get("completion_tokens")),
+    }
+
+
+def _call_many(model, prompts: list, label: str, usage_log: list, log_prefix: str) -> list:
+    """Runs the prompts concurrently and logs the token counts of every call."""
+    started = time.perf_counter()
+    try:
+        responses = model.batch(prompts, config={"max_concurrency": SYNTHESIS_CONCURRENCY})
+    except Exception:
+        metrics.EXTERNAL_API_SECONDS.labels("groq", "error").observe(time.perf_counter() - started)
+        raise
+    # batch() doesn't time calls individually; each is recorded with the batch's wall time (an upper bound)
+    elapsed = time.perf_counter() - started
+    for i, (prompt, response) in enumerate(zip(prompts, responses)):
+        metrics.EXTERNAL_API_SECONDS.labels("groq", "ok").observe(elapsed)
+        usage = _usage(response)
+        metrics.LLM_TOKENS.labels("input").inc(usage["input_tokens"] or 0)
+        metrics.LLM_TOKENS.labels("output").inc(usage["output_tokens"] or 0)
+        usage["call"] = f"{label}[{i}]"
+        usage["estimated_prompt_tokens"] = count_tokens(prompt)
+        usage_log.append(usage)
+        log.info(f"{log_prefix} LLM call {usage['call']}: {usage['input_tokens']} in / {usage['output_tokens']} out tokens")
+    return [response.content for response in responses]
+
+
+def _time_range(chunks: list) -> str:
+    first = chunks[0]["time_chunk"].split(" - ")[0]
+    last = chunks[-1]["time_chunk"].split(" - ")[-1]
+    return f"{first} - {last}"
+
+
+def _fill(template: str, raw_data: str) -> str:
+    # Not str.format: a caller's prompt may contain other braces
+    return template.replace("{raw_data}", raw_data)
+
+
+def synthesize(model, fused_data: list, log_prefix: str = "", budget: int = SYNTHESIS_BATCH_TOKENS, prompt: str = None):
+    """
+    Turns the fused timeline into the final markdown report.
+
+    Short timelines go out as one compact prompt. Longer ones are map-reduced: the
+    timeline is split into token-budgeted batches of time chunks that are summarized
+    concurrently, and the section notes are then combined (in rounds, if even the
+    notes don't fit in one call) into the final report. Prompt size - and so latency
+    per call - stays roughly flat as videos get longer.
+
+    `prompt` replaces the template of the call that writes the report (SYNTHESIS_PROMPT,
+    or REDUCE_PROMPT for the last combine); its {raw_data} gets the timeline or the notes.
+
+    Returns (report_markdown, usage), where usage lists the token counts of every call.
+    """
+    usage_log = []
+
+    raw = compact_json(fused_data)
+    if count_tokens(raw) <= budget:
+        report = _call_many(model, [_fill(prompt or SYNTHESIS_PROMPT, raw)], "single", usage_log, log_prefix)[0]
+        return report, usage_log
+
+    batches = batch_by_tokens(fused_data, budget)
+    log.info(f"{log_prefix} Timeline too long for one call, summarizing {len(batches)} sections...")
+    prompts = [
+        MAP_PROMPT.format(time_range=_time_range(batch), raw_data=compact_json(batch))
+        for batch in batches
+    ]
+    notes = [
+        f"## {_time_range(batch)}\n{text}"
+        for batch, text in zip(batches, _call_many(model, prompts, "map", usage_log, log_prefix))
+    ]
+
+    round_number = 0
+    while True:
+        groups = batch_by_tokens(notes, budget, render=lambda note: note)
+        if len(groups) == 1:
+            report = _call_many(model, [_fill(prompt or REDUCE_PROMPT, "\n\n".join(notes))], "reduce", usage_log, log_prefix)[0]
+            return report, usage_log
+        if len(groups) == len(notes):
+            # Every note is already over budget on its own, combining can't shrink it further
+            groups = [notes]
+        round_number += 1
+        log.info(f"{log_prefix} Notes too long for one call, combining {len(groups)} groups (round {round_number})...")
+        final = len(groups) == 1
+        template = (prompt or REDUCE_PROMPT) if final else REDUCE_PROMPT
+        prompts = [_fill(template, "\n\n".join(group)) for group in groups]
+        notes = _call_many(model, prompts, f"reduce{round_number}", usage_log, log_prefix)
+        if final:
+            return notes[0], usage_log
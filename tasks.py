@@ -4,19 +4,40 @@ os.environ["GOOGLE_AUTH_SUPPRESS_DEFAULT_CREDS"] = "true"
 # --- END FIX ---
 
 import json
+import time
+import shutil
 import logging
-import base64 
-import io 
-import whisper  # Module 1 dependency
-import cv2  # Module 2 dependency
+import tempfile
+import whisper_backend  # Module 1 dependency
 import pytesseract # Module 2 dependency
-from PIL import Image # Module 2 dependency
 import numpy as np 
-import google.generativeai as genai # For Module 3 (Vision)
+from vision_client import AsyncVisionClient # For Module 3 (Vision)
+from audio import SAMPLE_RATE, VAD_ENABLED, keep_speech, load_audio, remap_result # Module 1 audio + VAD
+from frame_sampler import (  # Shared decoder for Modules 2 & 3, fixed-interval or scene-aware
+    CHANGE_THRESHOLD, JPEG_QUALITY, SAMPLING_MODE, SAMPLING_SETTINGS, SIGNATURE_SIZE, sample_video, sample_video_adaptive
+)
+from ocr_engine import (  # Module 2 region-cropped, parallel OCR merged into text spans
+    MIN_CONFIDENCE, OCR_WORKERS, PREPROCESS_SETTINGS, SPAN_MAX_MISSED, SPAN_SETTINGS,
+    build_spans, join_spans, ocr_samples
+)
+from fusion import fuse_streams, stream_duration # Module 4 interval-indexed fusion
+from synthesis import (  # Module 5 map-reduce synthesis
+    MAP_PROMPT, REDUCE_PROMPT, SYNTHESIS_BATCH_TOKENS, SYNTHESIS_MODEL, SYNTHESIS_PROMPT, synthesize
+)
+import cache # Content-addressed results of every module
+import columnar # Compact, memory-mappable intermediate artifacts
+import storage # Artifact store shared by all nodes (local disk or S3)
+from checkpoints import ResultLog # Streamed, resumable per-frame results
+from progress import ProgressTracker, publish # Live progress + partial results
+import scheduling # Per-tenant admission slots
+import metrics # Timing spans + Prometheus metrics
+from metrics import span
 from langchain_groq import ChatGroq # For Module 5 (Text)
-from langchain_core.messages import HumanMessage
-from celery import chain
-from celery_app import celery  # Absolute import
+from celery.signals import (
+    before_task_publish, task_failure, task_postrun, task_prerun,
+    worker_init, worker_process_init, worker_process_shutdown
+)
+from celery_app import celery, consumes_task  # Absolute import
 
 # --- Tesseract Path Fix ---
 try:
@@ -30,41 +51,201 @@ except Exception:
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 log = logging.getLogger(__name__)
 
-# --- Processing Directory ---
-PROCESSING_DIR = "video_processing_storage"
-os.makedirs(PROCESSING_DIR, exist_ok=True)
+# --- Artifacts ---
+# context["paths"] holds store references (see storage.py), never machine-local paths,
+# so every task can run on any node: cache.fetch() turns a reference into a local path
+# (downloading it if needed), and outputs are published to the store once written.
+def output_location(context: dict, key: str, name: str):
+    """
+    (local path to write, store reference) for artifact `name`: in cache entry `key`,
+    or under the job itself when the result must not be cached (key is None).
+    """
+    if key:
+        return cache.artifact_path(key, name), cache.ref(key, name)
+    ref = f"jobs/{context['processing_id']}/{name}"
+    path = storage.STORE.local_path(ref)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path, ref
+
+
+def publish_output(key: str, ref: str):
+    """Makes a written artifact visible to other nodes: commits the cache entry, or uploads the job artifact."""
+    if key:
+        cache.commit(key)
+    else:
+        storage.STORE.put(ref)
+
+
+# --- Job Records ---
+# A finished job's context (minus the API keys) is kept in the store, so the job can be
+# re-run later from any stage (see pipeline.build_rerun) without the original upload.
+JOB_CONTEXT = "context.json"
 
 
-# --- Module 1: Whisper Model Loading (Lazy) ---
-WHISPER_MODEL = None
-def get_whisper_model():
-    global WHISPER_MODEL
-    if WHISPER_MODEL is None:
-        log.info("Loading Whisper model (tiny)...")
-        WHISPER_MODEL = whisper.load_model("tiny") 
-        log.info("Whisper model loaded.")
-    return WHISPER_MODEL
+def save_job_context(context: dict):
+    output_path, output_ref = output_location(context, None, JOB_CONTEXT)
+    record = {k: v for k, v in context.items() if k != "api_keys"}
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump(record, f, ensure_ascii=False)
+    publish_output(None, output_ref)
+
+
+def load_job_context(processing_id: str) -> dict:
+    """The saved context of a finished job (FileNotFoundError if there is none)."""
+    with open(storage.fetch(f"jobs/{processing_id}/{JOB_CONTEXT}"), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+# --- Module 1: Whisper Model (Resident, one per worker process) ---
+# The model is loaded when each worker process starts, so the first job after a
+# (re)start or autoscaling event doesn't pay the load time. See whisper_backend.py.
+# Only workers that can receive transcribe_video load it: io and default workers never
+# transcribe, and would otherwise hold a model in every pool process for nothing.
+@worker_process_init.connect
+def warm_up_whisper(**kwargs):
+    if consumes_task("tasks.transcribe_video"):
+        whisper_backend.warm_up(**kwargs)
+
+# --- Metrics ---
+# Queue wait, run time and outcome of every task; the worker's main process exports
+# the metrics of all its pool processes (see metrics.py).
+before_task_publish.connect(metrics.stamp_sent_time)
+task_prerun.connect(metrics.task_started)
+task_postrun.connect(metrics.task_finished)
+worker_init.connect(metrics.start_worker_exporter)
+worker_process_shutdown.connect(metrics.process_exited)
 
 # --- Module 2: Tesseract (No pre-loading needed!) ---
 
 
+# --- Modules 2 & 3: Shared Frame Sampling ---
+# The video is decoded once; each consumer gets frames at its own interval (ms).
+# To add a new frame consumer, register it here (and in FRAME_BUDGETS) and read its
+# samples from the manifest.
+FRAME_CONSUMERS = {
+    "ocr": 2000,      # Module 2 (Tesseract)
+    "motion": 10000,  # Module 3 (Gemini Vision)
+}
+# Adaptive sampling (the default; CORTEX_SAMPLING=fixed turns it off): keyframes each
+# consumer may get per minute of video. The defaults match the fixed intervals, so
+# adaptive never costs more OCR or Gemini calls; it spends them on scenes instead of on
+# the clock.
+FRAME_BUDGETS = {
+    "ocr": float(os.environ.get("CORTEX_OCR_FRAME_BUDGET", 30)),
+    "motion": float(os.environ.get("CORTEX_VISION_FRAME_BUDGET", 6)),
+}
+
+# --- Module 3: Gemini Vision ---
+VISION_MODEL = 'gemini-2.5-flash'
+VISION_PROMPT = "Describe this image in one brief sentence."
+
+
+# --- Result Cache ---
+# Each module's output is stored under a key derived from the video's content hash, the
+# module's parameters and the keys of its inputs (see cache.py), so duplicates and retries
+# return the stored artifact instead of recomputing it.
+def video_key(context: dict) -> str:
+    if "video_hash" not in context:
+        context["video_hash"] = cache.file_digest(storage.fetch(context["paths"]["original"]))
+    return context["video_hash"]
+
+
+def artifact_key(context: dict, module: str, params: dict, inputs: list) -> str:
+    key = cache.make_key(module, params, inputs)
+    context.setdefault("cache_keys", {})[module] = key
+    return key
+
+
+def shard_range(context: dict):
+    shard = context.get("shard")
+    return [shard["start"], shard["end"]] if shard else None
+
+
+# --- Progress Events ---
+TRANSCRIPT_EVENT_SEGMENTS = 100
+
+
+def publish_transcript(context: dict, segments: list):
+    """Sends the transcript as partial results, a batch of segments per event."""
+    for i in range(0, len(segments), TRANSCRIPT_EVENT_SEGMENTS):
+        publish(context, "transcription", "partial", segments=[
+            {"start": seg["start"], "end": seg["end"], "text": seg["text"]}
+            for seg in segments[i:i + TRANSCRIPT_EVENT_SEGMENTS]
+        ])
+
+
+@task_failure.connect
+def publish_failure(sender=None, exception=None, args=None, **_):
+    """Tells the client the job failed, whichever task it was."""
+    contexts = [a for a in _flatten_results(list(args or [])) if isinstance(a, dict) and "processing_id" in a]
+    if contexts:
+        publish(contexts[0], getattr(sender, "name", "unknown"), "failed", error=str(exception))
+        scheduling.release(contexts[0])
+
+
 # --- Task Definitions ---
 
 @celery.task(name="tasks.transcribe_video")
 def transcribe_video(context: dict):
-    video_path = context["paths"]["original"]
+    video_path = storage.video_source(context["paths"]["original"])
     processing_id = context["processing_id"]
     log.info(f"[{processing_id}] Module 1: Transcribing video (REAL)...")
     
     try:
-        model = get_whisper_model()
-        result = model.transcribe(video_path, word_timestamps=True)
+        key = artifact_key(context, "transcription", {
+            "model": whisper_backend.WHISPER_MODEL_NAME,
+            "backend": whisper_backend.WHISPER_BACKEND,
+            "memory_mb": whisper_backend.WHISPER_MEMORY_BUDGET_MB,
+            "vad": VAD_ENABLED,
+            "range": shard_range(context),
+        }, [video_key(context)])
+        cached = cache.lookup(key, "transcription.cols")
+        if cached:
+            context["paths"]["transcription"] = cached
+            log.info(f"[{processing_id}] Module 1: Cache hit. Using {cached}")
+            publish_transcript(context, columnar.read_bundle(cache.fetch(cached))["segments"].records())
+            publish(context, "transcription", "completed", cached=True)
+            return context
+
+        publish(context, "transcription", "started")
+
+        shard = context.get("shard")
+        if shard:
+            # Only this shard's time range; timestamps are shard-local until stitch_shards
+            log.info(f"[{processing_id}] Transcribing shard {shard['index']} ({shard['start']:.1f}s - {shard['end']:.1f}s)")
+            with span("audio_decode", context):
+                audio = load_audio(video_path, shard["start"], shard["end"] - shard["start"])
+        else:
+            with span("audio_decode", context):
+                audio = load_audio(video_path)
+
+        # Only feed speech to Whisper, then move timestamps back onto the original timeline
+        with span("vad", context):
+            speech, timeline = keep_speech(audio)
+        audio_seconds = len(audio) / SAMPLE_RATE
+        speech_seconds = len(speech) / SAMPLE_RATE
+        log.info(f"[{processing_id}] VAD: transcribing {speech_seconds:.1f}s of {audio_seconds:.1f}s audio.")
+
+        if timeline == []:
+            result = {"text": "", "segments": [], "language": None}
+        else:
+            with span("whisper", context, audio_seconds=round(len(speech) / SAMPLE_RATE, 2)):
+                result = whisper_backend.transcribe(speech, word_timestamps=True)
+            result = remap_result(result, timeline)
+
+        context.setdefault("stats", {})["whisper"] = dict(whisper_backend.MODEL_STATS)
+        context["stats"]["vad"] = {
+            "audio_seconds": round(audio_seconds, 2),
+            "transcribed_seconds": round(speech_seconds, 2),
+        }
         
-        output_path = os.path.join(PROCESSING_DIR, f"{processing_id}_transcription.json")
-        with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump(result, f, indent=2, ensure_ascii=False)
+        output_path, output_ref = output_location(context, key, "transcription.cols")
+        columnar.save_transcription(output_path, result)
+        publish_output(key, output_ref)
             
-        context["paths"]["transcription"] = output_path
+        context["paths"]["transcription"] = output_ref
+        publish_transcript(context, result.get("segments", []))
+        publish(context, "transcription", "completed", segments=len(result.get("segments", [])))
         log.info(f"[{processing_id}] Module 1: Complete. Saved to {output_path}")
         return context
     except Exception as e:
@@ -72,66 +253,214 @@ def transcribe_video(context: dict):
         raise e
 
 
-@celery.task(name="tasks.extract_static_data")
-def extract_static_data(context: dict, frame_interval_ms=2000):
-    video_path = context["paths"]["original"]
+@celery.task(name="tasks.sample_frames")
+def sample_frames(context: dict, change_threshold=CHANGE_THRESHOLD):
+    """
+    Shared frame-sampling stage for Modules 2 and 3.
+    Decodes the video once and saves the frames each consumer in FRAME_CONSUMERS needs:
+    on its fixed interval, or (SAMPLING_MODE "adaptive") keyframes per scene within the
+    consumer's FRAME_BUDGETS. Samples that haven't changed by more than `change_threshold`
+    are marked as duplicates.
+    """
+    video_path = storage.video_source(context["paths"]["original"])
     processing_id = context["processing_id"]
-    log.info(f"[{processing_id}] Module 2: Extracting static data (TESSERACT v23)...")
-    
-    try:
-        cap = cv2.VideoCapture(video_path)
-        if not cap.isOpened():
-            raise IOError(f"Cannot open video file {video_path}")
+    log.info(f"[{processing_id}] Sampling frames (single pass) for {list(FRAME_CONSUMERS)}...")
 
-        ocr_results = []
-        current_pos_ms = 0
-        
-        while cap.isOpened():
-            cap.set(cv2.CAP_PROP_POS_MSEC, current_pos_ms)
-            ret, frame = cap.read()
-            
-            if not ret:
-                break 
-                
-            timestamp_sec = current_pos_ms / 1000.0
-            
-            log.info(f"[{processing_id}] Running Tesseract OCR on frame at {timestamp_sec}s...")
-            
-            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-            _, thresh = cv2.threshold(gray, 150, 255, cv2.THRESH_BINARY)
-            pil_image = Image.fromarray(thresh)
-            
+    try:
+        key = artifact_key(context, "frames", {
+            "consumers": FRAME_CONSUMERS,
+            "change_threshold": change_threshold,
+            "signature_size": SIGNATURE_SIZE,
+            "jpeg_quality": JPEG_QUALITY,
+            "range": shard_range(context),
+            **({"sampling": SAMPLING_SETTINGS, "budgets": FRAME_BUDGETS} if SAMPLING_MODE == "adaptive" else {}),
+        }, [video_key(context)])
+        cached = cache.lookup(key, "frames.json")
+        if cached:
+            with open(cache.fetch(cache.ref(key, "video.json")), 'r', encoding='utf-8') as f:
+                context["video"] = json.load(f)
+            context["paths"]["frames"] = cached
+            log.info(f"[{processing_id}] Frame sampling: Cache hit. Using {cached}")
+            publish(context, "frames", "completed", cached=True)
+            return context
+
+        # Two jobs on the same video share this cache entry: frames are written to a
+        # directory of this attempt's own (outside the entry, which gets published as a
+        # whole) and renamed into place once complete, so neither deletes nor reads the
+        # other's frames half-written. The first to land is kept; both hold the same frames.
+        frames_dir = cache.artifact_path(key, "frames")
+        staging_dir = tempfile.mkdtemp(prefix=f"{key}.frames.", suffix=".tmp", dir=cache.CACHE_DIR)
+        shard = context.get("shard") or {}
+        tracker = None
+
+        def report(done, total):
+            nonlocal tracker
+            if tracker is None:
+                tracker = ProgressTracker(context, "frames", total)
+            tracker.update(done)
+
+        try:
+            with span("decode", context, mode=SAMPLING_MODE) as fields:
+                if SAMPLING_MODE == "adaptive":
+                    manifest, video_info, scenes = sample_video_adaptive(
+                        video_path, FRAME_CONSUMERS, FRAME_BUDGETS, staging_dir, change_threshold,
+                        start=shard.get("start", 0.0), end=shard.get("end"), on_progress=report
+                    )
+                    fields["scenes"] = len(scenes)
+                    context.setdefault("stats", {})["frames"] = {"scenes": len(scenes)}
+                else:
+                    manifest, video_info = sample_video(
+                        video_path, FRAME_CONSUMERS, staging_dir, change_threshold,
+                        start=shard.get("start", 0.0), end=shard.get("end"), on_progress=report
+                    )
+                sampled = len({s["path"] for samples in manifest.values() for s in samples})
+                fields["frames"] = sampled
+            os.chmod(staging_dir, 0o755)
             try:
-                data = pytesseract.image_to_data(pil_image, output_type=pytesseract.Output.DICT)
-                
-                num_items = len(data['text'])
-                for i in range(num_items):
-                    confidence = float(data['conf'][i])
-                    text = data['text'][i].strip()
-                    
-                    if confidence > 50 and text:
-                        ocr_results.append({
-                            "timestamp": timestamp_sec,
-                            "text": text,
-                            "confidence": confidence
-                        })
+                os.replace(staging_dir, frames_dir)
+            except OSError:
+                if not os.path.isdir(frames_dir):
+                    raise
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+        manifest = {
+            name: [{**s, "path": os.path.join(frames_dir, os.path.basename(s["path"]))} for s in samples]
+            for name, samples in manifest.items()
+        }
+        metrics.FRAMES_TOTAL.labels("sampled").inc(sampled)
+        if tracker:
+            tracker.finish()
+        context["video"] = video_info
+        log.info(
+            f"[{processing_id}] Video: {video_info['duration']:.1f}s, "
+            f"{video_info['frame_count']} frames @ {video_info['fps']:.2f} fps"
+        )
+
+        with open(cache.artifact_path(key, "video.json"), 'w', encoding='utf-8') as f:
+            json.dump(video_info, f)
+        output_path, output_ref = output_location(context, key, "frames.json")
+        with open(output_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, separators=(",", ":"), ensure_ascii=False)
+        publish_output(key, output_ref)
+
+        context["paths"]["frames"] = output_ref
+        counts = {
+            name: f"{sum('duplicate_of' not in s for s in samples)}/{len(samples)} changed"
+            for name, samples in manifest.items()
+        }
+        log.info(f"[{processing_id}] Frame sampling complete. {counts}. Saved to {output_path}")
+        return context
+    except Exception as e:
+        log.error(f"[{processing_id}] Frame sampling FAILED. Error: {e}")
+        raise e
+
 
-            except pytesseract.TesseractNotFoundError:
-                log.error(f"[{processing_id}] TESSERACT FAILED. The 'tesseract' executable was not found.")
-                raise
-            except Exception as ocr_err:
-                log.warning(f"[{processing_id}] Pytesseract failed on frame at {timestamp_sec}s: {ocr_err}")
+def load_frame_samples(context: dict, consumer: str):
+    """The consumer's samples, with paths pointing at this node's copy of the frames."""
+    manifest_ref = context["paths"]["frames"]
+    with open(cache.fetch(manifest_ref), 'r', encoding='utf-8') as f:
+        samples = json.load(f).get(consumer, [])
+    if not samples:
+        return samples
+    frames_dir = cache.fetch(manifest_ref.rsplit("/", 1)[0] + "/frames")
+    return [{**s, "path": os.path.join(frames_dir, os.path.basename(s["path"]))} for s in samples]
 
-            current_pos_ms += frame_interval_ms
 
-        cap.release()
+@celery.task(name="tasks.extract_static_data")
+def extract_static_data(context: dict):
+    processing_id = context["processing_id"]
+    log.info(f"[{processing_id}] Module 2: Extracting static data (TESSERACT v23)...")
+    
+    try:
+        key = artifact_key(context, "ocr", {
+            "min_confidence": MIN_CONFIDENCE,
+            "preprocess": PREPROCESS_SETTINGS,
+            "spans": SPAN_SETTINGS,
+        }, [context["cache_keys"]["frames"]])
+        cached = cache.lookup(key, "ocr_data.cols")
+        if cached:
+            context["paths"]["ocr"] = cached
+            log.info(f"[{processing_id}] Module 2: Cache hit. Using {cached}")
+            publish(context, "ocr", "completed", cached=True)
+            return context
+
+        samples = load_frame_samples(context, "ocr")
+        changed = [s for s in samples if "duplicate_of" not in s]
+        # Lines go to disk frame by frame; if this attempt fails, the log is closed (not
+        # discarded) and the next job on this video picks up where it stopped
+        with ResultLog(f"ocr-{key}") as results_by_time:
+            pending = [s for s in changed if s["timestamp"] not in results_by_time]
+            workers = max(1, min(OCR_WORKERS, len(pending) or 1))
+            log.info(
+                f"[{processing_id}] Running Tesseract OCR on {len(pending)} changed frames "
+                f"({len(samples) - len(changed)} unchanged skipped, {len(changed) - len(pending)} resumed) "
+                f"with {workers} workers..."
+            )
+
+            latencies = []
+            started = time.perf_counter()
+            tracker = ProgressTracker(context, "ocr", len(changed), baseline=len(changed) - len(pending))
+
+            with span("ocr", context, frames=len(pending), workers=workers):
+                try:
+                    resumed = len(changed) - len(pending)
+                    for done, (sample, results, latency, ocr_err) in enumerate(ocr_samples(pending, workers), resumed + 1):
+                        timestamp_sec = sample["timestamp"]
+                        if ocr_err is not None:
+                            log.warning(f"[{processing_id}] Pytesseract failed on frame at {timestamp_sec}s: {ocr_err}")
+                            tracker.update(done)
+                            continue
+                        results_by_time.append(timestamp_sec, results)
+                        tracker.update(done, partial=[{
+                            "timestamp": timestamp_sec,
+                            "text": " ".join(item["text"] for item in results)
+                        }] if results else None)
+                        latencies.append(latency)
+                        metrics.observe("ocr_frame", latency)
+                        metrics.FRAMES_TOTAL.labels("ocr").inc()
+                        log.info(f"[{processing_id}] OCR frame at {timestamp_sec}s: {len(results)} lines in {latency:.2f}s")
+                except pytesseract.TesseractNotFoundError:
+                    log.error(f"[{processing_id}] TESSERACT FAILED. The 'tesseract' executable was not found.")
+                    raise
+
+            # Unchanged frames reuse the lines of the frame they duplicate; lines seen on
+            # consecutive frames collapse into one span with first/last seen times. Frames
+            # are read back from the log one at a time.
+            line_count = 0
+
+            def frames():
+                nonlocal line_count
+                for sample in samples:
+                    lines = results_by_time.get(sample.get("duplicate_of", sample["timestamp"]), [])
+                    line_count += len(lines)
+                    yield sample["timestamp"], lines
+
+            ocr_spans = build_spans(frames())
+
+            wall_time = time.perf_counter() - started
+            latencies.sort()
+            context.setdefault("stats", {})["ocr"] = {
+                "frames": len(samples),
+                "skipped_frames": len(samples) - len(changed),
+                "ocr_runs": len(latencies),
+                "resumed_frames": results_by_time.resumed,
+                "workers": workers,
+                "wall_time_s": round(wall_time, 3),
+                "mean_latency_s": round(sum(latencies) / len(latencies), 3) if latencies else 0.0,
+                "p95_latency_s": round(latencies[int(0.95 * (len(latencies) - 1))], 3) if latencies else 0.0,
+                "lines": line_count,
+                "spans": len(ocr_spans),
+            }
+            log.info(f"[{processing_id}] OCR stats: {context['stats']['ocr']}")
         
-        output_path = os.path.join(PROCESSING_DIR, f"{processing_id}_ocr_data.json")
-        with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump(ocr_results, f, indent=2, ensure_ascii=False)
+            output_path, output_ref = output_location(context, key, "ocr_data.cols")
+            columnar.save_spans(output_path, ocr_spans)
+            publish_output(key, output_ref)
+            results_by_time.discard()
             
-        context["paths"]["ocr"] = output_path
-        log.info(f"[{processing_id}] Module 2: Complete. Found {len(ocr_results)} text lines. Saved to {output_path}")
+        context["paths"]["ocr"] = output_ref
+        tracker.finish(items=len(ocr_spans))
+        log.info(f"[{processing_id}] Module 2: Complete. Found {len(ocr_spans)} text spans. Saved to {output_path}")
         return context
 
     except Exception as e:
@@ -140,144 +469,287 @@ def extract_static_data(context: dict, frame_interval_ms=2000):
 
 
 @celery.task(name="tasks.describe_motion")
-def describe_motion(context: dict, frame_interval_ms=10000):
+def describe_motion(context: dict):
     processing_id = context["processing_id"]
-    video_path = context["paths"]["original"]
-    log.info(f"[{processing_id}] Module 3: Describing motion (REAL v28 - Native Google Lib)...")
+    log.info(f"[{processing_id}] Module 3: Describing motion (REAL v33 - async Gemini REST)...")
     
-    output_path = os.path.join(PROCESSING_DIR, f"{processing_id}_motion_data.json")
+    key = artifact_key(context, "motion", {
+        "model": VISION_MODEL,
+        "prompt": VISION_PROMPT,
+    }, [context["cache_keys"]["frames"]])
+    cached = cache.lookup(key, "motion_data.cols")
+    if cached:
+        context["paths"]["motion"] = cached
+        log.info(f"[{processing_id}] Module 3: Cache hit. Using {cached}")
+        publish(context, "vision", "completed", cached=True)
+        return context
+    context["cache_keys"]["motion"] = None  # set again only once a complete result is cached
 
     api_key = context.get("api_keys", {}).get("gemini")
         
     if not api_key:
         log.error(f"[{processing_id}] Module 3: FAILED. Gemini API key not found in context.")
-        with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump([], f) 
-        context["paths"]["motion"] = output_path
-        return context
-
-    try:
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel('gemini-2.5-flash')
-    except Exception as e:
-        log.error(f"[{processing_id}] Failed to initialize Google Gemini model: {e}")
-        with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump([], f)
-        context["paths"]["motion"] = output_path
+        output_path, output_ref = output_location(context, None, "motion_data.cols")
+        columnar.save_items(output_path, [], "description")
+        publish_output(None, output_ref)
+        context["paths"]["motion"] = output_ref
         return context
 
+    client = AsyncVisionClient(api_key, VISION_MODEL)
     motion_results = []
-    
-    try:
-        cap = cv2.VideoCapture(video_path)
-        if not cap.isOpened():
-            raise IOError(f"Cannot open video file {video_path}")
-
-        current_pos_ms = 0
-        while cap.isOpened():
-            cap.set(cv2.CAP_PROP_POS_MSEC, current_pos_ms)
-            ret, frame = cap.read()
-            
-            if not ret:
-                break 
-                
-            timestamp_sec = current_pos_ms / 1000.0
-            log.info(f"[{processing_id}] Describing frame at {timestamp_sec}s...")
-
-            _, buffer = cv2.imencode('.jpg', frame)
-            
-            img_blob = io.BytesIO(buffer)
-            img = Image.open(img_blob)
-            
-            try:
-                response = model.generate_content(
-                    ["Describe this image in one brief sentence.", img],
-                )
-                description = response.text
-                
+    skipped = 0
+    failed = 0
+    # Descriptions go to disk as they arrive; the next job on this video only asks Gemini
+    # for the missing ones (the log is closed on the way out, even if saving fails)
+    with ResultLog(f"motion-{key}") as descriptions:
+        try:
+            samples = load_frame_samples(context, "motion")
+            changed = [s for s in samples if "duplicate_of" not in s]
+            pending = [s for s in changed if s["timestamp"] not in descriptions]
+            log.info(
+                f"[{processing_id}] Describing {len(pending)} changed frames "
+                f"({len(samples) - len(changed)} unchanged skipped, {len(changed) - len(pending)} resumed), "
+                f"up to {client.concurrency} requests at a time..."
+            )
+
+            started = time.perf_counter()
+            tracker = ProgressTracker(context, "vision", len(changed), baseline=len(changed) - len(pending))
+            finished = len(changed) - len(pending)
+
+            def report(index, response):
+                nonlocal finished
+                finished += 1
+                if isinstance(response, Exception):
+                    tracker.update(finished)
+                    return
+                descriptions.append(pending[index]["timestamp"], response)
+                tracker.update(finished, partial=[{
+                    "timestamp": pending[index]["timestamp"],
+                    "description": response
+                }])
+
+            with span("vision", context, frames=len(pending)):
+                responses = client.describe_many_sync([s["path"] for s in pending], VISION_PROMPT, on_result=report)
+            metrics.FRAMES_TOTAL.labels("vision").inc(sum(not isinstance(r, Exception) for r in responses))
+            tracker.finish(failed=sum(isinstance(r, Exception) for r in responses))
+            log.info(f"[{processing_id}] Vision requests finished in {time.perf_counter() - started:.1f}s")
+
+            for sample, response in zip(pending, responses):
+                if isinstance(response, Exception):
+                    log.error(f"[{processing_id}] Gemini Vision call failed at t={sample['timestamp']}s: {response}")
+                    failed += 1
+                else:
+                    log.info(f"[{processing_id}]   Description at {sample['timestamp']}s: {response}")
+
+            # Unchanged frames reuse the description of the frame they duplicate
+            for sample in samples:
+                source = sample.get("duplicate_of", sample["timestamp"])
+                description = descriptions.get(source)
+                if description is None:
+                    continue
+                if source != sample["timestamp"]:
+                    skipped += 1
                 motion_results.append({
-                    "timestamp": timestamp_sec,
+                    "timestamp": sample["timestamp"],
                     "description": description
                 })
-                log.info(f"[{processing_id}]   Description: {description}")
 
-            except Exception as gemini_err:
-                log.error(f"[{processing_id}] Gemini Vision call failed at t={timestamp_sec}s: {gemini_err}")
-            
-            current_pos_ms += frame_interval_ms
+        except Exception as e:
+            log.error(f"[{processing_id}] Module 3: FAILED during CV processing. Error: {e}")
+            failed += 1
+
+        # Only a complete result goes into the cache; partial ones stay with this job
+        output_key = None if failed else key
+        output_path, output_ref = output_location(context, output_key, "motion_data.cols")
+        columnar.save_items(output_path, motion_results, "description")
+        publish_output(output_key, output_ref)
+        # A partial result keeps its log, so the next job only retries the failed frames
+        if not failed:
+            descriptions.discard()
+    context["cache_keys"]["motion"] = output_key
+        
+    context["paths"]["motion"] = output_ref
+    context.setdefault("stats", {})["motion"] = {
+        "frames": len(motion_results),
+        "skipped_frames": skipped,
+        "vision_calls": len(motion_results) - skipped,
+        "failed_calls": failed,
+    }
+    log.info(f"[{processing_id}] Module 3: Complete. Described {len(motion_results)} frames ({skipped} unchanged, reused). Saved to {output_path}")
+    return context
 
-        cap.release()
 
+STITCHED_NAMES = {"transcription": "transcription", "ocr": "ocr_data", "motion": "motion_data"}
+
+
+@celery.task(name="tasks.merge_contexts")
+def merge_contexts(contexts: list):
+    """
+    Joins the contexts returned by the parallel extractors (Modules 1-3) into one.
+    Results may arrive nested (a branch that ends in a group returns a list).
+    """
+    flat = _flatten_results(contexts)
+    merged = _merge_flat_contexts(flat)
+    log.info(f"[{merged['processing_id']}] Merged {len(flat)} extractor results: {sorted(merged['paths'])}")
+    return merged
+
+
+def _flatten_results(results: list):
+    flat = []
+    stack = list(results)
+    while stack:
+        item = stack.pop(0)
+        if isinstance(item, list):
+            stack[:0] = item
+        else:
+            flat.append(item)
+    return flat
+
+
+def _merge_flat_contexts(flat: list):
+    merged = dict(flat[0])
+    for key in ("paths", "stats", "video", "cache_keys", "timings"):
+        combined = {}
+        for ctx in flat:
+            combined.update(ctx.get(key) or {})
+        if combined:
+            merged[key] = combined
+    return merged
+
+
+@celery.task(name="tasks.stitch_shards")
+def stitch_shards(contexts: list):
+    """
+    Chord body for sharded jobs: merges each shard's extractor results, then concatenates
+    the per-shard transcription / OCR / motion artifacts in time order into the job's own
+    artifacts. Whisper timestamps are shard-local and get shifted by the shard start;
+    OCR and motion timestamps are already absolute (frames are indexed on the full video).
+    """
+    by_shard = {}
+    for ctx in _flatten_results(contexts):
+        by_shard.setdefault(ctx["shard"]["index"], []).append(ctx)
+    shards = [_merge_flat_contexts(by_shard[i]) for i in sorted(by_shard)]
+
+    context = dict(shards[0])
+    context.pop("shard")
+    processing_id = context["processing_id"] = context["parent_id"]
+    log.info(f"[{processing_id}] Stitching {len(shards)} shards...")
+
+    try:
+        # Columns are concatenated as arrays; only Whisper's shard-local times need shifting
+        parts = {"segments": [], "words": [], "motion": []}
+        ocr_spans = []
+        language, texts = None, []
+        segment_count = 0
+        for shard_ctx in shards:
+            offset = shard_ctx["shard"]["start"]
+
+            part = columnar.read_bundle(cache.fetch(shard_ctx["paths"]["transcription"]))
+            language = language or part.attrs.get("language")
+            texts.append((part.attrs.get("text") or "").strip())
+            segments, words = part["segments"], part["words"]
+            parts["segments"].append({
+                "start": segments["start"] + offset,
+                "end": segments["end"] + offset,
+                "text": segments["text"].tolist(),
+            })
+            parts["words"].append({
+                "segment": words["segment"] + segment_count,
+                "start": words["start"] + offset,
+                "end": words["end"] + offset,
+                "probability": np.asarray(words["probability"]),
+                "word": words["word"].tolist(),
+            })
+            segment_count += len(segments)
+
+            ocr_spans.extend(columnar.load_spans(cache.fetch(shard_ctx["paths"]["ocr"])))
+            motion = columnar.read_bundle(cache.fetch(shard_ctx["paths"]["motion"]))["items"]
+            parts["motion"].append({c: motion[c].tolist() if c == "description" else np.asarray(motion[c]) for c in motion.columns})
+
+        def concat(tables):
+            return {
+                column: np.concatenate([t[column] for t in tables]) if isinstance(tables[0][column], np.ndarray)
+                else [value for t in tables for value in t[column]]
+                for column in tables[0]
+            }
+
+        bundles = {
+            "transcription": ({"segments": concat(parts["segments"]), "words": concat(parts["words"])},
+                              {"language": language, "text": " ".join(t for t in texts if t)}),
+            # A line still on screen at a shard boundary was split in two; join it back up
+            "ocr": (columnar.span_tables(join_spans(ocr_spans, FRAME_CONSUMERS["ocr"] / 1000 * (SPAN_MAX_MISSED + 1))), None),
+            "motion": ({"items": concat(parts["motion"])}, None),
+        }
+
+        context["paths"] = dict(context["paths"])
+        context["cache_keys"] = {}
+        ranges = [shard_range(s) for s in shards]
+        for module, (tables, attrs) in bundles.items():
+            name = f"{STITCHED_NAMES[module]}{columnar.SUFFIX}"
+            shard_keys = [s.get("cache_keys", {}).get(module) for s in shards]
+            # A stitched artifact is only cacheable if every shard's part was
+            key = cache.make_key(module, {"shards": ranges}, shard_keys) if all(shard_keys) else None
+            output_path, output_ref = output_location(context, key, name)
+            columnar.write_bundle(output_path, tables, attrs)
+            publish_output(key, output_ref)
+            context["paths"][module] = output_ref
+            context["cache_keys"][module] = key
+
+        context["stats"] = {"shards": [s.get("stats", {}) for s in shards]}
+        context["timings"] = {}
+        for shard_ctx in shards:
+            for stage, seconds in (shard_ctx.get("timings") or {}).items():
+                context["timings"][stage] = round(context["timings"].get(stage, 0.0) + seconds, 3)
+        log.info(f"[{processing_id}] Stitching complete: {segment_count} segments, "
+                 f"{len(bundles['ocr'][0]['spans']['first_seen'])} OCR spans, "
+                 f"{len(bundles['motion'][0]['items']['timestamp'])} motion items.")
+        return context
     except Exception as e:
-        log.error(f"[{processing_id}] Module 3: FAILED during CV processing. Error: {e}")
-    
-    with open(output_path, 'w', encoding='utf-8') as f:
-        json.dump(motion_results, f, indent=2, ensure_ascii=False)
-        
-    context["paths"]["motion"] = output_path
-    log.info(f"[{processing_id}] Module 3: Complete. Described {len(motion_results)} frames. Saved to {output_path}")
-    return context
+        log.error(f"[{processing_id}] Stitching FAILED. Error: {e}")
+        raise e
 
 
 @celery.task(name="tasks.fuse_data")
 def fuse_data(context: dict, time_step_seconds=5):
     processing_id = context["processing_id"]
-    video_path = context["paths"]["original"]
+    # A re-run can override the granularity (see pipeline.build_rerun)
+    time_step_seconds = context.get("params", {}).get("time_step_seconds", time_step_seconds)
     log.info(f"[{processing_id}] Module 4: Fusing data streams (REAL v13)...")
     
     try:
-        with open(context["paths"]["transcription"], 'r', encoding='utf-8') as f:
-            transcription = json.load(f)
-        with open(context["paths"]["ocr"], 'r', encoding='utf-8') as f:
-            ocr_data = json.load(f) 
-        with open(context["paths"]["motion"], 'r', encoding='utf-8') as f:
-            motion_data = json.load(f) 
-
-        cap = cv2.VideoCapture(video_path)
-        fps = cap.get(cv2.CAP_PROP_FPS)
-        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-        video_duration_seconds = frame_count / fps
-        cap.release()
-
-        fused_timeline = []
-        current_time = 0.0
-        
-        whisper_segments = transcription.get('segments', [])
-
-        while current_time < video_duration_seconds:
-            chunk_start = current_time
-            chunk_end = current_time + time_step_seconds
-            
-            spoken_text = " ".join([
-                seg['text'] for seg in whisper_segments 
-                if seg['start'] < chunk_end and seg['end'] > chunk_start
-            ]).strip()
-            
-            ocr_text_set = set()
-            for item in ocr_data:
-                if chunk_start <= item['timestamp'] < chunk_end:
-                    ocr_text_set.add(item['text'])
-            
-            motion_descriptions = " ".join([
-                item['description'] for item in motion_data
-                if chunk_start <= item['timestamp'] < chunk_end
-            ])
-            
-            if spoken_text or ocr_text_set or motion_descriptions:
-                fused_timeline.append({
-                    "time_chunk": f"{chunk_start:.1f}s - {chunk_end:.1f}s",
-                    "spoken": spoken_text,
-                    "on_screen_text": list(ocr_text_set), 
-                    "visuals": motion_descriptions 
-                })
-            
-            current_time += time_step_seconds
-
-        output_path = os.path.join(PROCESSING_DIR, f"{processing_id}_fused_knowledge.json")
+        input_keys = [context.get("cache_keys", {}).get(m) for m in ("transcription", "ocr", "motion")]
+        key = artifact_key(context, "fused", {"time_step_seconds": time_step_seconds}, input_keys)
+        if not all(input_keys):
+            context["cache_keys"]["fused"] = key = None
+        cached = key and cache.lookup(key, "fused_knowledge.json")
+        if cached:
+            context["paths"]["fused"] = cached
+            log.info(f"[{processing_id}] Module 4: Cache hit. Using {cached}")
+            publish(context, "fusion", "completed", cached=True)
+            return context
+
+        publish(context, "fusion", "started")
+
+        with span("fusion", context) as fields:
+            # Memory-mapped columns: nothing is parsed, only the strings that are used get decoded
+            whisper_segments = columnar.read_bundle(cache.fetch(context["paths"]["transcription"]))["segments"]
+            ocr_data = columnar.read_bundle(cache.fetch(context["paths"]["ocr"]))["spans"]
+            motion_data = columnar.read_bundle(cache.fetch(context["paths"]["motion"]))["items"]
+
+            # Duration comes from the sampler's probe (or the streams themselves), no need to reopen the video
+            video_duration_seconds = (context.get("video") or {}).get("duration") \
+                or stream_duration(whisper_segments, ocr_data, motion_data)
+
+            fused_timeline = fuse_streams(whisper_segments, ocr_data, motion_data, video_duration_seconds, time_step_seconds)
+            fields["chunks"] = len(fused_timeline)
+
+        output_path, output_ref = output_location(context, key, "fused_knowledge.json")
         with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump(fused_timeline, f, indent=2, ensure_ascii=False)
+            json.dump(fused_timeline, f, separators=(",", ":"), ensure_ascii=False)
+        publish_output(key, output_ref)
             
-        context["paths"]["fused"] = output_path
+        context["paths"]["fused"] = output_ref
+        publish(context, "fusion", "completed", chunks=len(fused_timeline))
         log.info(f"[{processing_id}] Module 4: Complete. Fused {len(fused_timeline)} time chunks. Saved to {output_path}")
         return context
         
@@ -294,9 +766,31 @@ def synthesize_knowledge(context: dict):
     """
     processing_id = context["processing_id"]
     log.info(f"[{processing_id}] Module 5: Synthesizing final document (REAL v32 - LangChain/Groq)...")
+
+    params = context.get("params", {})
+    report_prompt = params.get("synthesis_prompt")
+    batch_tokens = params.get("synthesis_batch_tokens", SYNTHESIS_BATCH_TOKENS)
+    synthesis_params = {
+        "model": SYNTHESIS_MODEL,
+        "prompts": [SYNTHESIS_PROMPT, MAP_PROMPT, REDUCE_PROMPT],
+        "batch_tokens": batch_tokens,
+    }
+    if report_prompt:
+        synthesis_params["report_prompt"] = report_prompt
+
+    fused_key = context.get("cache_keys", {}).get("fused")
+    key = artifact_key(context, "final_report", synthesis_params, [fused_key]) if fused_key else None
+    cached = key and cache.lookup(key, "final_report.md")
+    if cached:
+        context["paths"]["final_report"] = cached
+        log.info(f"[{processing_id}] Module 5: Cache hit. Using {cached}")
+        save_job_context(context)
+        scheduling.release(context)
+        publish(context, "synthesis", "done", cached=True)
+        return context
     
     try:
-        with open(context["paths"]["fused"], 'r', encoding='utf-8') as f:
+        with open(cache.fetch(context["paths"]["fused"]), 'r', encoding='utf-8') as f:
             fused_data = json.load(f) 
     except Exception as e:
         log.error(f"[{processing_id}] Module 5: FAILED to read fused data. Error: {e}")
@@ -309,40 +803,27 @@ def synthesize_knowledge(context: dict):
         
     try:
         model = ChatGroq(
-            model_name="llama-3.1-8b-instant",
+            model_name=SYNTHESIS_MODEL,
             groq_api_key=api_key
         ) 
 
-        master_prompt = f"""
-        You are a technical analyst. You will receive a JSON object representing a video,
-        broken down into time chunks. Each chunk contains:
-        1. "spoken": The raw transcription (may contain errors).
-        2. "on_screen_text": A list of de-duplicated text *words* found by Tesseract.
-           (e.g., ["HOW", "NVIDIA", "AND", "OPEN", "AI"])
-        3. "visuals": A description of the on-screen action.
-
-        Your task is to synthesize this raw data into a clean, comprehensive markdown report.
-        Perform the following actions:
-        - Re-assemble the "on_screen_text" words into coherent sentences or labels.
-        - SUMMARIZE what is happening in each time chunk by combining the spoken
-          text, the (now re-assembled) on-screen text, AND the visual descriptions.
-        - Be structured and precise.
-
-        RAW DATA:
-        {json.dumps(fused_data, indent=2)}
-
-        ---
-        
-        FINAL SYNTHESIZED REPORT (Markdown Format):
-        """
-        
-        log.info(f"[{processing_id}] Sending data to Groq API (llama-3.1-8b-instant)...")
-        response = model.invoke(master_prompt)
-        
-        final_report = response.content
-        log.info(f"[{processing_id}] Received synthesis from Groq API.")
+        log.info(f"[{processing_id}] Sending data to Groq API ({SYNTHESIS_MODEL})...")
+        publish(context, "synthesis", "started")
+        with span("synthesis", context, chunks=len(fused_data)):
+            final_report, usage = synthesize(
+                model, fused_data, log_prefix=f"[{processing_id}]", budget=batch_tokens, prompt=report_prompt
+            )
+        synthesized = True
+
+        context.setdefault("stats", {})["synthesis"] = {
+            "llm_calls": len(usage),
+            "input_tokens": sum(u["input_tokens"] or 0 for u in usage),
+            "output_tokens": sum(u["output_tokens"] or 0 for u in usage),
+        }
+        log.info(f"[{processing_id}] Received synthesis from Groq API. {context['stats']['synthesis']}")
 
     except Exception as e:
+        synthesized = False
         log.error(f"[{processing_id}] Module 5: FAILED during Groq API call. Error: {e}")
         final_report = f"""
 # Video Analysis: {processing_id}
@@ -352,11 +833,17 @@ Dumping raw (but fused) JSON data instead:
 ```json
 {json.dumps(fused_data, indent=2, ensure_ascii=False)}
 """  # Re-raise the exception to notify the frontend raise e
-    output_path = os.path.join(PROCESSING_DIR, f"{processing_id}_final_report.md")
+    # The raw-data fallback is never cached, so a retry calls the LLM again
+    report_key = key if synthesized else None
+    output_path, output_ref = output_location(context, report_key, "final_report.md")
     with open(output_path, 'w', encoding='utf-8') as f:
         f.write(final_report)
+    publish_output(report_key, output_ref)
         
-    context["paths"]["final_report"] = output_path
+    context["paths"]["final_report"] = output_ref
+    save_job_context(context)
+    scheduling.release(context)
+    publish(context, "synthesis", "done", synthesized=synthesized)
     log.info(f"[{processing_id}] Module 5: COMPLETE. Final report saved to {output_path}")
     return context
 # --- KEY CHANGE ---
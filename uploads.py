@@ -0,0 +1,159 @@
+import os
+import re
+import uuid
+import hashlib
+from python_multipart.multipart import MultipartParser, parse_options_header
+
+
+class UploadError(Exception):
+    """The upload is malformed or not acceptable (maps to HTTP 400)."""
+
+
+class UploadTooLarge(UploadError):
+    """The upload exceeds the configured size limit (maps to HTTP 413)."""
+
+
+def new_job_id(filename: str) -> str:
+    """Collision-free job id that still shows which file it was: '<safe stem>-<random hex>'."""
+    stem = os.path.splitext(os.path.basename(filename or "video"))[0]
+    stem = re.sub(r"[^A-Za-z0-9_-]+", "_", stem).strip("_")[:40] or "video"
+    return f"{stem}-{uuid.uuid4().hex[:12]}"
+
+
+class StreamingUpload:
+    """
+    Parses a multipart/form-data body chunk by chunk and writes the file part straight
+    to its final location, hashing it (SHA-256) on the way. Nothing is spooled to a
+    temp file or held in memory beyond the chunk being processed.
+
+    Usage:
+        upload = StreamingUpload(content_type_header, upload_dir, max_bytes)
+        async for chunk in request.stream():
+            upload.feed(chunk)
+            await run_in_threadpool(upload.flush)   # disk write + hashing off the event loop
+        upload.finish()
+
+    Afterwards: upload.fields (small form fields, str), upload.file_field, upload.filename,
+    upload.path, upload.size, upload.sha256, upload.job_id.
+    """
+
+    FILE_FIELD = "video_file"
+    MAX_FIELD_BYTES = 64 * 1024
+
+    def __init__(self, content_type: str, upload_dir: str, max_bytes: int):
+        _, params = parse_options_header(content_type or "")
+        boundary = params.get(b"boundary")
+        if not boundary:
+            raise UploadError("Expected a multipart/form-data request.")
+
+        self.upload_dir = upload_dir
+        self.max_bytes = max_bytes
+        self.fields = {}
+        self.filename = None
+        self.job_id = None
+        self.path = None
+        self.size = 0
+        self.sha256 = None
+
+        self._hash = hashlib.sha256()
+        self._file = None
+        self._tmp_path = None
+        self._pending = []
+        self._headers = {}
+        self._header_field = b""
+        self._header_value = b""
+        self._part_name = None
+        self._part_is_file = False
+        self._field_value = b""
+
+        self._parser = MultipartParser(boundary, {
+            "on_part_begin": self._on_part_begin,
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end,
+        })
+
+    # --- Parser callbacks (synchronous, no I/O) ---
+    def _on_part_begin(self):
+        self._headers = {}
+        self._part_name = None
+        self._part_is_file = False
+        self._field_value = b""
+
+    def _on_header_field(self, data, start, end):
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data, start, end):
+        self._header_value += data[start:end]
+
+    def _on_header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = b""
+        self._header_value = b""
+
+    def _on_headers_finished(self):
+        _, disposition = parse_options_header(self._headers.get(b"content-disposition", b""))
+        self._part_name = disposition.get(b"name", b"").decode("utf-8", "replace")
+
+        if self._part_name != self.FILE_FIELD:
+            return
+        if self._file is not None:
+            raise UploadError(f"Only one '{self.FILE_FIELD}' may be uploaded.")
+
+        content_type = self._headers.get(b"content-type", b"").decode("latin-1")
+        if not content_type.startswith("video/"):
+            raise UploadError("Invalid file type. Please upload a video.")
+
+        self.filename = disposition.get(b"filename", b"video").decode("utf-8", "replace")
+        self.job_id = new_job_id(self.filename)
+        ext = os.path.splitext(self.filename)[1].lower()
+        self.path = os.path.join(self.upload_dir, f"{self.job_id}{ext}")
+        self._tmp_path = self.path + ".part"
+        self._file = open(self._tmp_path, "wb")
+        self._part_is_file = True
+
+    def _on_part_data(self, data, start, end):
+        if self._part_is_file:
+            self.size += end - start
+            if self.size > self.max_bytes:
+                raise UploadTooLarge(f"Upload exceeds the {self.max_bytes // 2**20} MB limit.")
+            self._pending.append(bytes(data[start:end]))
+        else:
+            self._field_value += data[start:end]
+            if len(self._field_value) > self.MAX_FIELD_BYTES:
+                raise UploadError(f"Form field '{self._part_name}' is too large.")
+
+    def _on_part_end(self):
+        if not self._part_is_file and self._part_name:
+            self.fields[self._part_name] = self._field_value.decode("utf-8", "replace")
+
+    # --- Driving the parser ---
+    def feed(self, chunk: bytes):
+        self._parser.write(chunk)
+
+    def flush(self):
+        """Writes and hashes the file data parsed so far. Blocking - run it in a thread."""
+        pending, self._pending = self._pending, []
+        for piece in pending:
+            self._hash.update(piece)
+            self._file.write(piece)
+
+    def finish(self):
+        """Completes parsing and moves the file into place. Call flush() before this."""
+        self._parser.finalize()
+        if self._file is None:
+            raise UploadError(f"No '{self.FILE_FIELD}' in the upload.")
+        self.flush()
+        self._file.close()
+        os.replace(self._tmp_path, self.path)
+        self.sha256 = self._hash.hexdigest()
+
+    def abort(self):
+        """Removes any partially written file."""
+        if self._file is not None and not self._file.closed:
+            self._file.close()
+        if self._tmp_path and os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
@@ -0,0 +1,171 @@
+import os
+import time
+import base64
+import random
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import httpx
+import metrics
+
+log = logging.getLogger(__name__)
+
+# --- Configuration ---
+# Point this at a local stub server to test without a real key or quota
+GEMINI_API_BASE = os.environ.get("CORTEX_GEMINI_API_BASE", "https://generativelanguage.googleapis.com")
+VISION_CONCURRENCY = int(os.environ.get("CORTEX_VISION_CONCURRENCY", 8))
+# Request rate per API key for the whole worker process, shared by every task using the key
+VISION_RATE_PER_MINUTE = float(os.environ.get("CORTEX_VISION_RATE_PER_MINUTE", 60))
+VISION_BURST = int(os.environ.get("CORTEX_VISION_BURST", 8))
+VISION_MAX_RETRIES = int(os.environ.get("CORTEX_VISION_MAX_RETRIES", 5))
+VISION_TIMEOUT_SECONDS = 60.0
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 60.0
+
+
+class VisionError(Exception):
+    """A vision request failed for good (non-retryable status, or out of retries)."""
+
+
+class TokenBucket:
+    """
+    Allows `rate_per_second` requests on average, with bursts of up to `capacity`.
+    Safe to share between threads and event loops: a caller takes its token up front
+    (the balance may go negative) and sleeps until the token would have been there.
+    """
+
+    def __init__(self, rate_per_second: float, capacity: int):
+        self.rate = rate_per_second
+        self.capacity = max(1, capacity)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Takes a token; returns how many seconds to wait before using it."""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return max(0.0, -self.tokens / self.rate)
+
+    async def acquire(self):
+        delay = self.reserve()
+        if delay:
+            await asyncio.sleep(delay)
+
+
+# One bucket per API key for the whole process: the io worker runs several vision tasks at
+# once (threads, each with its own event loop), and the quota belongs to the key.
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+def shared_bucket(api_key: str, rate_per_minute: float, burst: int) -> TokenBucket:
+    """The process-wide TokenBucket for `api_key` (created with these settings on first use)."""
+    with _buckets_lock:
+        if api_key not in _buckets:
+            _buckets[api_key] = TokenBucket(rate_per_minute / 60.0, burst)
+        return _buckets[api_key]
+
+
+class AsyncVisionClient:
+    """
+    Describes images with Gemini over its REST API, several requests in flight at once.
+
+    - at most `concurrency` requests in flight, started no faster than the token bucket allows
+    - 429 / 5xx responses and network errors are retried with exponential backoff and jitter
+      (honouring Retry-After), other errors fail that image only
+    """
+
+    def __init__(self, api_key: str, model: str, base_url: str = GEMINI_API_BASE,
+                 concurrency: int = VISION_CONCURRENCY, rate_per_minute: float = VISION_RATE_PER_MINUTE,
+                 burst: int = VISION_BURST, max_retries: int = VISION_MAX_RETRIES):
+        self.api_key = api_key
+        self.model = model
+        self.url = f"{base_url.rstrip('/')}/v1beta/models/{model}:generateContent"
+        self.concurrency = max(1, concurrency)
+        self.rate_per_minute = rate_per_minute
+        self.burst = burst
+        self.max_retries = max_retries
+
+    async def _describe(self, http: httpx.AsyncClient, bucket: TokenBucket, image_bytes: bytes, prompt: str) -> str:
+        body = {
+            "contents": [{
+                "parts": [
+                    {"text": prompt},
+                    {"inline_data": {"mime_type": "image/jpeg", "data": base64.b64encode(image_bytes).decode("ascii")}}
+                ]
+            }]
+        }
+
+        for attempt in range(self.max_retries + 1):
+            await bucket.acquire()
+            retry_after = None
+            started = time.perf_counter()
+            try:
+                response = await http.post(self.url, json=body, headers={"x-goog-api-key": self.api_key})
+            except httpx.TransportError as e:
+                error = f"{type(e).__name__}: {e}"
+                reason = type(e).__name__
+            else:
+                if response.status_code == 200:
+                    metrics.EXTERNAL_API_SECONDS.labels("gemini", "ok").observe(time.perf_counter() - started)
+                    parts = response.json()["candidates"][0]["content"]["parts"]
+                    return "".join(part.get("text", "") for part in parts).strip()
+                error = f"HTTP {response.status_code}: {response.text[:200]}"
+                reason = str(response.status_code)
+                if response.status_code not in RETRY_STATUSES:
+                    metrics.EXTERNAL_API_SECONDS.labels("gemini", "error").observe(time.perf_counter() - started)
+                    raise VisionError(error)
+                retry_after = response.headers.get("retry-after")
+            metrics.EXTERNAL_API_SECONDS.labels("gemini", "retryable").observe(time.perf_counter() - started)
+
+            if attempt == self.max_retries:
+                raise VisionError(f"Giving up after {attempt + 1} attempts. Last error: {error}")
+
+            delay = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt) * random.uniform(0.5, 1.0)
+            if retry_after and retry_after.replace(".", "", 1).isdigit():
+                delay = max(delay, float(retry_after))
+            log.warning(f"Vision request failed ({error}), retrying in {delay:.1f}s")
+            metrics.EXTERNAL_API_RETRIES.labels("gemini", reason).inc()
+            await asyncio.sleep(delay)
+
+    async def describe_many(self, images: list, prompt: str, on_result=None) -> list:
+        """
+        `images` is a list of (image_bytes or file path). Returns one entry per image, in order:
+        the description, or the exception that made that image fail.
+        `on_result(index, description_or_exception)` is called as each image finishes, on a
+        thread of its own and one call at a time: it may block (write a checkpoint, publish
+        progress) without holding up the requests in flight.
+        """
+        bucket = shared_bucket(self.api_key, self.rate_per_minute, self.burst)
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def run(index, image):
+            async with semaphore:
+                try:
+                    if isinstance(image, str):
+                        with open(image, "rb") as f:
+                            image = f.read()
+                    result = await self._describe(http, bucket, image, prompt)
+                except Exception as e:
+                    result = e
+            if on_result:
+                await asyncio.get_running_loop().run_in_executor(callbacks, on_result, index, result)
+            if isinstance(result, Exception):
+                raise result
+            return result
+
+        limits = httpx.Limits(max_connections=self.concurrency)
+        with ThreadPoolExecutor(max_workers=1) as callbacks:
+            async with httpx.AsyncClient(timeout=VISION_TIMEOUT_SECONDS, limits=limits) as http:
+                return await asyncio.gather(*(run(i, image) for i, image in enumerate(images)), return_exceptions=True)
+
+    def describe_many_sync(self, images: list, prompt: str, on_result=None) -> list:
+        """describe_many() for synchronous callers such as Celery tasks."""
+        return asyncio.run(self.describe_many(images, prompt, on_result))
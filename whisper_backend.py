@@ -0,0 +1,144 @@
+import os
+import time
+import logging
+import threading
+import psutil
+import metrics
+import torch
+import whisper
+from celery_app import CPU_THREADS_PER_TASK
+
+log = logging.getLogger(__name__)
+
+# --- Configuration ---
+WHISPER_MODEL_NAME = os.environ.get("CORTEX_WHISPER_MODEL", "tiny")
+# "openai" (openai-whisper, PyTorch) or "faster" (faster-whisper / CTranslate2, int8 on CPU)
+WHISPER_BACKEND = os.environ.get("CORTEX_WHISPER_BACKEND", "openai")
+WHISPER_COMPUTE_TYPE = os.environ.get("CORTEX_WHISPER_COMPUTE_TYPE", "int8")
+# Max memory one worker process may spend on the model (MB). 0 = no limit.
+WHISPER_MEMORY_BUDGET_MB = int(os.environ.get("CORTEX_WHISPER_MEMORY_MB", 0))
+# Load the model when the worker process starts instead of on the first task
+WHISPER_PRELOAD = os.environ.get("CORTEX_WHISPER_PRELOAD", "1") == "1"
+# Inference threads per process: the task's share of the cores (see celery_app.py)
+WHISPER_THREADS = int(os.environ.get("CORTEX_WHISPER_THREADS", CPU_THREADS_PER_TASK))
+
+# Approximate memory needed per model (MB), from the openai-whisper README.
+# Largest first: when the requested model doesn't fit the budget we step down this list.
+MODEL_FOOTPRINT_MB = {
+    "large": 10000,
+    "turbo": 6000,
+    "medium": 5000,
+    "small": 2000,
+    "base": 1000,
+    "tiny": 1000,
+}
+INT8_FOOTPRINT_FACTOR = 0.5
+
+# --- One shared instance per worker process ---
+_MODEL = None
+_LOCK = threading.Lock()
+MODEL_STATS = {}
+
+
+def _footprint_mb(name: str, backend: str) -> float:
+    base = name.split(".")[0].split("-")[0]
+    footprint = MODEL_FOOTPRINT_MB.get(base, MODEL_FOOTPRINT_MB["large"])
+    if backend == "faster" and WHISPER_COMPUTE_TYPE.startswith("int8"):
+        footprint *= INT8_FOOTPRINT_FACTOR
+    return footprint
+
+
+def choose_model(name: str, backend: str, budget_mb: int) -> str:
+    """Returns `name`, or the largest smaller model that fits `budget_mb`."""
+    if not budget_mb or _footprint_mb(name, backend) <= budget_mb:
+        return name
+
+    sizes = list(MODEL_FOOTPRINT_MB)
+    base = name.split(".")[0].split("-")[0]
+    for candidate in sizes[sizes.index(base) + 1 if base in sizes else 0:]:
+        if _footprint_mb(candidate, backend) <= budget_mb:
+            log.warning(f"Whisper model '{name}' exceeds the {budget_mb} MB budget, using '{candidate}' instead.")
+            return candidate
+
+    log.warning(f"No Whisper model fits the {budget_mb} MB budget, using 'tiny'.")
+    return "tiny"
+
+
+def _load(name: str, backend: str):
+    if backend == "faster":
+        try:
+            from faster_whisper import WhisperModel
+        except ImportError:
+            log.warning("CORTEX_WHISPER_BACKEND=faster but faster-whisper is not installed. Falling back to openai-whisper.")
+            torch.set_num_threads(WHISPER_THREADS)
+            return whisper.load_model(name), "openai"
+        return WhisperModel(name, device="cpu", compute_type=WHISPER_COMPUTE_TYPE, cpu_threads=WHISPER_THREADS), "faster"
+    torch.set_num_threads(WHISPER_THREADS)
+    return whisper.load_model(name), "openai"
+
+
+def get_model():
+    """Returns this process's Whisper model, loading it on first use."""
+    global _MODEL
+    if _MODEL is not None:
+        return _MODEL
+
+    with _LOCK:
+        if _MODEL is None:
+            name = choose_model(WHISPER_MODEL_NAME, WHISPER_BACKEND, WHISPER_MEMORY_BUDGET_MB)
+            process = psutil.Process()
+            rss_before = process.memory_info().rss
+
+            log.info(f"Loading Whisper model ({name}, backend={WHISPER_BACKEND})...")
+            started = time.perf_counter()
+            model, backend = _load(name, WHISPER_BACKEND)
+            load_seconds = time.perf_counter() - started
+
+            rss_after = process.memory_info().rss
+            MODEL_STATS.update({
+                "model": name,
+                "backend": backend,
+                "load_seconds": round(load_seconds, 3),
+                "model_memory_mb": round((rss_after - rss_before) / 2**20, 1),
+                "process_rss_mb": round(rss_after / 2**20, 1),
+            })
+            log.info(f"Whisper model loaded: {MODEL_STATS}")
+            metrics.WHISPER_LOAD_SECONDS.labels(name, backend).set(load_seconds)
+            metrics.WHISPER_MODEL_MEMORY_MB.labels(name, backend).set(MODEL_STATS["model_memory_mb"])
+            _MODEL = model
+    return _MODEL
+
+
+def transcribe(audio, **kwargs) -> dict:
+    """
+    Transcribes a file path or 16 kHz float32 array with the resident model.
+    Always returns the openai-whisper result layout: {"text", "segments", "language"}.
+    """
+    model = get_model()
+    if MODEL_STATS.get("backend") != "faster":
+        return model.transcribe(audio, **kwargs)
+
+    segments, info = model.transcribe(audio, **kwargs)
+    result = {"text": "", "segments": [], "language": info.language}
+    for seg in segments:
+        result["segments"].append({
+            "id": len(result["segments"]),
+            "start": seg.start,
+            "end": seg.end,
+            "text": seg.text,
+            "words": [
+                {"word": w.word, "start": w.start, "end": w.end, "probability": w.probability}
+                for w in (seg.words or [])
+            ]
+        })
+    result["text"] = "".join(seg["text"] for seg in result["segments"])
+    return result
+
+
+def warm_up(**_):
+    """Worker-startup hook (see tasks.py): load the model before the first task arrives."""
+    if WHISPER_PRELOAD:
+        try:
+            get_model()
+        except Exception as e:
+            log.error(f"Whisper warm-up failed, will retry on first task: {e}")